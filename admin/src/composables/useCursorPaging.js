@@ -0,0 +1,64 @@
+import { reactive, ref } from 'vue'
+
+// Cursor (keyset) paging for a server-paged DataTable.
+// The API returns next_cursor / prev_cursor with every page; the total is only
+// counted on the first page and kept while paging. Unfiltered listings may get
+// an approximate total; countExactly() asks the API for the exact one.
+export function useCursorPaging(pageSize = 20) {
+    const page = ref(1)
+    const total = ref(null)
+    const nextCursor = ref(null)
+    const prevCursor = ref(null)
+    const approximate = ref(false)
+    let cursor = null
+    let exact = false
+
+    // Request parameters of the current page
+    const params = () => ({
+        ...(cursor ? { cursor } : { page: 1 }),
+        page_size: pageSize,
+        ...(exact ? { exact_total: 1 } : {})
+    })
+
+    // Store the cursors (and total) of a page response
+    const update = (data) => {
+        nextCursor.value = data?.next_cursor || null
+        prevCursor.value = data?.prev_cursor || null
+        if (data?.total !== null && data?.total !== undefined) {
+            total.value = data.total
+            approximate.value = !!data.total_approximate
+            exact = false
+        }
+    }
+
+    const reset = () => {
+        cursor = null
+        page.value = 1
+        total.value = null
+        approximate.value = false
+        nextCursor.value = null
+        prevCursor.value = null
+    }
+
+    const next = () => {
+        if (!nextCursor.value) return false
+        cursor = nextCursor.value
+        page.value += 1
+        return true
+    }
+
+    const prev = () => {
+        if (!prevCursor.value) return false
+        cursor = prevCursor.value
+        page.value -= 1
+        return true
+    }
+
+    // Reload the current page with its exact total
+    const countExactly = () => {
+        exact = true
+        return true
+    }
+
+    return reactive({ page, total, approximate, nextCursor, prevCursor, params, update, reset, next, prev, countExactly })
+}
@@ -51,6 +51,12 @@ const routes = [
 		component: () => import('@/pages/VirtualAccounts.vue'),
 		meta: { requiresAuth: true, role: 'Admin' }
 	},
+	{
+		path: '/webhooks',
+		name: 'Webhooks',
+		component: () => import('@/pages/Webhooks.vue'),
+		meta: { requiresAuth: true, role: 'Admin' }
+	},
 	{
 		path: '/settings',
 		name: 'Settings',
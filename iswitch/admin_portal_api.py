@@ -3,8 +3,13 @@
 
 import frappe
 from frappe import _
+from frappe.utils import cint
 import json
 from datetime import datetime, timedelta
+from .auth_context import clear_all_contexts
+from .counts import get_total
+from .pagination import Page
+from .pricing import flatten, get_pricing_map
 
 def check_admin_permission():
     # role_profile = frappe.db.get_value("User", frappe.session.user, "role_profile_name")
@@ -28,18 +33,19 @@ def get_dashboard_stats():
         
         wallet_balance = wallet_data[0].total_balance if wallet_data and wallet_data[0].total_balance else 0
         
-        # Get global order statistics
+        # Get global order statistics from the all-time rollup rows (rollups.py)
         order_stats = frappe.db.sql("""
             SELECT 
-                COUNT(*) as total_orders,
-                SUM(CASE WHEN status = 'Processed' THEN 1 ELSE 0 END) as processed_orders,
-                SUM(CASE WHEN status IN ('Pending', 'Processing', 'Queued') THEN 1 ELSE 0 END) as pending_orders,
-                SUM(CASE WHEN status IN ('Cancelled', 'Reversed') THEN 1 ELSE 0 END) as cancelled_orders,
+                COALESCE(SUM(order_count), 0) as total_orders,
+                SUM(CASE WHEN status = 'Processed' THEN order_count ELSE 0 END) as processed_orders,
+                SUM(CASE WHEN status IN ('Pending', 'Processing', 'Queued') THEN order_count ELSE 0 END) as pending_orders,
+                SUM(CASE WHEN status IN ('Cancelled', 'Reversed') THEN order_count ELSE 0 END) as cancelled_orders,
                 SUM(CASE WHEN status = 'Processed' THEN COALESCE(order_amount, 0) ELSE 0 END) as total_processed_amount,
                 SUM(CASE WHEN status IN ('Pending', 'Processing', 'Queued') THEN COALESCE(order_amount, 0) ELSE 0 END) as total_pending_amount,
                 SUM(CASE WHEN status IN ('Cancelled', 'Reversed') THEN COALESCE(order_amount, 0) ELSE 0 END) as total_cancelled_amount,
                 SUM(COALESCE(order_amount, 0)) as total_orders_amount
-            FROM `tabOrder`
+            FROM `tabOrder Rollup`
+            WHERE day IS NULL
         """, as_dict=True)
         
         stats = order_stats[0] if order_stats else {}
@@ -82,8 +88,8 @@ def get_empty_stats():
     }
 
 @frappe.whitelist()
-def get_orders(filter_data=None, page=1, page_size=20, sort_by="creation", sort_order="desc"):
-    """Get paginated orders for ALL merchants"""
+def get_orders(filter_data=None, page=1, page_size=20, sort_by="creation", sort_order="desc", cursor=None, exact_total=0):
+    """Get paginated orders for ALL merchants (keyset pages through `cursor`)"""
     try:
         check_admin_permission()
         
@@ -115,19 +121,19 @@ def get_orders(filter_data=None, page=1, page_size=20, sort_by="creation", sort_
                 filter_conditions.append("o.merchant_ref_id = %(merchant_id)s")
                 filter_values["merchant_id"] = filters["merchant_id"]
 
-        where_clause = " AND ".join(filter_conditions)
+        listing = Page("o", page_size, cursor, page)
         
-        # Get total count
-        count_query = f"""
-            SELECT COUNT(*) as total
-            FROM `tabOrder` o
-            WHERE {where_clause}
-        """
-        total_result = frappe.db.sql(count_query, filter_values, as_dict=True)
-        total = total_result[0].total if total_result else 0
+        # Get total count (first load, or when asked for an exact total; cached in counts)
+        total, approximate = None, False
+        if not listing.uses_cursor or cint(exact_total):
+            total, approximate = get_total(
+                "Order", "o", filter_conditions, filter_values, exact=cint(exact_total)
+            )
+        
+        listing.apply(filter_conditions, filter_values)
+        where_clause = " AND ".join(filter_conditions)
         
         # Get paginated orders
-        start = (int(page) - 1) * int(page_size)
         orders_query = f"""
             SELECT 
                 o.name as id,
@@ -143,17 +149,20 @@ def get_orders(filter_data=None, page=1, page_size=20, sort_by="creation", sort_
             FROM `tabOrder` o
             LEFT JOIN `tabMerchant` m ON o.merchant_ref_id = m.name
             WHERE {where_clause}
-            ORDER BY o.{sort_by} {sort_order.upper()}
-            LIMIT {int(page_size)} OFFSET {start}
+            ORDER BY {listing.order(sort_by, sort_order)}
+            {listing.limit}
         """
         
         orders = frappe.db.sql(orders_query, filter_values, as_dict=True)
+        orders, cursors = listing.result(orders, creation_key="date", name_key="id")
         
         return {
             "orders": orders,
             "total": total,
+            "total_approximate": approximate,
             "page": int(page),
-            "page_size": int(page_size)
+            "page_size": listing.page_size,
+            **cursors
         }
     
     except Exception as e:
@@ -259,21 +268,10 @@ def get_merchants(page=1, page_size=20):
         # Get total count
         total = frappe.db.count("Merchant")
         
-        # Fetch child table data for each merchant
+        # Child table data for the whole page comes from the pricing engine in one pass
+        pricing = get_pricing_map([merchant.name for merchant in merchants])
         for merchant in merchants:
-            pricing = frappe.db.sql("""
-                SELECT 
-                    product,
-                    fee_type,
-                    fee,
-                    tax_fee_type,
-                    tax_fee,
-                    start_value,
-                    end_value
-                FROM `tabProduct Pricing`
-                WHERE parent = %s
-            """, (merchant.name,), as_dict=True)
-            merchant['product_pricing'] = pricing
+            merchant['product_pricing'] = flatten(pricing.get(merchant.name, {}))
             
         return {
             "merchants": merchants,
@@ -305,13 +303,9 @@ def get_processors():
         """, as_dict=True)
         
         # Get supported products/pricing for each processor
+        pricing = get_pricing_map([proc.name for proc in processors])
         for proc in processors:
-            pricing = frappe.db.sql("""
-                SELECT product
-                FROM `tabProduct Pricing`
-                WHERE parent = %s
-            """, (proc.name,), as_dict=True)
-            proc['products'] = [p.product for p in pricing]
+            proc['products'] = list(pricing.get(proc.name, {}))
             
         return {"processors": processors}
 
@@ -347,6 +341,8 @@ def toggle_service_status(service_name, is_active):
         check_admin_permission()
         
         frappe.db.set_value("Product", service_name, "is_active", 1 if is_active else 0)
+        # set_value skips doc events, so drop the cached auth contexts here
+        clear_all_contexts()
         frappe.db.commit()
         
         return {"success": True}
@@ -357,7 +353,7 @@ def toggle_service_status(service_name, is_active):
 
 @frappe.whitelist()
 def update_merchant(merchant, status, integration, webhook, pricing=None):
-    """Update merchant details, pricing, and register Webhook"""
+    """Update merchant details, pricing and webhook URL"""
     try:
         check_admin_permission()
         
@@ -365,37 +361,7 @@ def update_merchant(merchant, status, integration, webhook, pricing=None):
         doc.status = status
         doc.integration = integration
         
-        # Webhook Logic (Adapted from user snippet)
-        if webhook:
-            # Check if Webhook doctype exists for this merchant (using merchant email as name)
-            exists = frappe.db.exists("Webhook", merchant)
-            
-            webhook_json_structure = """{
-                "crn":"{{doc.order}}",
-                "utr":"{{doc.transaction_reference_id}}",
-                "status": "{{doc.status}}",
-                "clientRefID": "{{doc.client_ref_id}}"
-            }"""
-            
-            if not exists:
-                frappe.get_doc({
-                    'doctype': 'Webhook',
-                    '__newname': merchant,
-                    'webhook_doctype': 'Transaction',
-                    'webhook_docevent': 'on_submit',
-                    'condition': f"(doc.merchant == '{merchant}') and (doc.status in ['Success', 'Failed', 'Reversed'])",
-                    'request_url': webhook,
-                    'request_method': 'POST',
-                    'request_structure': 'JSON',
-                    'background_jobs_queue': 'long',
-                    'webhook_json': webhook_json_structure
-                }).insert()
-            elif doc.webhook != webhook:
-                # Update existing webhook if URL changed
-                webhook_doc = frappe.get_doc("Webhook", merchant)
-                webhook_doc.request_url = webhook
-                webhook_doc.save()
-        
+        # merchant_webhooks delivers to Merchant.webhook
         doc.webhook = webhook
         
         # Update pricing child table
@@ -421,6 +387,8 @@ def update_merchant(merchant, status, integration, webhook, pricing=None):
         return {"success": True}
 
     except Exception as e:
+        # Drop whatever a rejected save (e.g. invalid pricing slabs) wrote
+        frappe.db.rollback()
         frappe.log_error(f"Error in update_merchant: {str(e)}", "Admin Portal API")
         return {"success": False, "error": str(e)}
 
@@ -453,8 +421,8 @@ def bulk_update_merchants(merchants, action, value):
         return {"success": False, "error": str(e)}
 
 @frappe.whitelist()
-def get_van_logs(filter_data=None, page=1, page_size=20):
-    """Get Virtual Account Network logs for ALL merchants"""
+def get_van_logs(filter_data=None, page=1, page_size=20, cursor=None, exact_total=0):
+    """Get Virtual Account Network logs for ALL merchants (keyset pages through `cursor`)"""
     try:
         check_admin_permission()
         
@@ -480,17 +448,18 @@ def get_van_logs(filter_data=None, page=1, page_size=20):
                 filter_conditions.append("v.creation <= %(to_date)s")
                 filter_values["to_date"] = clean_to
         
-        where_clause = " AND ".join(filter_conditions)
+        listing = Page("v", page_size, cursor, page)
         
-        count_query = f"""
-            SELECT COUNT(*) as total
-            FROM `tabVirtual Account Logs` v
-            WHERE {where_clause}
-        """
-        total_result = frappe.db.sql(count_query, filter_values, as_dict=True)
-        total = total_result[0].total if total_result else 0
+        # Get total count (first load, or when asked for an exact total; cached in counts)
+        total, approximate = None, False
+        if not listing.uses_cursor or cint(exact_total):
+            total, approximate = get_total(
+                "Virtual Account Logs", "v", filter_conditions, filter_values, exact=cint(exact_total)
+            )
+        
+        listing.apply(filter_conditions, filter_values)
+        where_clause = " AND ".join(filter_conditions)
         
-        start = (int(page) - 1) * int(page_size)
         logs_query = f"""
             SELECT 
                 v.name as id,
@@ -510,17 +479,20 @@ def get_van_logs(filter_data=None, page=1, page_size=20):
             FROM `tabVirtual Account Logs` v
             LEFT JOIN `tabMerchant` m ON v.owner = m.company_email
             WHERE {where_clause}
-            ORDER BY v.creation DESC
-            LIMIT {int(page_size)} OFFSET {start}
+            ORDER BY {listing.order_by}
+            {listing.limit}
         """
         
         logs = frappe.db.sql(logs_query, filter_values, as_dict=True)
+        logs, cursors = listing.result(logs, creation_key="date", name_key="id")
         
         return {
             "logs": logs,
             "total": total,
+            "total_approximate": approximate,
             "page": int(page),
-            "page_size": int(page_size)
+            "page_size": listing.page_size,
+            **cursors
         }
     
     except Exception as e:
@@ -0,0 +1,228 @@
+import hashlib
+import zlib
+from collections import defaultdict
+
+import frappe
+from frappe.utils import add_to_date, cint, get_datetime, now, now_datetime
+
+# Order analytics
+# Hourly buckets per (merchant, integration, product) with the order count,
+# amount, fee and tax of the orders created in the hour and how many of them
+# settled (Processed) or failed (Cancelled / Reversed). Orders count in the hour
+# they were created, so a bucket's success rate is that of its cohort.
+#
+# Buckets are fed with the same changes as the dashboard rollups (rollups.py):
+# an insert adds the order to its bucket, a transition moves it between the
+# success / failure counters. Nothing is recomputed from tabOrder except by
+# rebuild_buckets (backfill and rollup repair).
+#
+# get_order_analytics reads a range for the admin charts, downsampled to hours,
+# days or weeks so a chart never gets more than MAX_POINTS points.
+
+BUCKET_FORMAT = "%Y-%m-%d %H:00:00"
+
+SHARDS = 8
+MAX_POINTS = 500
+MAX_SERIES = 8
+DEFAULT_RANGE_DAYS = 7
+
+SUCCESS = ("Processed",)
+FAILURE = ("Cancelled", "Reversed")
+
+SUMS = ("order_count", "order_amount", "fee", "tax", "success_count", "success_amount", "failure_count")
+
+# Bucket start of each chart interval
+INTERVALS = {
+    "hour": "bucket",
+    "day": "DATE(bucket)",
+    "week": "DATE_SUB(DATE(bucket), INTERVAL WEEKDAY(bucket) DAY)"
+}
+INTERVAL_SECONDS = {"hour": 3600, "day": 86400, "week": 604800}
+
+DIMENSIONS = {
+    "merchant": "merchant",
+    "integration": "integration",
+    "product": "product"
+}
+
+
+def new_deltas():
+    return defaultdict(lambda: [0, 0.0, 0.0, 0.0, 0, 0.0, 0])
+
+
+def add_order(deltas, order, status, sign, created=False):
+    """
+    Add an order in a status to bucket deltas; created also counts the order itself
+    """
+    if not order.merchant_ref_id:
+        return
+
+    amount = float(order.order_amount or 0)
+    key = (
+        get_datetime(order.creation).strftime(BUCKET_FORMAT), order.merchant_ref_id,
+        order.integration_id or "", order.product or "", zlib.crc32(order.name.encode()) % SHARDS
+    )
+    row = deltas[key]
+    if created:
+        row[0] += sign
+        row[1] += sign * amount
+        row[2] += sign * float(order.fee or 0)
+        row[3] += sign * float(order.tax or 0)
+    if status in SUCCESS:
+        row[4] += sign
+        row[5] += sign * amount
+    elif status in FAILURE:
+        row[6] += sign
+
+
+def write(deltas):
+    """
+    Add deltas to their buckets
+    """
+    rows = [
+        (_bucket_name(key), *key, *sums)
+        for key, sums in deltas.items()
+        if any(sums)
+    ]
+    if not rows:
+        return
+
+    # Same lock order in every transaction
+    rows.sort(key=lambda row: row[0])
+
+    timestamp = now()
+    user = frappe.session.user
+    columns = ("name", "creation", "modified", "owner", "modified_by",
+        "bucket", "merchant", "integration", "product", "shard") + SUMS
+    placeholders = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    updates = ", ".join([f"`{field}` = `{field}` + VALUES(`{field}`)" for field in SUMS] + ["`modified` = VALUES(`modified`)"])
+
+    frappe.db.sql(f"""
+        INSERT INTO `tabOrder Analytics Bucket` ({", ".join(f"`{column}`" for column in columns)})
+        VALUES {", ".join([placeholders] * len(rows))}
+        ON DUPLICATE KEY UPDATE {updates}
+    """, [value for row in rows for value in (row[0], timestamp, timestamp, user, user, *row[1:])])
+
+
+def rebuild_buckets(merchant):
+    """
+    Recompute the buckets of a merchant from tabOrder (in the caller's transaction)
+    """
+    frappe.db.sql("DELETE FROM `tabOrder Analytics Bucket` WHERE merchant = %s", merchant)
+    hours = frappe.db.sql("""
+        SELECT DATE_FORMAT(creation, '%%Y-%%m-%%d %%H:00:00') AS bucket,
+            COALESCE(integration_id, '') AS integration, COALESCE(product, '') AS product,
+            COUNT(*) AS order_count,
+            SUM(COALESCE(order_amount, 0)) AS order_amount,
+            SUM(COALESCE(fee, 0)) AS fee,
+            SUM(COALESCE(tax, 0)) AS tax,
+            SUM(CASE WHEN status IN %(success)s THEN 1 ELSE 0 END) AS success_count,
+            SUM(CASE WHEN status IN %(success)s THEN COALESCE(order_amount, 0) ELSE 0 END) AS success_amount,
+            SUM(CASE WHEN status IN %(failure)s THEN 1 ELSE 0 END) AS failure_count
+        FROM `tabOrder`
+        WHERE merchant_ref_id = %(merchant)s
+        GROUP BY 1, 2, 3
+        LOCK IN SHARE MODE
+    """, {"merchant": merchant, "success": SUCCESS, "failure": FAILURE}, as_dict=True)
+
+    deltas = new_deltas()
+    for row in hours:
+        deltas[(row.bucket, merchant, row.integration, row.product, 0)] = [float(row[field] or 0) for field in SUMS]
+    write(deltas)
+
+
+@frappe.whitelist()
+def get_order_analytics(from_date=None, to_date=None, days=None, interval="auto", group_by=None,
+        merchant=None, integration=None, product=None):
+    """
+    Order volume and success rate over a range (from_date / to_date, or the last
+    days), per interval and optionally per merchant, integration or product
+    (the largest MAX_SERIES, the rest as Other)
+    """
+    from .admin_portal_api import check_admin_permission
+
+    check_admin_permission()
+
+    to_date = get_datetime(to_date) if to_date else now_datetime()
+    from_date = get_datetime(from_date) if from_date else add_to_date(to_date, days=-(cint(days) or DEFAULT_RANGE_DAYS))
+    if from_date >= to_date:
+        frappe.throw("from_date must be before to_date")
+
+    interval = _pick_interval(interval, from_date, to_date)
+    if group_by and group_by not in DIMENSIONS:
+        frappe.throw(f"group_by must be one of {', '.join(DIMENSIONS)}")
+
+    conditions = ["bucket >= %(from_date)s", "bucket < %(to_date)s"]
+    values = {"from_date": from_date.strftime(BUCKET_FORMAT), "to_date": to_date}
+    for field, value in (("merchant", merchant), ("integration", integration), ("product", product)):
+        if value:
+            conditions.append(f"{field} = %({field})s")
+            values[field] = value
+
+    rows = frappe.db.sql(f"""
+        SELECT {INTERVALS[interval]} AS period,
+            {DIMENSIONS[group_by] if group_by else "''"} AS series,
+            {", ".join(f"SUM({field}) AS {field}" for field in SUMS)}
+        FROM `tabOrder Analytics Bucket`
+        WHERE {" AND ".join(conditions)}
+        GROUP BY 1, 2
+        ORDER BY 1
+    """, values, as_dict=True)
+
+    return {
+        "from_date": from_date,
+        "to_date": to_date,
+        "interval": interval,
+        "group_by": group_by,
+        "series": _series(rows, group_by)
+    }
+
+
+def _pick_interval(interval, from_date, to_date):
+    span = (to_date - from_date).total_seconds()
+    if interval == "auto":
+        for name, seconds in INTERVAL_SECONDS.items():
+            if span / seconds <= MAX_POINTS:
+                return name
+        return "week"
+
+    if interval not in INTERVALS:
+        frappe.throw(f"interval must be auto or one of {', '.join(INTERVALS)}")
+    if span / INTERVAL_SECONDS[interval] > MAX_POINTS * 4:
+        frappe.throw(f"Range too long for {interval} points")
+    return interval
+
+
+def _series(rows, group_by):
+    """
+    {series: [points]}, keeping the MAX_SERIES largest series and folding the rest into Other
+    """
+    volume = defaultdict(float)
+    for row in rows:
+        volume[row.series] += float(row.order_count or 0)
+    keep = set(sorted(volume, key=volume.get, reverse=True)[:MAX_SERIES])
+
+    points = defaultdict(dict)
+    for row in rows:
+        name = (row.series or "Unknown") if row.series in keep else "Other"
+        name = name if group_by else "All"
+        point = points[name].setdefault(str(row.period), {field: 0 for field in SUMS})
+        for field in SUMS:
+            point[field] += float(row[field] or 0)
+
+    series = {}
+    for name, periods in points.items():
+        series[name] = []
+        for period, point in sorted(periods.items()):
+            settled = point["success_count"] + point["failure_count"]
+            point["order_count"] = cint(point["order_count"])
+            point["success_count"] = cint(point["success_count"])
+            point["failure_count"] = cint(point["failure_count"])
+            point["success_rate"] = round(point["success_count"] * 100 / settled, 2) if settled else None
+            series[name].append({"period": period, **point})
+    return series
+
+
+def _bucket_name(key):
+    # Merchant, integration and product names can outgrow the 140 characters of a name
+    return hashlib.sha1("|".join(str(part) for part in key).encode()).hexdigest()[:20]
@@ -6,44 +6,17 @@ import jwt
 from datetime import datetime as dt, timedelta as td
 import hashlib
 import uuid
-
-def handle_transaction_failure(name, status, error_message, transaction_id):
-    """
-    Common function to handle transaction failures and refund wallet
-    """
-    try:
-
-        doc = frappe.get_doc("Order", name)
-
-        wallet_row = frappe.db.sql("""
-            SELECT balance FROM `tabWallet`
-            WHERE name = %s FOR UPDATE
-        """, (doc.merchant_ref_id,), as_dict=True)
-
-        frappe.set_user(doc.merchant_ref_id)
-        balance = float(wallet_row[0]["balance"]) or 0.0
-        # Apply balance change safely
-        new_balance = float(wallet_row[0]["balance"]) + float(doc.transaction_amount)
-
-        frappe.db.sql("""
-            UPDATE `tabWallet`
-            SET balance = %s
-            WHERE name = %s
-        """, (new_balance, doc.merchant_ref_id))
-        
-        doc.status = status
-        doc.cancellation_reason = error_message[:100]
-        doc.cancelled_at = frappe.utils.now()
-        doc.save(ignore_permissions=True)
-
-        frappe.db.commit()
-
-    except Exception as refund_error: 
-        frappe.db.rollback(save_point = "update_record")
-        frappe.log_error("Error",refund_error)
-
+from .audit_log import start_request_log, log_response
+from .idempotency import get_replay, claim_request, release_request, remember_response, IN_PROGRESS_RESPONSE
+from .auth_context import get_auth_context, is_ip_allowed, find_pricing
+from .routing import choose_integration
+from .pricing import get_pricing_rows
+from .wallet_service import hold_funds, capture_hold, release_hold
+from .order_state import complete, fail
+from .tracing import span, traced
 
 @frappe.whitelist()
+@traced("create_order")
 def create_order():
     data = frappe.request.get_json()
 
@@ -56,12 +29,7 @@ def create_order():
     
     auth_header = frappe.get_request_header("Authorization")
 
-    request_response = frappe.get_doc({
-        "doctype":"Request Response",
-        "request": data,
-        "header": auth_header,
-        "user": user_id
-    }).insert(ignore_permissions=True)
+    request_response = start_request_log(request=data, header=auth_header, user=user_id)
 
     if not auth_header or not auth_header.lower().startswith("token "):
         response = {
@@ -69,9 +37,7 @@ def create_order():
             "status": "MISSING_HEADER",
             "message": "Authorization header is missing."
         }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
         return response
     try:
         # Split token and extract parts
@@ -82,77 +48,72 @@ def create_order():
         response = {
             "Error in token format. Please verify and try again."
         }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
 
         return response
         
-    user_id = frappe.db.get_value("User", {"api_key": api_key},'email')
+    with span("create_order", "auth"):
+        context = get_auth_context(api_key)
+    user_id = context.user if context else None
 
     frappe.set_user(user_id)
 
-    if not frappe.db.exists("Whitelist IP",{'merchant':user_id,'whitelisted_ip':ip_address}):
+    if not is_ip_allowed(context, ip_address):
         response = {
             "code": "0x0401",
             "status": "UNAUTHORIZED ACCESS", 
             "message": f"Originating IP {ip_address} is blocked by central firewall system. This incident will be reported."
         }
 
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
 
         return response
 
-    if user_id == "Guest":
+    if user_id == "Guest" or not context.merchant:
         response = {
             "code": "0x0401",
             "status": "UNAUTHORIZED", 
             "message": "Authentication required"
         }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
         return response
 
-    merchant = frappe.get_doc("Merchant", user_id)
-    if merchant.status != "Approved":
+    if context.merchant_status != "Approved":
         response =  {
             "code": "0x0404",
             "status": "VALIDATION_ERROR",
             "message": "Validation failed",
-            "data": f"Your Account is in {merchant.status} stage. Please contact Admin"
+            "data": f"Your Account is in {context.merchant_status} stage. Please contact Admin"
         }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
         return response 
 
-    if not merchant.integration:
+    if not context.integration:
         response =  {
             "code": "0x0404",
             "status": "VALIDATION_ERROR",
             "message": "Validation failed",
             "data": "Processor isn't configured yet to process your order. Please try after sometime."
         }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
         return response
 
-    wallet = frappe.get_doc("Wallet", merchant.name)
-    if wallet.status != "Active":
+    if context.wallet_status != "Active":
         response = {
                 "code": "0x0404",
                 "status": "VALIDATION_ERROR",
                 "message": "Validation failed",
-                "data": f"Your Wallet is {wallet.status}. Please contact Admin"
+                "data": f"Your Wallet is {context.wallet_status}. Please contact Admin"
             }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
         return response
+
+    # Retries of an already processed clientRefId get the first response back
+    with span("create_order", "idempotency"):
+        replay = get_replay(context.merchant, data.get("clientRefId"))
+    if replay:
+        log_response(request_response, replay)
+        return replay
     
     if "mode" not in data:
         response = {
@@ -160,13 +121,10 @@ def create_order():
             "status": "MISSING_PARAMETER",
             "message": "mode is required"
         }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
         return response
 
-    product = frappe.db.exists("Product", {"product_name": data["mode"].upper(), "is_active":1})
-    if not product:
+    if data["mode"].upper() not in context.products:
         response = {
             "code": "0x0500",
             "status": "SERVER_DOWN",
@@ -176,50 +134,49 @@ def create_order():
                 ] 
             }
         }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
         return response
 
     order_amount = float(data["amount"])
 
-    product_pricing = frappe.db.sql("""
-        SELECT tax_fee_type, tax_fee, fee_type, fee
-        FROM `tabProduct Pricing`
-        WHERE parent = %s AND product = %s
-        AND %s >= start_value AND %s <= end_value
-    """, (merchant.name, data["mode"].upper(), order_amount, order_amount), as_dict=True)
+    with span("create_order", "pricing"):
+        pricing = find_pricing(context, data["mode"].upper(), order_amount)
     
-    if not product_pricing:
+    if not pricing:
         response = {
             "code": "0x0404",
             "status": "VALIDATION_ERROR",
             "message": "Validation failed",
             "data": "This payment mode or transaction limit is not active for you. Please contact Admin"
         }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
         return response
 
-    processor = frappe.get_doc("Integration", merchant.integration)
+    # Primary processor, or the secondary while the primary is failing
+    with span("create_order", "routing"):
+        route = choose_integration(context, data["mode"].upper(), order_amount)
 
-    mode_verification = frappe.db.sql("""
-        SELECT tax_fee_type, tax_fee, fee_type, fee
-        FROM `tabProduct Pricing`
-        WHERE parent = %s AND product = %s
-    """, (processor.name, data["mode"].upper()), as_dict=True)
-
-    if not mode_verification:
+    if not route:
         response = {
             "code": "0x0404",
             "status": "VALIDATION_ERROR",
             "message": "Validation failed",
             "data": "This payment mode is not active for now. Please contact Admin"
         }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
+        return response
+
+    if not route.integration:
+        response = {
+            "code": "0x0500",
+            "status": "SERVER_DOWN",
+            "message": {
+                f"{data['mode']}": [
+                    f"{data['mode']} payment mode is down. Please try again after sometime."
+                ]
+            }
+        }
+        log_response(request_response, response)
         return response
 
     # frappe.log_error("User",user_id)
@@ -227,6 +184,7 @@ def create_order():
     if data.get("mode","").upper() == "UPI":
         fields = ["customer_name", "customer_email", "customer_phone", "amount", "vpa", "clientRefId"]
 
+    held = None
     frappe.db.savepoint("start_transaction") 
     try:
         
@@ -240,26 +198,11 @@ def create_order():
                     "message": {f"{field}": [f"{field} is missing."]}
                 }
                 # request_response = frappe.get_doc("Request Response", request_response.name)
-                request_response.response = json.dumps(response)
-                request_response.submit()
+                log_response(request_response, response)
                 return response
 
-        # Check duplicate client ref id
-        existing_order = frappe.db.exists("Order", {"client_ref_id": data["clientRefId"]})
-        if existing_order:
-            frappe.db.rollback(save_point = "start_transaction")
-            response = {
-                "code": "0x0203",
-                "status": "MISSING_PARAMETER",
-                "message": {"clientRefId": ["Client Ref Id already exists."]}
-            }
-            # request_response = frappe.get_doc("Request Response", request_response.name)
-            request_response.response = json.dumps(response)
-            request_response.submit()
-            return response
 
         # Calculate fees and total amount
-        processor = frappe.get_doc("Integration", merchant.integration)
         api_data = {}
         # if data.get("mode", "").upper() == "UPI":
         #     headers = {
@@ -324,7 +267,6 @@ def create_order():
                 
         #         return response
             
-        pricing = product_pricing[0]
         fee = float(pricing.get("fee", 0))
         tax = 0
 
@@ -336,27 +278,18 @@ def create_order():
 
         total_amount = order_amount + fee + tax
 
-        wallet_row = frappe.db.sql("""
-            SELECT balance FROM `tabWallet`
-            WHERE name = %s FOR UPDATE
-        """, (merchant.name,), as_dict=True)
-        
-        if not wallet_row:
+        if not claim_request(context.merchant, data["clientRefId"]):
             frappe.db.rollback(save_point = "start_transaction")
-            response = {
-                "code": "0x0404",
-                "status": "VALIDATION_ERROR",
-                "message": "Validation failed",
-                "data": "No active wallet found"
-            }
-            request_response = frappe.get_doc("Request Response", request_response.name)
-            request_response.response = json.dumps(response)
-            request_response.submit()
-            return response
-            
-        balance = float(wallet_row[0].balance) or 0.0
+            log_response(request_response, IN_PROGRESS_RESPONSE)
+            return IN_PROGRESS_RESPONSE
+
+        # Reserve the funds; the hold commits so the wallet row is not locked
+        # while the order documents are created
+        with span("create_order", "wallet_hold"):
+            held = hold_funds(context.merchant, total_amount, data["clientRefId"])
 
-        if balance < total_amount:
+        if not held:
+            release_request(context.merchant, data["clientRefId"])
             frappe.db.rollback(save_point = "start_transaction")
             response = {
                 "code": "0x0404",
@@ -364,18 +297,12 @@ def create_order():
                 "message": "Validation failed",
                 "data": "Insufficient wallet balance"
             }
-            request_response = frappe.get_doc("Request Response", request_response.name)
-            request_response.response = json.dumps(response)
-            request_response.submit()
+            if not frappe.db.exists("Wallet", context.merchant):
+                response["data"] = "No active wallet found"
+            log_response(request_response, response)
             return response
 
-        new_balance = balance - total_amount
-
-        frappe.db.sql("""
-            UPDATE `tabWallet`
-            SET balance = %s
-            WHERE name = %s
-        """, (new_balance, merchant.name))
+        frappe.db.savepoint("start_transaction")
 
         # CREATE ORDER
         order = None
@@ -389,15 +316,16 @@ def create_order():
                 "order_amount": order_amount,
                 "purpose": data["purpose"],
                 "product": data["mode"].upper(),
-                "merchant_ref_id": merchant.name,
+                "merchant_ref_id": context.merchant,
                 "narration": data.get("narration", ""),
                 "remark": data.get("remark", ""),
                 "client_ref_id": data["clientRefId"],
-                "integration_id": processor.name,
+                "routing_decision": route.decision,
+                "integration_id": route.integration,
                 "tax": tax,
                 "fee": fee,
                 "transaction_amount": total_amount
-            }).insert(ignore_permissions=True)
+            })
         else:
             order = frappe.get_doc({
                 "doctype": "Order",
@@ -405,44 +333,55 @@ def create_order():
                 "order_amount": order_amount,
                 "purpose": data["purpose"],
                 "product": "UPI",
-                "merchant_ref_id": merchant.name,
-                "integration_id": merchant.integration,
+                "merchant_ref_id": context.merchant,
+                "integration_id": route.integration,
                 "remark": data.get("remark", ""),
                 "client_ref_id": data["clientRefId"],
-                "integration_id": processor.name,
+                "routing_decision": route.decision,
+                "integration_id": route.integration,
                 "vpa": data.get("vpa",""),
                 "tax": tax,
                 "fee": fee,
                 "transaction_amount": total_amount
-            }).insert(ignore_permissions=True)
+            })
+
+        # The naming series row is locked until commit
+        with span("create_order", "naming"):
+            order.set_new_name()
+        with span("create_order", "order_insert"):
+            order.insert(ignore_permissions=True)
 
         # CREATE TRANSACTION
-        transaction = frappe.get_doc({
-            "doctype": 'Transaction',
-            "order": order.name,
-            "merchant": order.merchant_ref_id,
-            "amount": order.order_amount,
-            "integration": order.integration_id,
-            "status": "Processing",
-            "product": order.product,
-            "transaction_date": frappe.utils.now()
-        }).insert(ignore_permissions=True)
-
-        ledger = frappe.get_doc({
-            "doctype": 'Ledger',
-            "order": order.name,
-            "transaction_type": 'Debit',
-            'status': 'Success',
-            'client_ref_id': order.client_ref_id,
-            'transaction_id': transaction.name,
-            'opening_balance': balance,
-            'closing_balance': new_balance
-        }).insert(ignore_permissions=True)
-        ledger.submit()
+        with span("create_order", "transaction_insert"):
+            transaction = frappe.get_doc({
+                "doctype": 'Transaction',
+                "order": order.name,
+                "merchant": order.merchant_ref_id,
+                "amount": order.order_amount,
+                "integration": order.integration_id,
+                "status": "Processing",
+                "product": order.product,
+                "transaction_date": frappe.utils.now()
+            }).insert(ignore_permissions=True)
+
+        with span("create_order", "ledger_submit"):
+            ledger = frappe.get_doc({
+                "doctype": 'Ledger',
+                "order": order.name,
+                "transaction_type": 'Debit',
+                'status': 'Success',
+                'client_ref_id': order.client_ref_id,
+                'transaction_id': transaction.name,
+                'opening_balance': held.opening_balance,
+                'closing_balance': held.closing_balance
+            }).insert(ignore_permissions=True)
+            ledger.submit()
+
+        with span("create_order", "capture_hold"):
+            capture_hold(held.hold, order.name)
 
         # FOR NON-UPI: Commit and return success
         if data.get("mode", "").upper() != "UPI":
-            frappe.db.commit()
             response = {
                 "code": "0x0200",
                 "message": "Order accepted successfully",
@@ -453,12 +392,13 @@ def create_order():
                     "status": order.status
                 }
             }
+            remember_response(order, response)
+            with span("create_order", "commit"):
+                frappe.db.commit()
             #request_response = frappe.get_doc("Request Response", request_response.name)
-            request_response.response = json.dumps(response)
-            request_response.submit()
+            log_response(request_response, response)
             return response
 
-        # FOR UPI: Make API call within same transaction
         else:            
             response = {
                 "code": "0x0200",
@@ -470,13 +410,15 @@ def create_order():
                     "status": order.status
                 }
             }
-            request_response = frappe.get_doc("Request Response", request_response.name)
-            request_response.response = json.dumps(response)
-            request_response.submit()
+            remember_response(order, response)
+            log_response(request_response, response)
             return response
 
     except frappe.ValidationError as e:
         frappe.db.rollback(save_point = "start_transaction")
+        if held:
+            release_hold(held.hold)
+            release_request(context.merchant, data["clientRefId"])
         response = {
             "code": "0x0400",
             "status": "VALIDATION_ERROR", 
@@ -484,13 +426,15 @@ def create_order():
             "data": str(e)
         }
         #request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
         
         return response
         
     except Exception as e:
         frappe.db.rollback(save_point = "start_transaction")
+        if held:
+            release_hold(held.hold)
+            release_request(context.merchant, data["clientRefId"])
         frappe.log_error("Order Creation Error", frappe.get_traceback())
         response = {
             "code": "0x0500",
@@ -499,8 +443,7 @@ def create_order():
             "data": str(e)
         }
         #request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
         return response
 
 def get_hash_string(payload, secret_key):
@@ -543,14 +486,10 @@ def get_order_status():
             "Error in token format. Please verify and try again."
         }
 
-    user_id = frappe.db.get_value("User", {"api_key": api_key},'email')
+    context = get_auth_context(api_key)
+    user_id = context.user if context else None
     # frappe.log_error("User",user_id)
-    request_response = frappe.get_doc({
-        "doctype":"Request Response",
-        "request": data,
-        "header": auth_header,
-        "user": user_id
-    }).insert(ignore_permissions=True)
+    request_response = start_request_log(request=data, header=auth_header, user=user_id)
     
     if not data.get('orderRefId') and not data.get('clientRefId'):
         response = {
@@ -558,9 +497,7 @@ def get_order_status():
             "status": "MISSING_PARAMETER",
             "message": "Either orderRefId or clientRefId is required"
         }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
 
         return response
     
@@ -593,9 +530,7 @@ def get_order_status():
                 "status": order.status
             }
         }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
 
         return response
         
@@ -605,9 +540,7 @@ def get_order_status():
             "status": "NOT_FOUND",
             "message": "Order not found"
         }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
         return response
 
     except Exception as e:
@@ -617,9 +550,7 @@ def get_order_status():
             "message": "Error fetching order status",
             "data": str(e)
         }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
         return response
     pass
 
@@ -666,35 +597,27 @@ def get_wallet_balance():
                 "Error in token format. Please verify and try again."
             }
 
-        user_id = frappe.db.get_value("User", {"api_key": api_key},'email')
-        request_response = frappe.get_doc({
-            "doctype":"Request Response",
-            "header": auth_header,
-            "user": user_id
-        }).insert(ignore_permissions=True)
+        context = get_auth_context(api_key)
+        user_id = context.user if context else None
+        request_response = start_request_log(header=auth_header, user=user_id)
 
-        if not frappe.db.exists("Whitelist IP",{'merchant':user_id,'whitelisted_ip':ip_address}):
+        if not is_ip_allowed(context, ip_address):
             response = {
                 "code": "0x0401",
                 "status": "UNAUTHORIZED ACCESS", 
                 "message": f"Originating IP {ip_address} is blocked by central firewall system. This incident will be reported."
             }
-            request_response = frappe.get_doc("Request Response", request_response.name)
-            request_response.response = json.dumps(response)
-            request_response.submit()
+            log_response(request_response, response)
             return response
 
-        merchant = frappe.get_doc("Merchant", user_id)
-        if merchant.status != "Approved":
+        if context.merchant_status != "Approved":
             response = {
                 "code": "0x0404",
                 "status": "VALIDATION_ERROR",
                 "message": "Validation failed",
-                "data": f"Your Account is in {merchant.status} stage. Please contact Admin"
+                "data": f"Your Account is in {context.merchant_status} stage. Please contact Admin"
             }
-            request_response = frappe.get_doc("Request Response", request_response.name)
-            request_response.response = json.dumps(response)
-            request_response.submit()
+            log_response(request_response, response)
             return response
 
         balance, status = frappe.db.get_value("Wallet",user_id, ["balance","status"])
@@ -704,9 +627,7 @@ def get_wallet_balance():
             "balance": balance,
             "status": status
         }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
         return response
 
     except Exception as e:
@@ -716,9 +637,7 @@ def get_wallet_balance():
             "status": "SERVER_ERROR",
             "message": "Error in fetching wallet"
         }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
         
         return response
 
@@ -834,11 +753,7 @@ def get_merchant(merchant_name):
         """, merchant_name, as_dict=True)
 
         # 3. Get Product Pricing
-        product_pricing = frappe.db.sql("""
-            SELECT product, start_value, end_value, fee_type, fee, tax_fee_type, tax_fee
-            FROM `tabProduct Pricing`
-            WHERE parent = %s
-        """, merchant_name, as_dict=True)
+        product_pricing = get_pricing_rows(merchant_name)
 
         merchant["wallet_balance"] = wallet[0]["balance"] if wallet else 0
         merchant["product_pricing"] = product_pricing
@@ -852,24 +767,27 @@ def get_merchant(merchant_name):
 @frappe.whitelist()
 def get_payout_report():
     try:
+        # All-time rollup rows (rollups.py) instead of scanning tabOrder
         result = frappe.db.sql("""
             SELECT
                 SUM(CASE WHEN status = 'Processed' THEN order_amount ELSE 0 END) AS successful_payout,
                 SUM(CASE WHEN status = 'Cancelled' THEN order_amount ELSE 0 END) AS failed_payout,
                 SUM(CASE WHEN status = 'Processed' THEN tax ELSE 0 END) AS total_tax,
                 SUM(CASE WHEN status = 'Processed' THEN fee ELSE 0 END) AS total_fee
-            FROM tabOrder
+            FROM `tabOrder Rollup`
+            WHERE day IS NULL
         """, as_dict=True)[0]  # get first (and only) row as dict
 
         users = frappe.db.sql("""
             SELECT
-                merchant_ref_id,
+                merchant AS merchant_ref_id,
                 SUM(CASE WHEN status = 'Processed' THEN order_amount ELSE 0 END) AS successful_payout,
                 SUM(CASE WHEN status = 'Cancelled' THEN order_amount ELSE 0 END) AS failed_payout,
                 SUM(CASE WHEN status = 'Processed' THEN tax ELSE 0 END) AS total_tax,
                 SUM(CASE WHEN status = 'Processed' THEN fee ELSE 0 END) AS total_fee
-            FROM tabOrder
-            GROUP BY merchant_ref_id
+            FROM `tabOrder Rollup`
+            WHERE day IS NULL
+            GROUP BY merchant
         """, as_dict=True)
 
         result["users"] = users
@@ -883,20 +801,23 @@ def get_payout_report():
 @frappe.whitelist()
 def get_van_report():
     try:
+        # All-time rollup rows of the submitted logs (rollups.py)
         result = frappe.db.sql("""
             SELECT
-                COUNT(name) AS total_van,
+                COALESCE(SUM(log_count), 0) AS total_van,
                 SUM(amount) AS total_collection
-            FROM `tabVirtual Account Logs`
+            FROM `tabVAN Rollup`
+            WHERE day IS NULL
         """, as_dict=True)[0]
 
         logs = frappe.db.sql("""
             SELECT
-                account_number,
+                MAX(account_number) AS account_number,
                 SUM(amount) AS total_collection,
                 merchant_email,
-                merchant
-            FROM `tabVirtual Account Logs`
+                MAX(merchant) AS merchant
+            FROM `tabVAN Rollup`
+            WHERE day IS NULL
             GROUP BY merchant_email
         """, as_dict=True)
 
@@ -919,58 +840,32 @@ def update_transaction_status():
         utr = data.get("utr","")
         remark = data.get("remark","")
 
-        doc = frappe.get_doc("Order",order_id)
-
-        frappe.set_user(doc.merchant_ref_id)
+        merchant = frappe.db.get_value("Order", order_id, "merchant_ref_id")
+        if not merchant:
+            frappe.throw(f"Order {order_id} not found")
 
-        transaction = frappe.get_doc("Transaction",{"order":order_id})
-
-        if transaction.docstatus == 1:
-            frappe.log_error(f"Transaction {transaction.name} is submitted. Current status: {transaction.docstatus}", "Webhook Processing")
-            return {
-                "Transaction is already submitted"
-            }
+        frappe.set_user(merchant)
 
+        updated = False
         if status == "FAILED":
-            transaction.status = "Failed"
-            transaction.remark = remark
-            transaction.save(ignore_permissions=True)
-            transaction.submit()
-
-            if status == "FAILED":
-                status = "Cancelled"
-
-            handle_transaction_failure(order_id,status,status,transaction.name)
-            return {
-                "Record updated successfully"
-            }
+            updated = fail(order_id, remark or "Cancelled")
 
         elif status == "REVERSED":
-            transaction.status = "Reversed"
-            transaction.remark = remark
-            transaction.save(ignore_permissions=True)
-            transaction.submit()
-
-            status = "Reversed"
+            updated = fail(order_id, remark or "Reversed", status="Reversed")
 
-            handle_transaction_failure(order_id,status,status,transaction.name)
-            return {
-                "Record updated successfully"
-            }
-            
         elif status == "SUCCESS":
-            transaction.status = "Success"
-            transaction.transaction_reference_id = utr
-            transaction.save(ignore_permissions=True)
-            transaction.submit()
-            
-            doc.status = "Processed"
-            doc.utr = utr
-            doc.save(ignore_permissions=True)
-            frappe.db.commit()
+            updated = complete(order_id, utr=utr, remark=remark)
+
+        if not updated:
+            frappe.log_error(f"Order {order_id} cannot move to {status}", "Webhook Processing")
             return {
-                "Record updated successfully"
+                "Transaction is already submitted"
             }
+
+        frappe.db.commit()
+        return {
+            "Record updated successfully"
+        }
         
     except Exception as e:
         frappe.db.rollback(save_point = "update_record")
@@ -0,0 +1,191 @@
+import json
+import os
+
+import frappe
+from frappe.utils import now
+
+from .utils import acquire_lock, release_lock
+
+# Request Response audit sink
+# API handlers hand finished request/response pairs to this module instead of
+# inserting and submitting a Request Response doc on the latency path. Entries are
+# buffered in a Redis list and written in multi-row inserts by flush_request_logs.
+# When Redis is unavailable entries are appended to a spill file on disk, which
+# the next flush drains. Global Config "Synchronous Request Logging" writes each
+# entry before the response is returned.
+
+BUFFER_KEY = "iswitch:request_log_buffer"
+LOCK_KEY = "iswitch:request_log_flush_lock"
+LOCK_TTL = 300
+
+BATCH_SIZE = 500
+MAX_BATCHES_PER_FLUSH = 40
+
+SPILL_FILE = "request_log_spill.jsonl"
+
+LOG_FIELDS = [
+    "name", "creation", "modified", "owner", "modified_by", "docstatus",
+    "request", "response", "header", "user"
+]
+
+_buffered_since_flush = 0
+
+
+def start_request_log(request=None, header=None, user=None):
+    """
+    Begin an audit entry for an API request. Nothing is written until log_response.
+    """
+    return frappe._dict({
+        "name": frappe.generate_hash(length=10),
+        "creation": now(),
+        "request": request,
+        "header": header,
+        "user": user
+    })
+
+
+def log_response(entry, response):
+    """
+    Attach the response to an audit entry and hand it to the sink
+    """
+    entry.response = response
+    entry.owner = frappe.session.user
+    entry.modified = now()
+
+    if is_synchronous():
+        _insert_entries([entry])
+        return
+
+    payload = json.dumps(entry, default=str)
+    try:
+        frappe.cache().rpush(BUFFER_KEY, payload)
+    except Exception:
+        _spill([payload])
+        return
+
+    _schedule_flush()
+
+
+def is_synchronous():
+    return bool(frappe.get_cached_doc("Global Config").get("synchronous_request_logging"))
+
+
+def flush_request_logs():
+    """
+    Write buffered audit entries to Request Response in bulk.
+    Entries leave the buffer only after their batch is committed, and the insert
+    ignores names that already exist, so a crashed flush is safe to repeat.
+    """
+    lock = acquire_lock(LOCK_KEY, LOCK_TTL)
+    if not lock:
+        return
+
+    cache = frappe.cache()
+
+    try:
+        _drain_spill_file()
+
+        for _batch in range(MAX_BATCHES_PER_FLUSH):
+            payloads = cache.lrange(BUFFER_KEY, 0, BATCH_SIZE - 1)
+            if not payloads:
+                break
+
+            _insert_entries(_parse(payloads))
+            frappe.db.commit()
+            cache.ltrim(BUFFER_KEY, len(payloads), -1)
+    except Exception as e:
+        frappe.db.rollback()
+        frappe.log_error("Error in request log flush", str(e))
+    finally:
+        release_lock(LOCK_KEY, lock)
+
+
+def _schedule_flush():
+    global _buffered_since_flush
+
+    # The cron flush picks up stragglers; busy workers also trigger one per batch
+    _buffered_since_flush += 1
+    if _buffered_since_flush < BATCH_SIZE:
+        return
+
+    _buffered_since_flush = 0
+    frappe.enqueue(
+        "iswitch.audit_log.flush_request_logs",
+        queue="short",
+        job_id="iswitch_request_log_flush",
+        deduplicate=True
+    )
+
+
+def _insert_entries(entries):
+    if not entries:
+        return
+
+    values = []
+    for entry in entries:
+        values.append((
+            entry.get("name"),
+            entry.get("creation"),
+            entry.get("modified") or entry.get("creation"),
+            entry.get("owner"),
+            entry.get("owner"),
+            1,
+            _as_json(entry.get("request")),
+            _as_json(entry.get("response")),
+            entry.get("header"),
+            entry.get("user")
+        ))
+
+    frappe.db.bulk_insert(
+        "Request Response", fields=LOG_FIELDS, values=values, ignore_duplicates=True
+    )
+
+
+def _as_json(value):
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, default=str)
+
+
+def _parse(payloads):
+    entries = []
+    for payload in payloads:
+        try:
+            entries.append(frappe._dict(json.loads(payload)))
+        except ValueError:
+            frappe.log_error("Unreadable request log entry", payload)
+    return entries
+
+
+def _spill_path():
+    return frappe.get_site_path("private", SPILL_FILE)
+
+
+def _spill(payloads):
+    try:
+        with open(_spill_path(), "a") as spill:
+            spill.write("".join(payload + "\n" for payload in payloads))
+            spill.flush()
+            os.fsync(spill.fileno())
+    except Exception as e:
+        # Last resort, the entry must not be lost silently
+        frappe.log_error("Error in request log spill", f"{e}\n{payloads}")
+
+
+def _drain_spill_file():
+    path = _spill_path()
+    processing = path + ".processing"
+
+    # A .processing file is left behind only by a flush that died mid-drain
+    if not os.path.exists(processing):
+        if not os.path.exists(path):
+            return
+        os.replace(path, processing)
+
+    with open(processing) as spill:
+        payloads = [line for line in spill.read().splitlines() if line.strip()]
+
+    for start in range(0, len(payloads), BATCH_SIZE):
+        _insert_entries(_parse(payloads[start:start + BATCH_SIZE]))
+    frappe.db.commit()
+    os.remove(processing)
@@ -0,0 +1,170 @@
+import time
+from functools import partial
+
+import frappe
+
+from .pricing import find_slab, get_pricing
+from .utils import after_commit
+
+# Merchant auth context
+# Everything the order APIs need to authorise a request (identity, whitelisted IPs,
+# merchant/wallet status, routing and pricing) resolved once per API key and kept
+# in-process and in Redis. Doc events on the source doctypes invalidate it.
+
+CACHE_KEY = "iswitch:auth_context"
+GENERATION_KEY = "iswitch:auth_context_generation"
+
+# Upper bound on how long a worker trusts its in-process copy without a rebuild
+LOCAL_TTL = 300
+
+_local_contexts = {}
+_local_generation = None
+
+
+def get_auth_context(api_key):
+    """
+    Return the merchant auth context for an API key, or None for an unknown key.
+    A warm lookup touches only the in-process cache and one Redis read.
+    """
+    if not api_key:
+        return None
+
+    _sync_generation()
+
+    entry = _local_contexts.get(api_key)
+    if entry and entry[0] > time.monotonic():
+        return entry[1]
+
+    context = frappe.cache().hget(CACHE_KEY, api_key)
+    if context is None:
+        context = build_auth_context(api_key)
+        if context is None:
+            return None
+        frappe.cache().hset(CACHE_KEY, api_key, context)
+
+    _local_contexts[api_key] = (time.monotonic() + LOCAL_TTL, context)
+    return context
+
+
+def build_auth_context(api_key):
+    """
+    Load the auth context for an API key from the database
+    """
+    user_id = frappe.db.get_value("User", {"api_key": api_key}, "email")
+    if not user_id:
+        return None
+
+    merchant = frappe.db.get_value(
+        "Merchant", user_id, ["name", "status", "integration", "secondary_integration"], as_dict=True
+    )
+    wallet_status = frappe.db.get_value("Wallet", user_id, "status")
+
+    ips = frappe.get_all("Whitelist IP", filters={"merchant": user_id}, pluck="whitelisted_ip")
+    products = frappe.get_all("Product", filters={"is_active": 1}, pluck="product_name")
+
+    pricing = {}
+    integration_products = []
+    if merchant:
+        pricing = get_pricing(merchant.name)
+        integration_products = list(get_pricing(merchant.integration))
+
+    return frappe._dict({
+        "api_key": api_key,
+        "user": user_id,
+        "merchant": merchant.name if merchant else None,
+        "merchant_status": merchant.status if merchant else None,
+        "integration": merchant.integration if merchant else None,
+        "secondary_integration": merchant.secondary_integration if merchant else None,
+        "wallet_status": wallet_status,
+        "ips": set(ips),
+        "products": set(products),
+        "integration_products": set(integration_products),
+        "pricing": pricing
+    })
+
+
+def find_pricing(context, product, amount, inclusive_end=True):
+    """
+    Return the merchant pricing slab for a product and order amount, or None
+    """
+    return find_slab(context.pricing, product, amount, inclusive_end)
+
+
+def is_ip_allowed(context, ip_address):
+    return bool(context) and ip_address in context.ips
+
+
+def clear_merchant_context(merchant):
+    """
+    Drop the cached context of a merchant once the current transaction commits
+    """
+    if not merchant:
+        return
+    _after_commit(partial(_clear_api_keys, _get_api_keys(merchant)))
+
+
+def clear_all_contexts():
+    """
+    Drop every cached context, used when shared data (products, integrations) changes
+    """
+    _after_commit(_clear_all)
+
+
+def on_merchant_change(doc, method=None):
+    clear_merchant_context(doc.name)
+
+
+def on_wallet_change(doc, method=None):
+    clear_merchant_context(doc.name)
+
+
+def on_whitelist_ip_change(doc, method=None):
+    clear_merchant_context(doc.merchant)
+
+
+def on_user_change(doc, method=None):
+    api_keys = [doc.api_key]
+    previous = doc.get_doc_before_save() if method != "on_trash" else None
+    if previous:
+        api_keys.append(previous.api_key)
+    _after_commit(partial(_clear_api_keys, [key for key in api_keys if key]))
+
+
+def on_shared_change(doc, method=None):
+    clear_all_contexts()
+
+
+def _get_api_keys(merchant):
+    return frappe.get_all("User", filters={"name": merchant, "api_key": ["is", "set"]}, pluck="api_key")
+
+
+def _clear_api_keys(api_keys):
+    for api_key in api_keys:
+        frappe.cache().hdel(CACHE_KEY, api_key)
+    _bump_generation()
+
+
+def _clear_all():
+    frappe.cache().delete_key(CACHE_KEY)
+    _bump_generation()
+
+
+def _bump_generation():
+    # Every worker drops its in-process copies when the generation moves
+    frappe.cache().set_value(GENERATION_KEY, frappe.generate_hash(length=10))
+    _local_contexts.clear()
+
+
+def _sync_generation():
+    global _local_generation
+
+    generation = frappe.cache().get_value(GENERATION_KEY)
+    if generation != _local_generation:
+        _local_contexts.clear()
+        _local_generation = generation
+
+
+def _after_commit(callback):
+    # Clear now and again after commit, so a worker that rebuilt from the
+    # pre-commit rows in between does not keep serving them
+    after_commit(callback, run_now=True)
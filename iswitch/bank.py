@@ -2,13 +2,14 @@ import frappe
 import base64
 import os
 import json
-import requests
 from frappe.auth import LoginManager
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.backends import default_backend
 from frappe.utils import validate_email_address, getdate, today, get_formatted_email, now, now_datetime, format_datetime
+from . import crypto, http_client
+from .tracing import span, traced
 
 class JSONEncryptionDecryption:
     
@@ -30,18 +31,10 @@ class JSONEncryptionDecryption:
             result = ""
             TAG_LENGTH_BIT = 128
             IV_LENGTH_BYTE = 16
-            SALT_LENGTH_BYTE = 16
-            iteration_count = 65536
-            key_length = 256
             
-            # Generate random IV and salt
+            # Random IV; the salt and its derived key are reused for a while (crypto)
             iv = JSONEncryptionDecryption.get_random_nonce(IV_LENGTH_BYTE)
-            salt = JSONEncryptionDecryption.get_random_nonce(SALT_LENGTH_BYTE)
-            
-            # Generate secret key from password
-            aes_key_from_password = JSONEncryptionDecryption.get_aes_key_from_password(
-                password, salt, iteration_count, key_length
-            )
+            salt, aes_key_from_password = crypto.get_encryption_key(password)
             
             # Create cipher instance
             cipher = Cipher(
@@ -79,8 +72,6 @@ class JSONEncryptionDecryption:
             IV_LENGTH_BYTE = 16
             SALT_LENGTH_BYTE = 16
             TAG_LENGTH_BYTE = 16
-            iteration_count = 65536
-            key_length = 256
             
             # Decode base64
             decode = base64.b64decode(encrypted_data.encode(JSONEncryptionDecryption.ENCODING_CHARSET))
@@ -91,10 +82,8 @@ class JSONEncryptionDecryption:
             tag = decode[-TAG_LENGTH_BYTE-SALT_LENGTH_BYTE:-SALT_LENGTH_BYTE]
             salt = decode[-SALT_LENGTH_BYTE:]
             
-            # Generate secret key from password
-            aes_key_from_password = JSONEncryptionDecryption.get_aes_key_from_password(
-                password, salt, iteration_count, key_length
-            )
+            # Secret key from password, cached per salt
+            aes_key_from_password = crypto.derive_key(password, salt)
             
             # Create cipher instance
             cipher = Cipher(
@@ -203,17 +192,14 @@ def bank_login():
 
     data = frappe.request.get_json()
 
-    config = frappe.get_single("Global Config")
-    passphrase = config.get_password("passphrase")
+    passphrase = crypto.get_passphrase()
 
     current_time = now_datetime()
     msgtime = format_datetime(current_time, "yyyy-MM-dd HH:mm:ss.fff")
 
-    bank_req = frappe.new_doc("Bank ReqRes")
-    bank_req.request = data
-    bank_req.msgid = data.get("msgid")
+    bank_req = claim_msgid(data, data.get("msgid"))
 
-    if frappe.db.exists("Bank ReqRes",{"msgid":data.get("msgid")}):
+    if not bank_req:
         response = {
             "msgid": data.get("msgid"),
             "channelName": "iSwitch",
@@ -224,6 +210,9 @@ def bank_login():
         frappe.log_error("Response", response)
         encrypted_response = JSONEncryptionDecryption.encrypt_json(response, passphrase)
         
+        bank_req = frappe.new_doc("Bank ReqRes")
+        bank_req.request = data
+        bank_req.msgid = data.get("msgid")
         bank_req.response = {"resdata":encrypted_response}
         bank_req.remark = "Duplicate msgId"
         bank_req.save(ignore_permissions = True)
@@ -231,8 +220,6 @@ def bank_login():
 
         return encrypted_response
 
-    bank_req.save(ignore_permissions = True)
-
     try:
         encrypted_data = data.get("reqdata")
         msgid = data.get("msgid")
@@ -391,8 +378,7 @@ def test_encrypt():
     try:
         data = frappe.request.get_json()
         
-        config = frappe.get_single("Global Config")
-        passphrase = config.get_password("passphrase")
+        passphrase = crypto.get_passphrase()
         
         encrypted_response = JSONEncryptionDecryption.encrypt_json(data, passphrase)
         return encrypted_response
@@ -404,8 +390,7 @@ def test_decryption():
     try:
         data = frappe.request.get_json()
         
-        config = frappe.get_single("Global Config")
-        passphrase = config.get_password("passphrase")
+        passphrase = crypto.get_passphrase()
         encrypted_data = data.get("reqData","")
         
         decrypted_response = JSONEncryptionDecryption.decrypt_json(encrypted_data, passphrase, return_as_dict=True)
@@ -415,13 +400,13 @@ def test_decryption():
 
 
 @frappe.whitelist(allow_guest=True)
+@traced("bank_webhook")
 def bank_webhook():
 
     auth_header = frappe.request.headers.get('X-Bank-Auth')
     
     data = frappe.request.get_json()
-    config = frappe.get_single("Global Config")
-    passphrase = config.get_password("passphrase")
+    passphrase = crypto.get_passphrase()
 
     bank_req = frappe.new_doc("Bank ReqRes")
     msgid = data.get("msgId")
@@ -489,7 +474,8 @@ def bank_webhook():
         return res
     
 
-    if frappe.db.exists("Bank ReqRes",{"msgid":msgid}):
+    accepted = claim_msgid(data, msgid)
+    if not accepted:
         error_response = {
             "inwardCreditUpdateResp": {
                 "status": "F",
@@ -517,15 +503,14 @@ def bank_webhook():
         
         return res
 
-    bank_req.request = data
-
-    bank_req.save(ignore_permissions = True)
+    bank_req = accepted
 
     try:
 
         encrypted_data = data.get("reqData")
 
-        decrypted_json = JSONEncryptionDecryption.decrypt_json(encrypted_data, passphrase, return_as_dict=True)
+        with span("bank_webhook", "decrypt"):
+            decrypted_json = JSONEncryptionDecryption.decrypt_json(encrypted_data, passphrase, return_as_dict=True)
         
         req_data = decrypted_json.get("inwardCreditUpdateReq", {})
         
@@ -565,14 +550,16 @@ def bank_webhook():
         frappe.set_user(merchant)
         
         if not frappe.db.exists("Virtual Account Logs", {"utr": utr}):
-            va_logs = frappe.get_doc({
-                "doctype": 'Virtual Account Logs',
-                "account_number": account_number,
-                "transaction_type": "Credit",
-                "amount": float(amt),
-                "utr": utr,
-                "status": "Success"
-            }).insert(ignore_permissions=True)
+            # after_insert credits the wallet
+            with span("bank_webhook", "van_insert"):
+                va_logs = frappe.get_doc({
+                    "doctype": 'Virtual Account Logs',
+                    "account_number": account_number,
+                    "transaction_type": "Credit",
+                    "amount": float(amt),
+                    "utr": utr,
+                    "status": "Success"
+                }).insert(ignore_permissions=True)
             
             response = {
                 "inwardCreditUpdateResp": {
@@ -629,8 +616,7 @@ def bank_webhook():
         
         # Return encrypted error response
         try:
-            config = frappe.get_single("Global Config")
-            passphrase = config.get_password("passphrase")
+            passphrase = crypto.get_passphrase()
             
             error_response = {
                 "inwardCreditUpdateResp": {
@@ -662,6 +648,31 @@ def bank_webhook():
                 "msgId": data.get("msgId", "") if data else ""
             }
 
+def claim_msgid(data, msgid):
+    """
+    Save the Bank ReqRes row accepting a msgid. Returns it, or None when a request
+    with the same msgid was accepted before (the unique dedup_key decides races).
+    Rejected and duplicate requests are logged without a dedup_key, so a bank
+    retrying a rejected request is not refused as a duplicate.
+    """
+    if msgid and frappe.db.exists("Bank ReqRes", {"dedup_key": msgid}):
+        return None
+
+    bank_req = frappe.new_doc("Bank ReqRes")
+    bank_req.request = data
+    bank_req.msgid = msgid
+    bank_req.dedup_key = msgid or None
+
+    frappe.db.savepoint("bank_msgid")
+    try:
+        bank_req.save(ignore_permissions = True)
+    except (frappe.DuplicateEntryError, frappe.UniqueValidationError):
+        # Lost the race to a concurrent request with the same msgid
+        frappe.db.rollback(save_point = "bank_msgid")
+        frappe.clear_last_message()
+        return None
+    return bank_req
+
 @frappe.whitelist()
 def bank_access_token():
     try:
@@ -684,8 +695,7 @@ def bank_access_token():
                 frappe.log_error("Access Token Headers",headers)
                 frappe.log_error("Access Token Payload", data)
 
-                config = frappe.get_single("Global Config")
-                passphrase = config.get_password("passphrase")
+                passphrase = crypto.get_passphrase()
                 
                 encrypted_response = JSONEncryptionDecryption.encrypt_json(data, passphrase)
                 
@@ -694,7 +704,7 @@ def bank_access_token():
                 }
                 frappe.log_error("Access Token Encrypted Payload", payload)
                 url = "https://apimuatext.unionbankofindia.co.in/cms/OAPI/accessToken"
-                api_response = requests.post(url, json = payload, headers = headers)
+                api_response = http_client.post(bank_doc.name, url, json = payload, headers = headers)
                 response = api_response.json()
                 frappe.log_error("Access Token Response",response)
                 respData = response.get("respData","")
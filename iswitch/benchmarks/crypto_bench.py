@@ -0,0 +1,85 @@
+import time
+
+from .. import crypto
+from ..bank import JSONEncryptionDecryption
+
+# Bank callback crypto micro-benchmark
+# CPU time of the crypto in one bank callback (decrypt the request, encrypt the
+# response) with the derived-key cache off and on:
+#   uncached         every message derives its key (PBKDF2 per decrypt and encrypt)
+#   fresh_salt       the bank salts every request anew: decrypt derives, the
+#                    response reuses the rotating outgoing key
+#   reused_salt      the bank reuses its salt too: both keys come from the cache
+#   pool             as uncached, with bank_crypto_pool_size set: derivations run in
+#                    the crypto pool, so only the cipher work is left on this process
+#
+#   bench --site <site> execute iswitch.benchmarks.crypto_bench.run --kwargs "{'callbacks': 50}"
+
+PASSPHRASE = "benchmark-passphrase-0123456789"
+
+REQUEST = {
+    "inwardCreditUpdateReq": {
+        "txnRefNo": "123456789012",
+        "VANum": "999000000001",
+        "txnAmt": "100",
+        "remitterName": "Benchmark Remitter",
+        "remitterAccNo": "000011112222",
+        "remitterBankIFSC": "UBIN0000001"
+    }
+}
+
+RESPONSE = {
+    "inwardCreditUpdateResp": {
+        "status": "S",
+        "errorCode": "000",
+        "errorMsg": "Success"
+    }
+}
+
+
+def run(callbacks=50):
+    """
+    Print and return the CPU milliseconds per callback of each mode
+    """
+    callbacks = int(callbacks)
+    report = {
+        "uncached": _measure(_requests(callbacks, reuse_salt=False), clear_each=True),
+        "fresh_salt": _measure(_requests(callbacks, reuse_salt=False), clear_each=False),
+        "reused_salt": _measure(_requests(callbacks, reuse_salt=True), clear_each=False)
+    }
+    if crypto.get_pool():
+        report["pool"] = _measure(_requests(callbacks, reuse_salt=False), clear_each=True)
+
+    baseline = report["uncached"]
+    print(f"{'mode':<14}{'cpu ms/callback':>17}{'speedup':>10}")
+    for mode, cpu_ms in report.items():
+        print(f"{mode:<14}{cpu_ms:>17}{round(baseline / cpu_ms, 1) if cpu_ms else '-':>10}")
+    return report
+
+
+def _requests(count, reuse_salt):
+    """
+    Request bodies as the bank would send them, built before timing
+    """
+    bodies = []
+    for _i in range(count):
+        if not reuse_salt:
+            crypto.clear_key_cache()
+        bodies.append(JSONEncryptionDecryption.encrypt_json(REQUEST, PASSPHRASE))
+    crypto.clear_key_cache()
+    return bodies
+
+
+def _measure(bodies, clear_each):
+    started = time.process_time()
+    for body in bodies:
+        if clear_each:
+            crypto.clear_key_cache()
+        JSONEncryptionDecryption.decrypt_json(body, PASSPHRASE)
+        if clear_each:
+            crypto.clear_key_cache()
+        JSONEncryptionDecryption.encrypt_json(RESPONSE, PASSPHRASE)
+    elapsed = time.process_time() - started
+
+    crypto.clear_key_cache()
+    return round(elapsed * 1000 / len(bodies), 3) if bodies else 0
@@ -0,0 +1,142 @@
+import frappe
+from frappe.utils.password import get_decrypted_password, set_encrypted_password
+
+# Benchmark fixtures
+# Merchants, processors, pricing and a virtual account for the benchmark, with
+# every processor pointed at the local stand-in server. Integrations are looked
+# up by name in the pipeline ("Airtel Payment Bank", "Swavenpay"), so setting
+# them up repoints those records: only run the benchmark on a throwaway site
+# with allow_tests enabled.
+
+PAYOUT_MERCHANT = "benchmark-payout@example.com"
+COLLECT_MERCHANT = "benchmark-collect@example.com"
+
+AIRTEL = "Airtel Payment Bank"
+FLIPOPAY = "Flipopay"
+SWAVENPAY = "Swavenpay"
+
+PRODUCTS = ("IMPS", "UPI")
+CLIENT_IP = "127.0.0.1"
+BANK_PREFIX = "9990"
+ACCOUNT_NUMBER = "999000000001"
+WALLET_BALANCE = 10 ** 12
+
+PRICING = [
+    {"start_value": 1, "end_value": 10 ** 7, "fee_type": "Fixed", "fee": 5,
+        "tax_fee_type": "Percentage", "tax_fee": 18}
+]
+
+
+def setup(processor_url):
+    """
+    Create or refresh the benchmark records and return what the runner needs:
+    API credentials of both merchants, the virtual account and the bank passphrase
+    """
+    if not frappe.conf.allow_tests:
+        frappe.throw("Benchmarks change processor settings. Enable allow_tests on a throwaway site first.")
+
+    for product in PRODUCTS:
+        _upsert("Product", product, {"product_name": product, "is_active": 1})
+
+    _integration(AIRTEL, "UPI", processor_url, PRODUCTS)
+    _integration(FLIPOPAY, "Payment Gateway", processor_url, ("UPI",))
+    _integration(SWAVENPAY, "Payment Gateway", processor_url, ("IMPS",))
+
+    env = frappe._dict({
+        "payout": _merchant(PAYOUT_MERCHANT, AIRTEL, PRODUCTS),
+        "collect": _merchant(COLLECT_MERCHANT, FLIPOPAY, ("UPI",)),
+        "account_number": ACCOUNT_NUMBER,
+        "passphrase": _passphrase()
+    })
+
+    _upsert("Bank Prefix", BANK_PREFIX, {"prefix": BANK_PREFIX})
+    if not frappe.db.exists("Virtual Account", ACCOUNT_NUMBER):
+        frappe.get_doc({
+            "doctype": "Virtual Account",
+            "account_number": ACCOUNT_NUMBER,
+            "prefix": BANK_PREFIX,
+            "merchant": COLLECT_MERCHANT,
+            "status": "Active"
+        }).insert(ignore_permissions=True)
+
+    frappe.db.commit()
+    return env
+
+
+def _integration(name, integration_type, processor_url, products):
+    doc = _upsert("Integration", name, {
+        "integration_name": name,
+        "integration_type": integration_type,
+        "is_active": 1,
+        "api_endpoint": processor_url,
+        "client_id": "benchmark-client",
+        "secret_key": "benchmark-secret",
+        "product_pricing": _pricing(products)
+    })
+    return doc.name
+
+
+def _merchant(email, integration, products):
+    if not frappe.db.exists("User", email):
+        frappe.get_doc({
+            "doctype": "User",
+            "email": email,
+            "first_name": "Benchmark",
+            "send_welcome_email": 0
+        }).insert(ignore_permissions=True)
+
+    user = frappe.get_doc("User", email)
+    api_secret = frappe.generate_hash(length=15)
+    user.api_key = user.api_key or frappe.generate_hash(length=15)
+    user.api_secret = api_secret
+    user.save(ignore_permissions=True)
+
+    _upsert("Merchant", email, {
+        "company_email": email,
+        "company_name": "Benchmark",
+        "pancard": "AAAAA0000A",
+        "status": "Approved",
+        "integration": integration,
+        "secondary_integration": None,
+        "product_pricing": _pricing(products)
+    })
+    _upsert("Wallet", email, {"merchant_id": email, "status": "Active"})
+    frappe.db.set_value("Wallet", email, "balance", WALLET_BALANCE, update_modified=False)
+
+    if not frappe.db.exists("Whitelist IP", {"merchant": email, "whitelisted_ip": CLIENT_IP}):
+        frappe.get_doc({
+            "doctype": "Whitelist IP",
+            "merchant": email,
+            "whitelisted_ip": CLIENT_IP
+        }).insert(ignore_permissions=True)
+
+    return frappe._dict({
+        "user": email,
+        "api_key": user.api_key,
+        "token": f"token {user.api_key}:{api_secret}"
+    })
+
+
+def _passphrase():
+    # bank.bank_webhook reads the passphrase of Global Config
+    passphrase = get_decrypted_password("Global Config", "Global Config", "passphrase", raise_exception=False)
+    if not passphrase:
+        passphrase = frappe.generate_hash(length=32)
+        set_encrypted_password("Global Config", "Global Config", passphrase, "passphrase")
+    return passphrase
+
+
+def _pricing(products):
+    return [dict(row, product=product) for product in products for row in PRICING]
+
+
+def _upsert(doctype, name, values):
+    if frappe.db.exists(doctype, name):
+        doc = frappe.get_doc(doctype, name)
+        if "product_pricing" in values:
+            doc.set("product_pricing", [])
+        doc.update(values)
+        doc.save(ignore_permissions=True)
+    else:
+        doc = frappe.get_doc(dict(values, doctype=doctype)).insert(ignore_permissions=True)
+    return doc
@@ -0,0 +1,190 @@
+import base64
+import json
+import random
+import secrets
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ..bank import JSONEncryptionDecryption
+
+# Local processor stand-ins
+# One HTTP server that answers like the processors the order pipeline talks to,
+# with a configurable response latency and failure rate:
+#   POST /upiMerCollect                Airtel Payment Bank collect request
+#   POST /upiMerCollectCheckTxn        Airtel Payment Bank requery
+#   POST /transaction/top-up/          Flipopay top-up (payment links)
+#   POST /balance                      Swavenpay balance
+#   POST /cms/OAPI/accessToken         Union Bank access token
+# Inbound callbacks (Airtel webhook, Union Bank encrypted credit) are built by
+# the helpers at the bottom and posted to the site by the benchmark runner.
+
+
+class MockProcessor:
+    def __init__(self, latency_ms=50, jitter_ms=20, failure_rate=0.0, host="127.0.0.1", port=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+        self.server = ThreadingHTTPServer((host, port), _handler(self))
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def respond(self, path, payload):
+        """
+        Return (status, body) for a request, after the simulated processor latency
+        """
+        with self._lock:
+            self.calls[path] += 1
+
+        delay = max(0, self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms))
+        time.sleep(delay / 1000)
+
+        route = ROUTES.get(path)
+        if not route:
+            return 404, {"message": f"No mock for {path}"}
+        if random.random() < self.failure_rate:
+            return 503, {"messageText": "Service temporarily unavailable"}
+        return 200, route(payload or {})
+
+
+def _handler(processor):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self._reply()
+
+        def do_POST(self):
+            self._reply()
+
+        def _reply(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                payload = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                payload = {}
+
+            status, body = processor.respond(self.path.split("?", 1)[0], payload)
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def _airtel_collect(payload):
+    return {
+        "code": "0",
+        "status": "SUCCESS",
+        "hdnOrderID": payload.get("hdnOrderID"),
+        "rrn": _reference(),
+        "messageText": "Collect request initiated"
+    }
+
+
+def _airtel_check(payload):
+    return {
+        "code": "0",
+        "hdnOrderID": payload.get("hdnOrderID"),
+        "rrn": payload.get("rrn") or _reference(),
+        "txnStatus": "SUCCESS",
+        "messageText": "Transaction successful"
+    }
+
+
+def _flipopay_top_up(payload):
+    order = payload.get("external_order_id")
+    return {
+        "status": "success",
+        "data": {
+            "order_id": order,
+            "payment_url": f"https://pay.example.com/{order}",
+            "success_url": f"https://pay.example.com/{order}/success",
+            "failed_url": f"https://pay.example.com/{order}/failed",
+            "close_url": f"https://pay.example.com/{order}/close"
+        }
+    }
+
+
+def _swavenpay_balance(payload):
+    return {"statusCode": 1, "balance": 1000000}
+
+
+def _union_bank_token(payload):
+    return {"access_token": secrets.token_hex(16), "expires_in": 3600}
+
+
+ROUTES = {
+    "/upiMerCollect": _airtel_collect,
+    "/upiMerCollectCheckTxn": _airtel_check,
+    "/transaction/top-up/": _flipopay_top_up,
+    "/balance": _swavenpay_balance,
+    "/cms/OAPI/accessToken": _union_bank_token
+}
+
+
+def airtel_callback(order, status="SUCCESS"):
+    """
+    Body of an Airtel Payment Bank status callback for an order
+    """
+    return {
+        "hdnOrderID": order,
+        "rrn": _reference(),
+        "txnStatus": status,
+        "messageText": "Transaction successful" if status == "SUCCESS" else "Transaction failed"
+    }
+
+
+def union_bank_callback(passphrase, account_number, amount, utr=None):
+    """
+    Body of a Union Bank inward credit callback, encrypted as the bank sends it
+    """
+    utr = utr or _reference()
+    request = {
+        "inwardCreditUpdateReq": {
+            "txnRefNo": utr,
+            "VANum": account_number,
+            "txnAmt": str(amount),
+            "remitterName": "Benchmark Remitter",
+            "remitterAccNo": "000011112222",
+            "remitterBankIFSC": "UBIN0000001"
+        }
+    }
+    return {
+        "msgId": f"MSG{utr}",
+        "reqData": JSONEncryptionDecryption.encrypt_json(request, passphrase)
+    }
+
+
+def union_bank_auth(api_key):
+    """
+    X-Bank-Auth header value for an API key
+    """
+    token = base64.b64encode(f"{api_key}:benchmark".encode()).decode()
+    return f"Bearer {token}"
+
+
+def _reference():
+    return str(random.randint(10 ** 11, 10 ** 12 - 1))
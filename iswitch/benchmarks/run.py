@@ -0,0 +1,386 @@
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+from urllib.parse import urlencode
+
+import frappe
+from frappe.app import application
+from werkzeug.test import Client
+
+from . import fixtures
+from .mock_processor import MockProcessor, airtel_callback, union_bank_auth, union_bank_callback
+
+# Order pipeline benchmark
+# Runs each scenario `requests` times at `concurrency` against this site, in this
+# process: API scenarios go through the WSGI app like a request from the load
+# balancer, job scenarios call the background function on a fresh connection like
+# a worker does. Processors are answered by the local stand-in server. Reports
+# p50/p95/p99 latency, throughput and database queries per request, and compares
+# them with the stored baseline.
+#
+#   bench --site <site> execute iswitch.benchmarks.run.run \
+#       --kwargs "{'requests': 500, 'concurrency': 16}"
+#
+# save_baseline=True stores the run as baseline.json next to this file, with its
+# settings and the versions it ran on; commit it with the change it measures so
+# the difference shows up in review. A scenario the baseline has no measurements
+# for (requests null) is reported, not compared.
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# A scenario regresses when its p95 or throughput moves by more than this share,
+# or when it runs more queries per request than the baseline
+TOLERANCE = 0.2
+QUERY_TOLERANCE = 0.5
+
+# update_record works through every open order in one pass
+REFETCH_PASSES = 5
+
+_local = threading.local()
+
+
+def run(scenarios=None, requests=200, concurrency=8, latency_ms=50, failure_rate=0.0, save_baseline=False):
+    """
+    Run the benchmark scenarios (all by default, in pipeline order) and return the report
+    """
+    if isinstance(scenarios, str):
+        scenarios = [name.strip() for name in scenarios.split(",")]
+    scenarios = scenarios or list(SCENARIOS)
+
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        frappe.throw(f"Unknown scenarios: {', '.join(unknown)}")
+
+    settings = {
+        "requests": int(requests),
+        "concurrency": int(concurrency),
+        "latency_ms": latency_ms,
+        "failure_rate": failure_rate
+    }
+
+    processor = MockProcessor(latency_ms=latency_ms, failure_rate=failure_rate).start()
+    try:
+        env = fixtures.setup(processor.url)
+        env.site = frappe.local.site
+        env.sites_path = frappe.local.sites_path
+
+        report = {"settings": settings, "scenarios": {}}
+        with _count_queries():
+            for name in scenarios:
+                calls = SCENARIOS[name](env, settings["requests"])
+                workers = 1 if name in SERIAL else settings["concurrency"]
+                report["scenarios"][name] = _run_scenario(env, calls, workers)
+        report["processor_calls"] = dict(processor.calls)
+    finally:
+        processor.stop()
+
+    baseline = _load_baseline()
+    if baseline:
+        report["regressions"] = _compare(report, baseline)
+        report["unmeasured"] = [
+            name for name in report["scenarios"]
+            if not baseline.get("scenarios", {}).get(name, {}).get("requests")
+        ]
+        if baseline.get("settings") != settings:
+            report["baseline_settings"] = baseline.get("settings")
+
+    _print(report)
+
+    if save_baseline:
+        with open(BASELINE_PATH, "w") as f:
+            f.write(frappe.as_json({
+                "settings": settings,
+                "environment": _environment(),
+                "scenarios": report["scenarios"]
+            }) + "\n")
+
+    return report
+
+
+# Scenarios
+# Each returns the calls to time: API requests, or background jobs
+
+def create_order(env, count):
+    return [_api("POST", "/api/method/order", env.payout, _order_body("IMPS")) for _i in range(count)]
+
+
+def create_order_upi(env, count):
+    # Each order queues dispatch_transaction once it commits
+    return [_api("POST", "/api/method/order", env.payout, _order_body("UPI")) for _i in range(count)]
+
+
+def dispatch_transaction(env, count):
+    orders = frappe.db.sql("""
+        SELECT o.name, l.transaction_id
+        FROM `tabOrder` o
+        JOIN `tabLedger` l ON l.order = o.name AND l.transaction_type = 'Debit'
+        WHERE o.merchant_ref_id = %s AND o.product = 'UPI' AND o.status = 'Queued'
+        ORDER BY o.creation
+        LIMIT %s
+    """, (env.payout.user, count), as_dict=True)
+    return [
+        _job("iswitch.transaction_processing.dispatch_transaction", order=order.name, transaction_id=order.transaction_id)
+        for order in orders
+    ]
+
+
+def blinkpe_webhook(env, count):
+    orders = frappe.get_all(
+        "Order",
+        filters={"merchant_ref_id": env.payout.user, "product": "UPI", "status": "Processing"},
+        pluck="name",
+        limit=count
+    )
+    return [
+        _api("POST", "/api/method/iswitch.webhook.blinkpe_webhook", None, airtel_callback(order))
+        for order in orders
+    ]
+
+
+def initiate_upi(env, count):
+    return [_api("POST", "/api/method/init_upi", env.collect, _order_body("UPI")) for _i in range(count)]
+
+
+def bank_webhook(env, count):
+    # Encryption is slow by design (PBKDF2), so the bodies are built before timing
+    headers = {"X-Bank-Auth": union_bank_auth(env.collect.api_key)}
+    return [
+        _api("POST", "/api/method/callback", None,
+            union_bank_callback(env.passphrase, env.account_number, 100), headers)
+        for _i in range(count)
+    ]
+
+
+def refetch(env, count):
+    return [_job("iswitch.refetch.update_record") for _i in range(min(count, REFETCH_PASSES))]
+
+
+def processor_balance(env, count):
+    return [_job("iswitch.wallet.get_wallet_balance") for _i in range(count)]
+
+
+def portal_orders(env, count):
+    return _portal("iswitch.portal_api.get_merchant_orders", env.payout, count, page=1, limit=20)
+
+
+def portal_ledger(env, count):
+    return _portal("iswitch.portal_api.get_merchant_ledger", env.payout, count, page=1, limit=20)
+
+
+def portal_van_logs(env, count):
+    return _portal("iswitch.portal_api.get_merchant_van_logs", env.collect, count, page=1, limit=20)
+
+
+def merchant_portal_orders(env, count):
+    return _portal("iswitch.merchant_portal_api.get_orders", env.payout, count, page=1, page_size=20)
+
+
+SCENARIOS = {
+    "create_order": create_order,
+    "create_order_upi": create_order_upi,
+    "dispatch_transaction": dispatch_transaction,
+    "blinkpe_webhook": blinkpe_webhook,
+    "initiate_upi": initiate_upi,
+    "bank_webhook": bank_webhook,
+    "refetch": refetch,
+    "processor_balance": processor_balance,
+    "portal_orders": portal_orders,
+    "portal_ledger": portal_ledger,
+    "portal_van_logs": portal_van_logs,
+    "merchant_portal_orders": merchant_portal_orders
+}
+
+# Scheduler jobs that never run in parallel with themselves
+SERIAL = {"refetch"}
+
+
+def _order_body(mode):
+    body = {
+        "customer_name": "Benchmark Customer",
+        "amount": 100,
+        "purpose": "Benchmark",
+        "mode": mode,
+        "clientRefId": uuid.uuid4().hex[:20]
+    }
+    if mode == "UPI":
+        body.update({
+            "customer_email": "customer@example.com",
+            "customer_phone": "9000000000",
+            "vpa": "customer@upi"
+        })
+    else:
+        body.update({"accountNo": "000011112222", "ifsc": "UBIN0000001", "bank": "UBI"})
+    return body
+
+
+def _api(method, path, merchant, body=None, headers=None):
+    headers = dict(headers or {})
+    if merchant:
+        headers["Authorization"] = merchant.token
+    return frappe._dict({"method": method, "path": path, "body": body, "headers": headers})
+
+
+def _portal(method, merchant, count, **params):
+    return [_api("GET", f"/api/method/{method}?{urlencode(params)}", merchant) for _i in range(count)]
+
+
+def _job(method, **kwargs):
+    return frappe._dict({"job": method, "kwargs": kwargs})
+
+
+def _run_scenario(env, calls, workers):
+    if not calls:
+        return {"requests": 0}
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda call: _execute(env, call), calls))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(elapsed * 1000 for elapsed, _queries, _ok in results)
+    return {
+        "requests": len(results),
+        "errors": sum(1 for _elapsed, _queries, ok in results if not ok),
+        "p50_ms": round(_percentile(latencies, 50), 2),
+        "p95_ms": round(_percentile(latencies, 95), 2),
+        "p99_ms": round(_percentile(latencies, 99), 2),
+        "mean_ms": round(sum(latencies) / len(latencies), 2),
+        "throughput_rps": round(len(results) / wall, 2),
+        "queries_per_request": round(sum(queries for _elapsed, queries, _ok in results) / len(results), 2)
+    }
+
+
+def _execute(env, call):
+    """
+    Time one call. Returns (seconds, queries, ok).
+    """
+    if call.get("job"):
+        return _run_job(env, call)
+
+    client = getattr(_local, "client", None)
+    if client is None:
+        client = _local.client = Client(application)
+
+    headers = dict(call.headers, **{"X-Frappe-Site-Name": env.site, "X-Real-Ip": fixtures.CLIENT_IP})
+    _local.queries = 0
+    started = time.perf_counter()
+    response = client.open(call.path, method=call.method, json=call.body, headers=headers)
+    elapsed = time.perf_counter() - started
+
+    return elapsed, _local.queries, response.status_code < 400 and not _is_error(response)
+
+
+def _run_job(env, call):
+    # A worker connects per job; only the job itself is timed
+    frappe.init(site=env.site, sites_path=env.sites_path)
+    frappe.connect()
+    try:
+        frappe.set_user("Administrator")
+        _local.queries = 0
+        started = time.perf_counter()
+        try:
+            frappe.get_attr(call.job)(**call.kwargs)
+            frappe.db.commit()
+            ok = True
+        except Exception:
+            frappe.db.rollback()
+            ok = False
+        return time.perf_counter() - started, _local.queries, ok
+    finally:
+        frappe.destroy()
+
+
+def _is_error(response):
+    # The order APIs answer failures with HTTP 200 and an error code
+    try:
+        message = json.loads(response.get_data()).get("message")
+    except (ValueError, AttributeError):
+        return False
+    return isinstance(message, dict) and message.get("code") not in (None, "0x0200")
+
+
+@contextmanager
+def _count_queries():
+    """
+    Count queries per thread, so each request sees only its own
+    """
+    db_class = type(frappe.db)
+    original = db_class.__dict__.get("sql")
+    inherited = db_class.sql
+
+    @wraps(inherited)
+    def sql(self, *args, **kwargs):
+        _local.queries = getattr(_local, "queries", 0) + 1
+        return inherited(self, *args, **kwargs)
+
+    db_class.sql = sql
+    try:
+        yield
+    finally:
+        if original:
+            db_class.sql = original
+        else:
+            del db_class.sql
+
+
+def _percentile(ordered, percent):
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(len(ordered) * percent / 100) - 1))]
+
+
+def _environment():
+    return {
+        "frappe": frappe.__version__,
+        "database": f"{frappe.db.db_type} {frappe.db.sql('SELECT VERSION()')[0][0]}",
+        "cpus": os.cpu_count()
+    }
+
+
+def _load_baseline():
+    if not os.path.exists(BASELINE_PATH):
+        return None
+    with open(BASELINE_PATH) as f:
+        return json.load(f)
+
+
+def _compare(report, baseline):
+    regressions = []
+    for name, current in report["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base or not base.get("requests") or not current.get("requests"):
+            continue
+
+        if current["p95_ms"] > base["p95_ms"] * (1 + TOLERANCE):
+            regressions.append(f"{name}: p95 {base['p95_ms']} -> {current['p95_ms']} ms")
+        if current["throughput_rps"] < base["throughput_rps"] * (1 - TOLERANCE):
+            regressions.append(f"{name}: throughput {base['throughput_rps']} -> {current['throughput_rps']} rps")
+        if current["queries_per_request"] > base["queries_per_request"] + QUERY_TOLERANCE:
+            regressions.append(
+                f"{name}: queries per request {base['queries_per_request']} -> {current['queries_per_request']}"
+            )
+    return regressions
+
+
+def _print(report):
+    print(f"{'scenario':<24}{'requests':>9}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'rps':>9}{'q/req':>8}")
+    for name, result in report["scenarios"].items():
+        if not result["requests"]:
+            print(f"{name:<24}{0:>9}  (nothing to run)")
+            continue
+        print(
+            f"{name:<24}{result['requests']:>9}{result['errors']:>8}{result['p50_ms']:>10}"
+            f"{result['p95_ms']:>10}{result['p99_ms']:>10}{result['throughput_rps']:>9}"
+            f"{result['queries_per_request']:>8}"
+        )
+
+    if report.get("unmeasured"):
+        print(f"Baseline has no measurements for: {', '.join(report['unmeasured'])}")
+    if report.get("baseline_settings"):
+        print(f"Baseline was recorded with different settings: {report['baseline_settings']}")
+    for regression in report.get("regressions", []):
+        print(f"REGRESSION {regression}")
@@ -0,0 +1,461 @@
+import io
+import json
+
+import frappe
+from frappe.model.naming import set_new_name
+from frappe.utils import now
+
+from .audit_log import start_request_log, log_response
+from .auth_context import get_auth_context, is_ip_allowed
+from .counts import clear_totals
+from .platform_fee import record_fees
+from .pricing import find_slabs
+from .refetch import first_check_at
+from .rollups import add_orders
+from .routing import choose_integration
+from .wallet_service import hold_funds, capture_hold, release_hold
+
+# Bulk payout orders
+# One request carries a whole payout batch, as a JSON array ({"orders": [...]})
+# or as NDJSON (one order per line, Content-Type application/x-ndjson). Rows are
+# handled in chunks: one validation pass, one clientRefId query, one pricing pass
+# per product, one wallet hold for the chunk total and multi-row inserts of
+# Order, Transaction, Ledger and Platform Fee Journal. Every row gets a result;
+# a rejected row never blocks the rest of its chunk.
+
+CHUNK_SIZE = 1000
+MAX_ROWS = 100000
+
+NDJSON_TYPES = ("application/x-ndjson", "application/jsonl", "application/json-lines")
+
+FIELDS = ["customer_name", "accountNo", "ifsc", "bank", "amount", "purpose", "mode", "clientRefId"]
+
+ORDER_FIELDS = [
+    "name", "creation", "modified", "owner", "modified_by", "docstatus",
+    "client_ref_id", "merchant_ref_id", "fee", "tax", "purpose", "status", "order_amount",
+    "product", "transaction_amount", "customer_name", "customer_account_number", "ifsc",
+    "bank", "integration_id", "routing_decision", "api_response", "next_check_at"
+]
+
+TRANSACTION_FIELDS = [
+    "name", "creation", "modified", "owner", "modified_by", "docstatus",
+    "order", "merchant", "amount", "status", "integration", "transaction_date", "product", "client_ref_id"
+]
+
+LEDGER_FIELDS = [
+    "name", "creation", "modified", "owner", "modified_by", "docstatus",
+    "order", "order_amount", "tax", "fee", "transaction_amount", "transaction_type", "status",
+    "transaction_id", "client_ref_id", "opening_balance", "closing_balance"
+]
+
+
+@frappe.whitelist()
+def create_bulk_orders():
+    """
+    Accept a batch of payout orders and return one result per row
+    """
+    ip_address = None
+    if frappe.request.headers.get('X-Real-Ip'):
+        ip_address = frappe.request.headers.get('X-Real-Ip').split(',')[0]
+    else:
+        ip_address = frappe.request.remote_addr
+
+    auth_header = frappe.get_request_header("Authorization")
+    batch_id = frappe.generate_hash(length=12)
+
+    request_response = start_request_log(
+        request={"batchId": batch_id, "format": frappe.request.mimetype}, header=auth_header
+    )
+
+    context, response = _authenticate(auth_header, ip_address)
+    if response:
+        log_response(request_response, response)
+        return response
+
+    results = []
+    seen = set()
+    chunk = []
+    chunk_index = 0
+
+    try:
+        for position, row in enumerate(_read_rows()):
+            if position >= MAX_ROWS:
+                response = {
+                    "code": "0x0404",
+                    "status": "VALIDATION_ERROR",
+                    "message": "Validation failed",
+                    "data": f"A batch can have at most {MAX_ROWS} orders. Rows from {MAX_ROWS + 1} were not processed."
+                }
+                break
+
+            chunk.append((position + 1, row))
+            if len(chunk) == CHUNK_SIZE:
+                results.extend(_process_chunk(context, chunk, seen, f"{batch_id}-{chunk_index}"))
+                chunk = []
+                chunk_index += 1
+
+        if chunk:
+            results.extend(_process_chunk(context, chunk, seen, f"{batch_id}-{chunk_index}"))
+    except Exception as e:
+        frappe.db.rollback()
+        frappe.log_error("Bulk Order Creation Error", frappe.get_traceback())
+        response = {
+            "code": "0x0500",
+            "status": "ERROR",
+            "message": "Error in bulk order creation",
+            "data": str(e)
+        }
+
+    accepted = sum(1 for result in results if result["code"] == "0x0200")
+    summary = {
+        "batchId": batch_id,
+        "total": len(results),
+        "accepted": accepted,
+        "rejected": len(results) - accepted,
+        "results": results
+    }
+
+    if response:
+        # Rows processed before the error keep their results
+        response["batch"] = summary
+    elif not results:
+        response = {
+            "code": "0x0203",
+            "status": "MISSING_PARAMETER",
+            "message": {"orders": ["orders is missing."]}
+        }
+    else:
+        response = {
+            "code": "0x0200",
+            "message": "Batch processed",
+            "status": "SUCCESS",
+            "data": summary
+        }
+
+    log_response(request_response, response)
+    return response
+
+
+def _authenticate(auth_header, ip_address):
+    """
+    Resolve the merchant context of a request. Returns (context, error response).
+    """
+    if not auth_header or not auth_header.lower().startswith("token "):
+        return None, {
+            "code": "0x0401",
+            "status": "MISSING_HEADER",
+            "message": "Authorization header is missing."
+        }
+
+    # Frappe has already checked the key and secret of the token header; the
+    # key only picks the merchant context
+    try:
+        api_key, _ = auth_header[6:].strip().split(":")
+    except ValueError as e:
+        frappe.log_error("Error in header extraction", str(e))
+        return None, {
+            "code": "0x0401",
+            "status": "MISSING_HEADER",
+            "message": "Error in token format. Please verify and try again."
+        }
+
+    context = get_auth_context(api_key)
+    frappe.set_user(context.user if context else None)
+
+    if not is_ip_allowed(context, ip_address):
+        return None, {
+            "code": "0x0401",
+            "status": "UNAUTHORIZED ACCESS",
+            "message": f"Originating IP {ip_address} is blocked by central firewall system. This incident will be reported."
+        }
+
+    if context.user == "Guest" or not context.merchant:
+        return None, {
+            "code": "0x0401",
+            "status": "UNAUTHORIZED",
+            "message": "Authentication required"
+        }
+
+    error = None
+    if context.merchant_status != "Approved":
+        error = f"Your Account is in {context.merchant_status} stage. Please contact Admin"
+    elif not context.integration:
+        error = "Processor isn't configured yet to process your order. Please try after sometime."
+    elif context.wallet_status != "Active":
+        error = f"Your Wallet is {context.wallet_status}. Please contact Admin"
+
+    if error:
+        return None, {
+            "code": "0x0404",
+            "status": "VALIDATION_ERROR",
+            "message": "Validation failed",
+            "data": error
+        }
+
+    return context, None
+
+
+def _read_rows():
+    """
+    Yield the orders of the request body, None for an unreadable NDJSON line
+    """
+    if frappe.request.mimetype in NDJSON_TYPES:
+        # Lines are parsed as they are consumed, so only the current chunk of
+        # orders is held as Python objects
+        for line in io.BytesIO(frappe.request.get_data()):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
+        return
+
+    data = frappe.request.get_json(silent=True)
+    rows = data.get("orders") if isinstance(data, dict) else data
+    if isinstance(rows, list):
+        yield from rows
+
+
+def _process_chunk(context, chunk, seen, hold_ref):
+    results = {}
+    valid = []
+
+    # Validation pass
+    for row_number, row in chunk:
+        error = _validate_row(context, row, seen)
+        if error:
+            results[row_number] = _rejected(row_number, row, *error)
+        else:
+            seen.add(row["clientRefId"])
+            valid.append((row_number, row))
+
+    # clientRefIds already used by earlier orders, in one query
+    if valid:
+        existing = {
+            order.client_ref_id: order for order in frappe.get_all(
+                "Order",
+                filters={"client_ref_id": ["in", [row["clientRefId"] for _row_number, row in valid]]},
+                fields=["name", "client_ref_id", "merchant_ref_id", "status"]
+            )
+        }
+        pending = []
+        for row_number, row in valid:
+            order = existing.get(row["clientRefId"])
+            if not order:
+                pending.append((row_number, row))
+            elif order.merchant_ref_id == context.merchant:
+                # A resubmitted row of an earlier batch
+                results[row_number] = _accepted(row_number, row["clientRefId"], order.name, order.status)
+            else:
+                results[row_number] = _rejected(
+                    row_number, row, "0x0203", "MISSING_PARAMETER",
+                    {"clientRefId": ["Client Ref Id already exists."]}
+                )
+        valid = pending
+
+    # Pricing, one pass over the slabs per product
+    priced = []
+    by_product = {}
+    for row_number, row in valid:
+        by_product.setdefault(str(row["mode"]).upper(), []).append((row_number, row))
+
+    for product, rows in by_product.items():
+        slabs = find_slabs(context.pricing, product, [float(row["amount"]) for _row_number, row in rows])
+        for (row_number, row), pricing in zip(rows, slabs):
+            if not pricing:
+                results[row_number] = _rejected(
+                    row_number, row, "0x0404", "VALIDATION_ERROR",
+                    "This payment mode or transaction limit is not active for you. Please contact Admin"
+                )
+                continue
+
+            order_amount = float(row["amount"])
+
+            # Routing health is cached per worker, so this is not a lookup per row
+            route = choose_integration(context, product, order_amount)
+            if not route:
+                results[row_number] = _rejected(
+                    row_number, row, "0x0404", "VALIDATION_ERROR",
+                    "This payment mode is not active for now. Please contact Admin"
+                )
+                continue
+            if not route.integration:
+                results[row_number] = _rejected(
+                    row_number, row, "0x0500", "SERVER_DOWN",
+                    {f"{row['mode']}": [f"{row['mode']} payment mode is down. Please try again after sometime."]}
+                )
+                continue
+
+            fee = float(pricing.get("fee", 0))
+            tax = 0
+            if pricing["fee_type"] == "Percentage":
+                fee = (order_amount * float(pricing.get("fee", 0))) / 100
+            if pricing["tax_fee_type"] == "Percentage":
+                tax = (fee * float(pricing.get("tax_fee", 0))) / 100
+
+            priced.append(frappe._dict({
+                "row_number": row_number,
+                "row": row,
+                "product": product,
+                "integration": route.integration,
+                "routing_decision": route.decision,
+                "order_amount": order_amount,
+                "fee": fee,
+                "tax": tax,
+                "total_amount": order_amount + fee + tax
+            }))
+
+    if priced:
+        priced.sort(key=lambda order: order.row_number)
+        results.update(_create_orders(context, priced, hold_ref))
+
+    return [results[row_number] for row_number, _row in chunk]
+
+
+def _validate_row(context, row, seen):
+    """
+    Return (code, status, message) for an invalid row, or None
+    """
+    if not isinstance(row, dict):
+        return "0x0203", "MISSING_PARAMETER", "Order is not a valid JSON object."
+
+    for field in FIELDS:
+        if field not in row or not row[field]:
+            return "0x0203", "MISSING_PARAMETER", {f"{field}": [f"{field} is missing."]}
+
+    mode = str(row["mode"]).upper()
+    if mode == "UPI":
+        return "0x0404", "VALIDATION_ERROR", "UPI orders cannot be submitted in a bulk payout."
+
+    if mode not in context.products:
+        return "0x0500", "SERVER_DOWN", {
+            f"{row['mode']}": [f"{row['mode']} payment mode is down. Please try again after sometime."]
+        }
+
+    try:
+        amount = float(row["amount"])
+    except (TypeError, ValueError):
+        amount = 0
+    if amount <= 0:
+        return "0x0404", "VALIDATION_ERROR", "amount must be a positive number."
+
+    if row["clientRefId"] in seen:
+        return "0x0203", "MISSING_PARAMETER", {"clientRefId": ["Client Ref Id is repeated in this batch."]}
+
+    return None
+
+
+def _create_orders(context, priced, hold_ref):
+    """
+    Hold the chunk total once and insert its documents in one transaction
+    """
+    held = hold_funds(context.merchant, sum(order.total_amount for order in priced), hold_ref)
+    if not held:
+        message = "Insufficient wallet balance"
+        if not frappe.db.exists("Wallet", context.merchant):
+            message = "No active wallet found"
+        return {
+            order.row_number: _rejected(order.row_number, order.row, "0x0404", "VALIDATION_ERROR", message)
+            for order in priced
+        }
+
+    try:
+        results = _insert_orders(context, priced, held)
+        capture_hold(held.hold)
+        frappe.db.commit()
+        return results
+    except Exception as e:
+        frappe.db.rollback()
+        release_hold(held.hold)
+        frappe.log_error("Bulk Order Creation Error", frappe.get_traceback())
+        return {
+            order.row_number: _rejected(order.row_number, order.row, "0x0500", "ERROR", str(e))
+            for order in priced
+        }
+
+
+def _insert_orders(context, priced, held):
+    timestamp = now()
+    user = frappe.session.user
+    balance = held.opening_balance
+    next_check_at = first_check_at()
+
+    orders, transactions, ledgers, fees = [], [], [], []
+    results = {}
+
+    for order in priced:
+        row = order.row
+
+        # Names come from the Order naming series, as for single orders
+        doc = frappe.new_doc("Order")
+        set_new_name(doc)
+        result = _accepted(order.row_number, row["clientRefId"], doc.name, "Queued")
+        results[order.row_number] = result
+
+        response = {
+            "code": "0x0200",
+            "message": "Order accepted successfully",
+            "status": "SUCCESS",
+            "data": {"clientRefId": row["clientRefId"], "orderRefId": doc.name, "status": "Queued"}
+        }
+        orders.append((
+            doc.name, timestamp, timestamp, user, user, 0,
+            row["clientRefId"], context.merchant, order.fee, order.tax, row["purpose"], "Queued",
+            order.order_amount, order.product, order.total_amount, row["customer_name"],
+            row["accountNo"], row["ifsc"], str(row["bank"]).upper(), order.integration,
+            order.routing_decision, json.dumps(response), next_check_at
+        ))
+
+        transaction = frappe.generate_hash(length=10)
+        transactions.append((
+            transaction, timestamp, timestamp, user, user, 0,
+            doc.name, context.merchant, order.order_amount, "Processing", order.integration,
+            timestamp, order.product, row["clientRefId"]
+        ))
+
+        ledgers.append((
+            frappe.generate_hash(length=10), timestamp, timestamp, user, user, 1,
+            doc.name, order.order_amount, order.tax, order.fee, order.total_amount, "Debit", "Success",
+            transaction, row["clientRefId"], balance, balance - order.total_amount
+        ))
+        balance -= order.total_amount
+
+        fees.append({
+            "merchant": context.merchant,
+            "client_ref_id": row["clientRefId"],
+            "order": doc.name,
+            "fee": order.fee,
+            "tax": order.tax
+        })
+
+    frappe.db.bulk_insert("Order", fields=ORDER_FIELDS, values=orders)
+    frappe.db.bulk_insert("Transaction", fields=TRANSACTION_FIELDS, values=transactions)
+    frappe.db.bulk_insert("Ledger", fields=LEDGER_FIELDS, values=ledgers)
+    record_fees(fees)
+    add_orders(frappe._dict(zip(ORDER_FIELDS, order)) for order in orders)
+    clear_totals("Order", [context.merchant])
+    clear_totals("Ledger", [user])
+
+    return results
+
+
+def _accepted(row_number, client_ref_id, order, status):
+    return {
+        "row": row_number,
+        "clientRefId": client_ref_id,
+        "code": "0x0200",
+        "status": "SUCCESS",
+        "data": {"orderRefId": order, "status": status}
+    }
+
+
+def _rejected(row_number, row, code, status, message):
+    return {
+        "row": row_number,
+        "clientRefId": row.get("clientRefId") if isinstance(row, dict) else None,
+        "code": code,
+        "status": status,
+        "message": message
+    }
@@ -0,0 +1,116 @@
+import hashlib
+import json
+from functools import partial
+
+import frappe
+from frappe.utils import cint
+
+from .utils import after_commit
+
+# Listing totals
+# The portal listings show a total next to the page. Counting it exactly costs a
+# scan of every matching row, which for a large merchant is more work than the
+# page itself, so:
+#   - exact totals are cached per (doctype, filters) for COUNT_TTL seconds. Every
+#     insert into a listed doctype moves the generation of its merchant (and of
+#     the all-merchants scope), which retires the cached totals at once. Status
+#     changes are not tracked and show up within the TTL.
+#   - an unfiltered listing (admin views) gets the table statistics estimate,
+#     flagged as approximate; the caller asks for exact=True when it needs more
+#
+# Rows written by bulk_insert skip the doc events; those paths call clear_totals.
+
+COUNT_TTL = 60
+ESTIMATE_TTL = 300
+
+GENERATION_KEY = "iswitch:count_generation"
+ALL_MERCHANTS = "all"
+
+# Field holding the scope a listing is filtered by
+SCOPE_FIELDS = {
+    "Order": "merchant_ref_id",
+    "Ledger": "owner",
+    "Virtual Account Logs": "owner"
+}
+
+
+def get_total(doctype, alias, conditions, values, scope=None, exact=False):
+    """
+    Return (total, approximate) of a listing query
+    """
+    if not exact and all(condition == "1=1" for condition in conditions):
+        estimate = get_estimate(doctype)
+        if estimate is not None:
+            return estimate, True
+
+    cache = frappe.cache()
+    key = _total_key(doctype, scope, conditions, values)
+    total = cache.get_value(key)
+    if total is None:
+        total = frappe.db.sql(f"""
+            SELECT COUNT(*)
+            FROM `tab{doctype}` {alias}
+            WHERE {" AND ".join(conditions)}
+        """, values)[0][0]
+        cache.set_value(key, total, expires_in_sec=COUNT_TTL)
+    return cint(total), False
+
+
+def get_estimate(doctype):
+    """
+    Row count of the table statistics, or None when the database has none
+    """
+    cache = frappe.cache()
+    key = f"iswitch:count_estimate:{doctype}"
+    estimate = cache.get_value(key)
+    if estimate is not None:
+        return estimate
+
+    if frappe.db.db_type == "postgres":
+        rows = frappe.db.sql("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", f"tab{doctype}")
+    else:
+        rows = frappe.db.sql("""
+            SELECT TABLE_ROWS
+            FROM information_schema.TABLES
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+        """, f"tab{doctype}")
+
+    if not rows or rows[0][0] is None or rows[0][0] < 0:
+        return None
+
+    estimate = cint(rows[0][0])
+    cache.set_value(key, estimate, expires_in_sec=ESTIMATE_TTL)
+    return estimate
+
+
+def clear_totals(doctype, scopes=()):
+    """
+    Retire the cached totals of a doctype for the given scopes and all merchants
+    """
+    scopes = {ALL_MERCHANTS, *(scope for scope in scopes if scope)}
+    after_commit(partial(_bump_generations, doctype, scopes), run_now=True)
+
+
+def on_listed_insert(doc, method=None):
+    """
+    after_insert / on_submit of the listed doctypes
+    """
+    clear_totals(doc.doctype, [doc.get(SCOPE_FIELDS[doc.doctype])])
+
+
+def _total_key(doctype, scope, conditions, values):
+    fingerprint = hashlib.sha1(
+        json.dumps([conditions, values], sort_keys=True, default=str).encode()
+    ).hexdigest()
+    generation = frappe.cache().get_value(_generation_key(doctype, scope or ALL_MERCHANTS)) or 0
+    return f"iswitch:count:{doctype}:{generation}:{fingerprint}"
+
+
+def _generation_key(doctype, scope):
+    return f"{GENERATION_KEY}:{doctype}:{scope}"
+
+
+def _bump_generations(doctype, scopes):
+    cache = frappe.cache()
+    for scope in scopes:
+        cache.set_value(_generation_key(doctype, scope), frappe.generate_hash(length=10))
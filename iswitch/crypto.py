@@ -0,0 +1,274 @@
+import hashlib
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+import frappe
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from frappe.utils.password import get_decrypted_password
+
+from .utils import after_commit
+
+# Bank payload key derivation
+# Bank payloads are AES-GCM encrypted with a key derived from the shared
+# passphrase by PBKDF2-HMAC-SHA256 (65536 iterations) over a salt that travels
+# at the end of every message. Deriving costs far more CPU than the cipher, so:
+#   - derived keys are kept in an in-process LRU keyed by (passphrase
+#     fingerprint, salt); a repeated salt skips PBKDF2
+#   - outgoing messages reuse one random salt and its key per passphrase for
+#     bank_salt_rotation seconds (site config, default 300) or KEY_MAX_USES
+#     messages. Every message still gets a fresh random IV and carries its salt,
+#     so the wire format is unchanged and the bank derives the key as before.
+#   - the Global Config passphrase is decrypted once per worker and refreshed
+#     when Global Config is saved (the generation key moves)
+#
+# With bank_crypto_pool_size set in the site config, key derivations that miss
+# the cache run in a pool of that many processes instead of the request thread,
+# so a burst of bank callbacks uses at most that many cores. Derivations queue
+# for the pool (up to bank_crypto_max_pending) and are sent in batches of what
+# has queued up meanwhile; when the queue is full or the pool does not answer
+# in POOL_TIMEOUT, the caller derives inline as before.
+
+ITERATIONS = 65536
+KEY_LENGTH = 32
+SALT_LENGTH = 16
+
+KEY_CACHE_SIZE = 1024
+DEFAULT_ROTATION = 300
+
+# Bound on messages encrypted under one salt, well inside the GCM random-IV limit
+KEY_MAX_USES = 2 ** 20
+
+PASSPHRASE_GENERATION_KEY = "iswitch:passphrase_generation"
+
+DEFAULT_MAX_PENDING = 64
+# A batch runs in one pool process; small batches keep every process busy
+BATCH_SIZE = 4
+POOL_TIMEOUT = 5
+
+_keys = OrderedDict()
+_outgoing = {}
+_passphrases = {}
+_lock = threading.Lock()
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def derive_key(password, salt):
+    """
+    AES key for a passphrase and salt, from the LRU when it was derived before
+    """
+    cache_key = (fingerprint(password), bytes(salt))
+    with _lock:
+        key = _keys.get(cache_key)
+        if key is not None:
+            _keys.move_to_end(cache_key)
+            return key
+
+    key = _derive_in_pool(password, salt) or pbkdf2(password, salt)
+    with _lock:
+        _keys[cache_key] = key
+        if len(_keys) > KEY_CACHE_SIZE:
+            _keys.popitem(last=False)
+    return key
+
+
+def get_encryption_key(password):
+    """
+    Return (salt, key) for an outgoing message, rotated by age and use count
+    """
+    passphrase_id = fingerprint(password)
+    rotation = frappe.utils.cint(frappe.conf.get("bank_salt_rotation", DEFAULT_ROTATION))
+    now = time.monotonic()
+
+    with _lock:
+        entry = _outgoing.get(passphrase_id)
+        if entry and entry[0] > now and entry[3] < KEY_MAX_USES:
+            entry[3] += 1
+            return entry[1], entry[2]
+
+    salt = os.urandom(SALT_LENGTH)
+    key = derive_key(password, salt)
+    if rotation > 0:
+        with _lock:
+            # expires, salt, key, uses
+            _outgoing[passphrase_id] = [now + rotation, salt, key, 1]
+    return salt, key
+
+
+def pbkdf2(password, salt):
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=KEY_LENGTH,
+        salt=salt,
+        iterations=ITERATIONS,
+        backend=default_backend()
+    )
+    return kdf.derive(password.encode("UTF-8"))
+
+
+def derive_batch(jobs):
+    """
+    Pool task: derive the key of every (password, salt) in a batch
+    """
+    return [pbkdf2(password, salt) for password, salt in jobs]
+
+
+def fingerprint(password):
+    # Cache keys never hold the passphrase itself
+    return hashlib.sha256(password.encode("UTF-8")).digest()
+
+
+def get_passphrase():
+    """
+    Bank passphrase of Global Config, decrypted once per worker
+    """
+    generation = frappe.cache().get_value(PASSPHRASE_GENERATION_KEY)
+    entry = _passphrases.get(frappe.local.site)
+    if entry and entry[0] == generation:
+        return entry[1]
+
+    passphrase = get_decrypted_password("Global Config", "Global Config", "passphrase", raise_exception=False)
+    if not passphrase:
+        # The field is declared as "passpharse" on Global Config
+        passphrase = get_decrypted_password("Global Config", "Global Config", "passpharse", raise_exception=False)
+    if not passphrase:
+        frappe.throw("Bank passphrase is not set in Global Config")
+
+    _passphrases[frappe.local.site] = (generation, passphrase)
+    return passphrase
+
+
+def clear_passphrase(doc=None, method=None):
+    """
+    Global Config on_update: make every worker decrypt the passphrase again
+    """
+    after_commit(partial(_bump_passphrase_generation, frappe.local.site), run_now=True)
+
+
+def clear_key_cache():
+    with _lock:
+        _keys.clear()
+        _outgoing.clear()
+
+
+def _bump_passphrase_generation(site):
+    frappe.cache().set_value(PASSPHRASE_GENERATION_KEY, frappe.generate_hash(length=10))
+    _passphrases.pop(site, None)
+
+
+class _CryptoPool:
+    """
+    Process pool fed by one batching thread through a bounded queue
+    """
+
+    def __init__(self, size, max_pending):
+        self.size = size
+        self.executor = ProcessPoolExecutor(max_workers=size, mp_context=multiprocessing.get_context("spawn"))
+        self.pending = queue.Queue(maxsize=max_pending)
+        # Batches handed to the pool but not finished; more would only queue inside it
+        self.slots = threading.BoundedSemaphore(size)
+        self.broken = False
+        threading.Thread(target=self._dispatch, name="bank_crypto", daemon=True).start()
+
+    def submit(self, password, salt):
+        """
+        Queue a derivation, or return None when the queue is full
+        """
+        future = Future()
+        try:
+            self.pending.put_nowait((password, salt, future))
+        except queue.Full:
+            return None
+        return future
+
+    def _dispatch(self):
+        while not self.broken:
+            batch = [self.pending.get()]
+            self.slots.acquire()
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                task = self.executor.submit(derive_batch, [(password, salt) for password, salt, _future in batch])
+            except (BrokenProcessPool, RuntimeError) as e:
+                self.slots.release()
+                self.broken = True
+                _fail(batch + self._drain(), e)
+                break
+            task.add_done_callback(partial(self._resolve, batch))
+
+    def _drain(self):
+        items = []
+        while True:
+            try:
+                items.append(self.pending.get_nowait())
+            except queue.Empty:
+                return items
+
+    def _resolve(self, batch, task):
+        self.slots.release()
+        try:
+            keys = task.result()
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                self.broken = True
+            _fail(batch, e)
+            return
+        for (_password, _salt, future), key in zip(batch, keys):
+            future.set_result(key)
+
+
+def get_pool():
+    """
+    Crypto pool of this worker process, or None when bank_crypto_pool_size is off
+    """
+    global _pool
+
+    size = frappe.utils.cint(frappe.conf.get("bank_crypto_pool_size"))
+    if size <= 0:
+        return None
+    if _pool and not _pool.broken:
+        return _pool
+
+    with _pool_lock:
+        if not _pool or _pool.broken:
+            if _pool:
+                _pool.executor.shutdown(wait=False, cancel_futures=True)
+            max_pending = frappe.utils.cint(frappe.conf.get("bank_crypto_max_pending")) or DEFAULT_MAX_PENDING
+            _pool = _CryptoPool(size, max_pending)
+    return _pool
+
+
+def _derive_in_pool(password, salt):
+    """
+    Key derived by the crypto pool, or None to derive inline (pool off, full or failing)
+    """
+    pool = get_pool()
+    if not pool:
+        return None
+
+    future = pool.submit(password, bytes(salt))
+    if future is None:
+        return None
+    try:
+        return future.result(timeout=POOL_TIMEOUT)
+    except Exception:
+        return None
+
+
+def _fail(batch, error):
+    for _password, _salt, future in batch:
+        if not future.done():
+            future.set_exception(error)
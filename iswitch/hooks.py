@@ -139,13 +139,72 @@ app_license = "mit"
 
 doc_events = {
 	"Ledger":{
-		"on_submit": "iswitch.transaction_processing.handle_transaction"
+		"on_submit": [
+			"iswitch.transaction_processing.handle_transaction",
+			"iswitch.counts.on_listed_insert"
+		]
+	},
+	"Order":{
+		"after_insert": [
+			"iswitch.counts.on_listed_insert",
+			"iswitch.rollups.record_order"
+		],
+		"on_update": "iswitch.rollups.on_order_update"
+	},
+	"Virtual Account Logs":{
+		"on_submit": [
+			"iswitch.counts.on_listed_insert",
+			"iswitch.rollups.record_van_log"
+		]
 	},
 	"Blinkpe Webhook":{
 		"on_submit": "iswitch.webhook.process_webhook"
 	},
 	"Payin":{
 		"on_submit": "iswitch.zip_extractor.process_payin_zip"
+	},
+	"Merchant":{
+		"validate": "iswitch.pricing.validate_pricing",
+		"on_update": [
+			"iswitch.pricing.rebuild_pricing",
+			"iswitch.auth_context.on_merchant_change",
+			"iswitch.merchant_webhooks.clear_endpoint"
+		],
+		"on_trash": [
+			"iswitch.pricing.clear_pricing",
+			"iswitch.auth_context.on_merchant_change",
+			"iswitch.merchant_webhooks.clear_endpoint"
+		]
+	},
+	"Wallet":{
+		"on_update": "iswitch.auth_context.on_wallet_change",
+		"on_trash": "iswitch.auth_context.on_wallet_change"
+	},
+	"Whitelist IP":{
+		"on_update": "iswitch.auth_context.on_whitelist_ip_change",
+		"on_trash": "iswitch.auth_context.on_whitelist_ip_change"
+	},
+	"User":{
+		"on_update": "iswitch.auth_context.on_user_change",
+		"on_trash": "iswitch.auth_context.on_user_change"
+	},
+	"Product":{
+		"on_update": "iswitch.auth_context.on_shared_change",
+		"on_trash": "iswitch.auth_context.on_shared_change"
+	},
+	"Integration":{
+		"validate": "iswitch.pricing.validate_pricing",
+		"on_update": [
+			"iswitch.pricing.rebuild_pricing",
+			"iswitch.auth_context.on_shared_change"
+		],
+		"on_trash": [
+			"iswitch.pricing.clear_pricing",
+			"iswitch.auth_context.on_shared_change"
+		]
+	},
+	"Global Config":{
+		"on_update": "iswitch.crypto.clear_passphrase"
 	}
 }
 
@@ -163,8 +222,20 @@ doc_events = {
 
 scheduler_events = {
 	"cron": {
+		"* * * * *": [
+			"iswitch.audit_log.flush_request_logs",
+			"iswitch.platform_fee.roll_up_platform_fees",
+			"iswitch.refetch.schedule_requery",
+			"iswitch.webhook_queue.schedule_drain",
+			"iswitch.merchant_webhooks.schedule_dispatch"
+		],
+		"*/5 * * * *": [
+			"iswitch.wallet_service.release_expired_holds"
+		],
+		"0 2 * * *": [
+			"iswitch.rollups.check_rollups"
+		],
         "*/10 * * * *": [
-            "iswitch.refetch.update_record",
 			"iswitch.email_reader.process_gmail_emails"
         ]
     }
@@ -180,6 +251,7 @@ scheduler_events = {
 #
 override_whitelisted_methods = {
 	"order": "iswitch.api.create_order",
+	"bulk_order": "iswitch.bulk_order.create_bulk_orders",
 	"init_upi": "iswitch.upi.initiate_upi",
 	"onboard_merchant": "iswitch.auth.signup",
 	"generate_token": "iswitch.auth.login",
@@ -201,7 +273,8 @@ override_whitelisted_methods = {
 	"van_report": "iswitch.api.get_van_report",
 	"processor_balance": "iswitch.wallet.get_wallet_balance",
 	"authenticate": "iswitch.bank.bank_login",
-	"callback": "iswitch.bank.bank_webhook"
+	"callback": "iswitch.bank.bank_webhook",
+	"metrics": "iswitch.tracing.get_metrics"
 }
 #
 # each overriding function accepts a `data` argument;
@@ -229,11 +302,13 @@ override_whitelisted_methods = {
 # ----------------
 # before_request = ["iswitch.utils.before_request"]
 # after_request = ["iswitch.utils.after_request"]
+after_request = ["iswitch.tracing.flush_spans"]
 
 # Job Events
 # ----------
 # before_job = ["iswitch.utils.before_job"]
 # after_job = ["iswitch.utils.after_job"]
+after_job = ["iswitch.tracing.flush_spans"]
 
 # User Data Protection
 # --------------------
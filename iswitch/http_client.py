@@ -0,0 +1,210 @@
+import threading
+import time
+
+import frappe
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .routing import record_outcome
+
+# Outbound HTTP client registry
+# One pooled keep-alive Session per Integration and worker process, so processor
+# calls reuse open TCP/TLS connections instead of a handshake per call. Timeouts,
+# retry budget and pool size come from the Integration. Retries are only made for
+# idempotent calls (GET, and enquiries flagged idempotent=True); a payout POST is
+# sent at most once. Every call records its latency for metrics; calls made for
+# an order product also feed the routing health of that Integration and product.
+
+DEFAULT_CONFIG = {
+    "connect_timeout": 5.0,
+    "read_timeout": 30.0,
+    "max_retries": 2,
+    "pool_size": 10
+}
+
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "OPTIONS"])
+RETRY_STATUSES = (502, 503, 504)
+RETRY_BACKOFF = 0.2
+
+METRICS_KEY = "iswitch:http_metrics"
+LATENCY_KEY = "iswitch:http_latency"
+LATENCY_SAMPLES = 200
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+class Client:
+    """
+    Sessions of one Integration: one that only retries idempotent methods and one
+    for calls the caller declares idempotent
+    """
+
+    def __init__(self, name, config):
+        self.name = name
+        self.config = config
+        self.timeout = (config["connect_timeout"], config["read_timeout"])
+        self.session = self._session(IDEMPOTENT_METHODS)
+        self.idempotent_session = None
+        self._lock = threading.Lock()
+
+    def get_session(self, method, idempotent=None):
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        if not idempotent:
+            return self.session
+        if self.idempotent_session is None:
+            with self._lock:
+                if self.idempotent_session is None:
+                    # Retry on any method; only used for calls marked idempotent
+                    self.idempotent_session = self._session(None)
+        return self.idempotent_session
+
+    def close(self):
+        for session in (self.session, self.idempotent_session):
+            if session:
+                session.close()
+
+    def _session(self, allowed_methods):
+        # Connection failures are retried for every method: nothing was sent
+        retries = Retry(
+            total=self.config["max_retries"],
+            connect=self.config["max_retries"],
+            read=self.config["max_retries"],
+            status=self.config["max_retries"],
+            allowed_methods=allowed_methods,
+            status_forcelist=RETRY_STATUSES,
+            backoff_factor=RETRY_BACKOFF,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(
+            pool_connections=self.config.get("pool_connections", 1),
+            pool_maxsize=self.config["pool_size"],
+            max_retries=retries
+        )
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+
+def get_client(name):
+    """
+    Return the pooled client of an Integration (or other named endpoint), rebuilt
+    when its configuration changes
+    """
+    config = _load_config(name)
+
+    client = _clients.get(name)
+    if client and client.config == config:
+        return client
+
+    with _clients_lock:
+        client = _clients.get(name)
+        if client and client.config == config:
+            return client
+        if client:
+            client.close()
+        client = _clients[name] = Client(name, config)
+    return client
+
+
+def request(name, method, url, idempotent=None, timeout=None, product=None, **kwargs):
+    """
+    Send a request through the pooled client of an Integration.
+    idempotent=True allows retries of a non-GET call that is safe to repeat.
+    product reports the outcome to processor routing.
+    """
+    client = get_client(name)
+    response, elapsed, error = send(client, method, url, idempotent, timeout, **kwargs)
+    record_call(name, elapsed, response.status_code if response is not None else None, product)
+    if error:
+        raise error
+    return response
+
+
+def send(client, method, url, idempotent=None, timeout=None, **kwargs):
+    """
+    Send a request through a client without touching the site, so it can run in a
+    worker thread. Returns (response, elapsed seconds, error); the calling thread
+    records it with record_call.
+    """
+    session = client.get_session(method, idempotent)
+    started = time.perf_counter()
+    try:
+        response = session.request(method, url, timeout=timeout or client.timeout, **kwargs)
+    except Exception as e:
+        return None, time.perf_counter() - started, e
+    return response, time.perf_counter() - started, None
+
+
+def get(name, url, **kwargs):
+    return request(name, "GET", url, **kwargs)
+
+
+def post(name, url, **kwargs):
+    return request(name, "POST", url, **kwargs)
+
+
+def get_call_stats(name):
+    """
+    Call count, error count, mean latency and recent latencies (ms) of an Integration
+    """
+    cache = frappe.cache()
+    try:
+        counters = cache.hgetall(cache.make_key(f"{METRICS_KEY}:{name}")) or {}
+        samples = cache.lrange(cache.make_key(f"{LATENCY_KEY}:{name}"), 0, -1) or []
+    except Exception:
+        return None
+
+    counters = {_text(key): float(value) for key, value in counters.items()}
+    count = counters.get("count", 0)
+    return frappe._dict({
+        "count": int(count),
+        "errors": int(counters.get("errors", 0)),
+        "mean_ms": counters.get("total_ms", 0) / count if count else None,
+        "recent_ms": [float(sample) for sample in samples]
+    })
+
+
+def _load_config(name):
+    try:
+        integration = frappe.get_cached_doc("Integration", name)
+    except frappe.DoesNotExistError:
+        frappe.clear_last_message()
+        return dict(DEFAULT_CONFIG)
+
+    config = {}
+    for field, default in DEFAULT_CONFIG.items():
+        value = integration.get(field)
+        config[field] = type(default)(value) if value else default
+    return config
+
+
+def record_call(name, elapsed, status_code, product=None):
+    elapsed_ms = round(elapsed * 1000, 3)
+    failed = status_code is None or status_code >= 500
+
+    cache = frappe.cache()
+    try:
+        pipeline = cache.pipeline(transaction=False)
+        metrics_key = cache.make_key(f"{METRICS_KEY}:{name}")
+        latency_key = cache.make_key(f"{LATENCY_KEY}:{name}")
+        pipeline.hincrby(metrics_key, "count", 1)
+        pipeline.hincrbyfloat(metrics_key, "total_ms", elapsed_ms)
+        if failed:
+            pipeline.hincrby(metrics_key, "errors", 1)
+        pipeline.lpush(latency_key, elapsed_ms)
+        pipeline.ltrim(latency_key, 0, LATENCY_SAMPLES - 1)
+        pipeline.execute()
+    except Exception:
+        # Metrics must never fail a processor call
+        pass
+
+    if product:
+        record_outcome(name, product, failed, elapsed_ms)
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
@@ -0,0 +1,121 @@
+import json
+from functools import partial
+
+import frappe
+
+from .utils import after_commit
+
+# Idempotency store
+# Order requests are keyed by (merchant, clientRefId). The first successful
+# response is kept in Redis and on the Order itself, so a merchant retrying a
+# request gets that exact response back without validation, pricing or a wallet
+# hold. A Redis miss falls back to the unique client_ref_id index on Order.
+
+KEY_PREFIX = "iswitch:idempotency"
+IN_PROGRESS = "in_progress"
+
+# A claim covers one request from wallet hold to commit
+CLAIM_TTL = 120
+RESPONSE_TTL = 24 * 60 * 60
+
+DUPLICATE_RESPONSE = {
+    "code": "0x0203",
+    "status": "MISSING_PARAMETER",
+    "message": {"clientRefId": ["Client Ref Id already exists."]}
+}
+
+IN_PROGRESS_RESPONSE = {
+    "code": "0x0203",
+    "status": "MISSING_PARAMETER",
+    "message": {"clientRefId": ["A request with this Client Ref Id is already being processed."]}
+}
+
+
+def get_replay(merchant, client_ref_id):
+    """
+    Return the response to replay for an already seen (merchant, clientRefId), or None
+    """
+    if not client_ref_id:
+        return None
+
+    value = _get(merchant, client_ref_id)
+    if value == IN_PROGRESS:
+        return IN_PROGRESS_RESPONSE
+    if value:
+        return json.loads(value)
+
+    order = frappe.db.get_value(
+        "Order", {"client_ref_id": client_ref_id},
+        ["name", "client_ref_id", "merchant_ref_id", "status", "api_response"], as_dict=True
+    )
+    if not order:
+        return None
+    if order.merchant_ref_id != merchant:
+        return DUPLICATE_RESPONSE
+
+    response = json.loads(order.api_response) if order.api_response else _accepted_response(order)
+    _set(merchant, client_ref_id, json.dumps(response), RESPONSE_TTL)
+    return response
+
+
+def claim_request(merchant, client_ref_id):
+    """
+    Mark a clientRefId as being processed. False when another request holds it.
+    Without Redis the unique index on Order still rejects the second insert.
+    """
+    try:
+        return bool(frappe.cache().set(_key(merchant, client_ref_id), IN_PROGRESS, nx=True, ex=CLAIM_TTL))
+    except Exception:
+        return True
+
+
+def release_request(merchant, client_ref_id):
+    """
+    Drop the claim of a request that did not create an order, so it can be retried
+    """
+    try:
+        frappe.cache().delete(_key(merchant, client_ref_id))
+    except Exception:
+        pass
+
+
+def remember_response(order, response):
+    """
+    Keep the first response of an order, on the Order row and in Redis after commit
+    """
+    payload = json.dumps(response, default=str)
+    order.db_set("api_response", payload, update_modified=False)
+    after_commit(partial(_set, order.merchant_ref_id, order.client_ref_id, payload, RESPONSE_TTL))
+
+
+def _accepted_response(order):
+    # Orders created before responses were stored
+    return {
+        "code": "0x0200",
+        "message": "Order accepted successfully",
+        "status": "SUCCESS",
+        "data": {
+            "clientRefId": order.client_ref_id,
+            "orderRefId": order.name,
+            "status": order.status
+        }
+    }
+
+
+def _key(merchant, client_ref_id):
+    return frappe.cache().make_key(f"{KEY_PREFIX}:{merchant}:{client_ref_id}")
+
+
+def _get(merchant, client_ref_id):
+    try:
+        value = frappe.cache().get(_key(merchant, client_ref_id))
+    except Exception:
+        return None
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _set(merchant, client_ref_id, payload, ttl):
+    try:
+        frappe.cache().set(_key(merchant, client_ref_id), payload, ex=ttl)
+    except Exception:
+        pass
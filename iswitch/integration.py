@@ -1,5 +1,5 @@
 import frappe
-import requests
+from . import http_client
 
 @frappe.whitelist()
 def get_flipoppay_balance():
@@ -13,7 +13,7 @@ def get_flipoppay_balance():
         }
         url = processor.api_endpoint.rstrip("/") + "/wallet/10040/balance"
         
-        response = requests.get(url, headers = headers, params = params)
+        response = http_client.get(processor.name, url, headers = headers, params = params)
         if response.status_code == 200:
             api_response = response.json()
             return {
@@ -34,7 +34,7 @@ def get_nimblepe_balance():
         }
         url = processor.api_endpoint.rstrip("/") + "/merchants/get/account_getbalance"
 
-        response = requests.get(url, headers = headers)
+        response = http_client.get(processor.name, url, headers = headers)
 
         api_response = response.json()
 
@@ -56,12 +56,12 @@ def get_swavenpay_balance():
         }
         url = processor.api_endpoint.rstrip("/") + "/balance"
 
-        response = requests.get(url, json = payload)
+        response = http_client.get(processor.name, url, json = payload)
         if response.status_code == 200:
             api_response = response.json()
             return {
                 "processor": processor.name,
-                "balance": api_response.("balance")
+                "balance": api_response.get("balance")
             }
         else:
             frappe.throw(f"API response {response.status_code}")
@@ -1,9 +1,15 @@
 # Copyright (c) 2025, Xettle and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
 
 
 class BankReqRes(Document):
 	pass
+
+
+def on_doctype_update():
+	# A log: rejected and duplicate requests keep their msgid too, so msgid is not
+	# unique. The row that accepts a msgid also sets the unique dedup_key.
+	frappe.db.add_index("Bank ReqRes", ["msgid"], "msgid_index")
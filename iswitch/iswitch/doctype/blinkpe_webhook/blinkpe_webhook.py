@@ -1,9 +1,14 @@
 # Copyright (c) 2025, Blinkpe and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
 
 
 class BlinkpeWebhook(Document):
 	pass
+
+
+def on_doctype_update():
+	# Queue drain (webhook_queue._claim): WHERE status = 'Queued' AND next_attempt_at <= now ORDER BY creation
+	frappe.db.add_index("Blinkpe Webhook", ["status", "next_attempt_at", "creation"], "status_next_attempt_index")
@@ -1,9 +1,13 @@
 # Copyright (c) 2025, Xettle and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
 
 
 class Customer(Document):
 	pass
+
+
+def on_doctype_update():
+	frappe.db.add_index("Customer", ["mobile_number"], "mobile_number_index")
@@ -1,9 +1,14 @@
 # Copyright (c) 2025, Xettle and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
 
 
 class Ledger(Document):
 	pass
+
+
+def on_doctype_update():
+	frappe.db.add_index("Ledger", ["owner", "creation"], "owner_creation_index")
+	frappe.db.add_index("Ledger", ["creation"], "creation_index")
@@ -0,0 +1,15 @@
+# Copyright (c) 2026, Xettle and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class MerchantWebhookDelivery(Document):
+	pass
+
+
+def on_doctype_update():
+	# Dispatcher (merchant_webhooks): WHERE status = 'Pending' AND next_attempt_at <= now ORDER BY creation
+	frappe.db.add_index("Merchant Webhook Delivery", ["status", "next_attempt_at", "creation"], "status_next_attempt_index")
+	frappe.db.add_index("Merchant Webhook Delivery", ["merchant", "creation"], "merchant_creation_index")
@@ -1,9 +1,23 @@
 # Copyright (c) 2025, Xettle and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
 
+from iswitch.refetch import first_check_at
+
 
 class Order(Document):
-	pass
+	def before_insert(self):
+		# Open orders are picked up by the requery schedule
+		if not self.next_check_at:
+			self.next_check_at = first_check_at()
+
+
+def on_doctype_update():
+	# Portal listings: WHERE merchant_ref_id [AND status] ORDER BY creation
+	frappe.db.add_index("Order", ["merchant_ref_id", "creation"], "merchant_creation_index")
+	frappe.db.add_index("Order", ["merchant_ref_id", "status", "creation"], "merchant_status_creation_index")
+	frappe.db.add_index("Order", ["creation"], "creation_index")
+	# Requery schedule (refetch): WHERE status IN (...) AND next_check_at <= now
+	frappe.db.add_index("Order", ["status", "next_check_at"], "status_next_check_index")
@@ -0,0 +1,15 @@
+# Copyright (c) 2026, Xettle and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class OrderAnalyticsBucket(Document):
+	pass
+
+
+def on_doctype_update():
+	# get_order_analytics: WHERE bucket BETWEEN ... [AND merchant = ...]
+	frappe.db.add_index("Order Analytics Bucket", ["bucket"], "bucket_index")
+	frappe.db.add_index("Order Analytics Bucket", ["merchant", "bucket"], "merchant_bucket_index")
@@ -0,0 +1,15 @@
+# Copyright (c) 2026, Xettle and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class OrderRollup(Document):
+	pass
+
+
+def on_doctype_update():
+	# Merchant dashboards: WHERE merchant = ... AND day IS NULL; admin totals: WHERE day IS NULL
+	frappe.db.add_index("Order Rollup", ["merchant", "day"], "merchant_day_index")
+	frappe.db.add_index("Order Rollup", ["day", "status"], "day_status_index")
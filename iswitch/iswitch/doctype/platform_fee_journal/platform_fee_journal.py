@@ -0,0 +1,17 @@
+# Copyright (c) 2026, Xettle and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+
+
+class PlatformFeeJournal(Document):
+	# Append-only: corrections are posted as new entries
+
+	def validate(self):
+		if not self.is_new():
+			frappe.throw(_("Platform Fee Journal entries cannot be modified"))
+
+	def on_trash(self):
+		frappe.throw(_("Platform Fee Journal entries cannot be deleted"))
@@ -1,5 +1,8 @@
 import frappe
 
+from iswitch import http_client
+from iswitch.order_state import complete, fail, mark_pending
+
 @frappe.whitelist()
 def process_transaction(transaction_name):
     """
@@ -38,7 +41,7 @@ def process_transaction(transaction_name):
                 }
 
                 url = processor.api_endpoint
-                response = requests.post(url, json=payload, headers=headers, timeout=15)
+                response = http_client.post(processor.name, url, json=payload, headers=headers, product=order.product)
                 frappe.log_error("API Response", response.json())
                 
                 if response.status_code != 200 or not response.json():
@@ -76,7 +79,7 @@ def process_transaction(transaction_name):
                 }
 
                 url = processor.api_endpoint.rstrip("/") + "/payout"
-                response = requests.post(url, json=payload, timeout=15)
+                response = http_client.post(processor.name, url, json=payload, product=order.product)
 
                 if response.status_code != 200:
                     status = "Failed"
@@ -97,22 +100,19 @@ def process_transaction(transaction_name):
                 order_id = api_response.get('orderId', "")
                 utr = api_response.get("utr", "")
             
-            # Update transaction
-            doc.payment_gateway_transaction_id = order_id
-            doc.status = status
-            doc.utr = utr
-            doc.remark = remark
-            doc.save(ignore_permissions=True)
-            frappe.db.commit()
-
-            # Update order
-            frappe.db.set_value("Order", doc.order, 'status', 'processed')
+            # Apply the outcome through the order state machine
+            if status == "Success":
+                complete(doc.order, utr=utr, crn=order_id, remark=remark)
+            elif status == "Failed":
+                fail(doc.order, remark or "Transaction failed", crn=order_id)
+            elif status == "Reversal":
+                fail(doc.order, remark or "Transaction reversed", status="Reversed", crn=order_id)
+            else:
+                mark_pending(doc.order, crn=order_id, remark=remark)
             frappe.db.commit()
         
         elif doc.status == "Failed":
-            doc.submit()
-            order = frappe.get_doc("Order", doc.order)
-            handle_transaction_failure(order, "Transaction failed")
+            fail(doc.order, doc.remark or "Transaction failed")
             frappe.db.commit()
 
         elif doc.status == "Success" and doc.product != "FEES AND CHARGES":
@@ -130,37 +130,9 @@ def process_transaction(transaction_name):
                 "transaction_type": "Debit"
             }).insert(ignore_permissions=True)
             transaction.submit()
-            doc.submit()
+            complete(doc.order, utr=doc.transaction_reference_id)
             frappe.db.commit()
             
     except Exception as e:
+        frappe.db.rollback()
         frappe.log_error("Error in transaction processing", str(e))
-
-def handle_transaction_failure(doc, error_message):
-    """
-    Common function to handle transaction failures and refund wallet
-    """
-    try:
-        # Update order status
-        frappe.db.set_value("Order", doc.name, {
-            'status': 'cancelled',
-            'failed_message': error_message[:100],
-            'failed_at': frappe.utils.now()
-        })
-        
-        # Refund merchant wallet
-        balance = frappe.db.get_value("Wallet", doc.merchant_ref_id, 'balance')
-        frappe.db.set_value("Wallet", doc.merchant_ref_id, 'balance', 
-                           float(balance) + float(doc.transaction_amount))
-        
-        # Refund Xettle Wallet
-        wallet = frappe.get_single("Xettle Wallet")
-        frappe.db.set_value("Xettle Wallet", None, "tax", 
-                           float(wallet.tax) - float(doc.tax))
-        frappe.db.set_value("Xettle Wallet", None, "fee", 
-                           float(wallet.fee) - float(doc.fee))
-        
-        frappe.db.commit()
-
-    except Exception as refund_error: 
-        frappe.log_error("Error in transaction failure handling", str(refund_error))
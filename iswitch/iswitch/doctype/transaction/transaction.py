@@ -7,3 +7,7 @@ from frappe.model.document import Document
 
 class Transaction(Document):
 	pass
+
+
+def on_doctype_update():
+	frappe.db.add_index("Transaction", ["transaction_date"], "transaction_date_index")
@@ -0,0 +1,8 @@
+// Copyright (c) 2026, Xettle and contributors
+// For license information, please see license.txt
+
+// frappe.ui.form.on("VAN Rollup", {
+// 	refresh(frm) {
+
+// 	},
+// });
@@ -0,0 +1,14 @@
+# Copyright (c) 2026, Xettle and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class VANRollup(Document):
+	pass
+
+
+def on_doctype_update():
+	frappe.db.add_index("VAN Rollup", ["merchant_email", "day"], "merchant_email_day_index")
+	frappe.db.add_index("VAN Rollup", ["day"], "day_index")
@@ -26,3 +26,7 @@ class VirtualAccount(Document):
 		# if self.merchant:
 		# 	frappe.set_user(self.merchant)
 	pass
+
+
+def on_doctype_update():
+	frappe.db.add_index("Virtual Account", ["merchant", "creation"], "merchant_creation_index")
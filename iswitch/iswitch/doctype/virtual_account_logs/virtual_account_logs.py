@@ -1,36 +1,27 @@
 import frappe
 from frappe.model.document import Document
 
+from iswitch.utils import add_unique_index
+from iswitch.wallet_service import credit, debit
+
 class VirtualAccountLogs(Document):
     def after_insert(self):
         try:
             if self.status == "Success" and self.docstatus == 0:
                 merchant = frappe.db.get_value("Virtual Account", self.account_number, 'merchant')
 
-                wallet_row = frappe.db.sql("""
-                    SELECT balance FROM `tabWallet`
-                    WHERE name = %s FOR UPDATE
-                """, (merchant,), as_dict=True)
+                if self.transaction_type == "Debit":
+                    movement = debit(merchant, self.amount, allow_overdraft=True)
+                else:
+                    movement = credit(merchant, self.amount)
 
-                if not wallet_row:
+                if not movement:
                     frappe.throw("Wallet not found for the merchant.")
 
-                balance = float(wallet_row[0].balance or 0.0)
-                
-                new_balance = balance + float(self.amount)
-                if self.transaction_type == "Debit":
-                    new_balance = balance - float(self.amount)
-                    
-                frappe.db.sql("""
-                    UPDATE `tabWallet`
-                    SET balance = %s
-                    WHERE name = %s
-                """, (new_balance, merchant))
-
-                self.opening_balance = balance
-                self.closing_balance = new_balance
-                self.db_set("opening_balance", balance)
-                self.db_set("closing_balance", new_balance)
+                self.opening_balance = movement.opening_balance
+                self.closing_balance = movement.closing_balance
+                self.db_set("opening_balance", movement.opening_balance)
+                self.db_set("closing_balance", movement.closing_balance)
                 self.save()
                 self.submit()
 
@@ -41,3 +32,9 @@ class VirtualAccountLogs(Document):
         except Exception as e:
             frappe.db.rollback(save_point = "wallet_process")
             frappe.log_error("Error in van processing",str(e))
+
+
+def on_doctype_update():
+    add_unique_index("Virtual Account Logs", ["utr"], "unique_utr")
+    frappe.db.add_index("Virtual Account Logs", ["owner", "creation"], "owner_creation_index")
+    frappe.db.add_index("Virtual Account Logs", ["creation"], "creation_index")
@@ -1,9 +1,13 @@
 # Copyright (c) 2025, Xettle and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
 
 
 class WhitelistIP(Document):
 	pass
+
+
+def on_doctype_update():
+	frappe.db.add_index("Whitelist IP", ["merchant", "whitelisted_ip"], "merchant_ip_index")
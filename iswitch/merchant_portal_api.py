@@ -3,8 +3,11 @@
 
 import frappe
 from frappe import _
+from frappe.utils import cint
 import json
 from datetime import datetime, timedelta
+from .counts import get_total
+from .pagination import Page
 
 @frappe.whitelist()
 def get_dashboard_stats():
@@ -36,19 +39,19 @@ def get_dashboard_stats():
         wallet_balance = wallet_data[0].balance if wallet_data else 0
         wallet_status = wallet_data[0].status if wallet_data else "Inactive"
         
-        # Get order statistics using optimized SQL
+        # Get order statistics from the all-time rollup rows (rollups.py)
         order_stats = frappe.db.sql("""
             SELECT 
-                COUNT(*) as total_orders,
-                SUM(CASE WHEN status = 'Processed' THEN 1 ELSE 0 END) as processed_orders,
-                SUM(CASE WHEN status IN ('Pending', 'Processing', 'Queued') THEN 1 ELSE 0 END) as pending_orders,
-                SUM(CASE WHEN status IN ('Cancelled', 'Reversed') THEN 1 ELSE 0 END) as cancelled_orders,
+                COALESCE(SUM(order_count), 0) as total_orders,
+                SUM(CASE WHEN status = 'Processed' THEN order_count ELSE 0 END) as processed_orders,
+                SUM(CASE WHEN status IN ('Pending', 'Processing', 'Queued') THEN order_count ELSE 0 END) as pending_orders,
+                SUM(CASE WHEN status IN ('Cancelled', 'Reversed') THEN order_count ELSE 0 END) as cancelled_orders,
                 SUM(CASE WHEN status = 'Processed' THEN COALESCE(order_amount, 0) ELSE 0 END) as total_processed_amount,
                 SUM(CASE WHEN status IN ('Pending', 'Processing', 'Queued') THEN COALESCE(order_amount, 0) ELSE 0 END) as total_pending_amount,
                 SUM(CASE WHEN status IN ('Cancelled', 'Reversed') THEN COALESCE(order_amount, 0) ELSE 0 END) as total_cancelled_amount,
                 SUM(COALESCE(order_amount, 0)) as total_orders_amount
-            FROM `tabOrder`
-            WHERE merchant_ref_id = %s
+            FROM `tabOrder Rollup`
+            WHERE merchant = %s AND day IS NULL
         """, (merchant_id,), as_dict=True)
         
         stats = order_stats[0] if order_stats else {}
@@ -111,8 +114,8 @@ def get_wallet_balance():
         return {"wallet_balance": 0}
 
 @frappe.whitelist()
-def get_orders(filter_data=None, page=1, page_size=20, sort_by="creation", sort_order="desc"):
-    """Get paginated orders with filters using SQL"""
+def get_orders(filter_data=None, page=1, page_size=20, sort_by="creation", sort_order="desc", cursor=None, exact_total=0):
+    """Get paginated orders with filters using SQL (keyset pages through `cursor`)"""
     try:
         merchant_email = frappe.session.user
         merchant_id = frappe.db.get_value("Merchant", {"company_email": merchant_email}, "name")
@@ -144,19 +147,19 @@ def get_orders(filter_data=None, page=1, page_size=20, sort_by="creation", sort_
                 filter_conditions.append("o.creation <= %(to_date)s")
                 filter_values["to_date"] = clean_to
         
-        where_clause = " AND ".join(filter_conditions)
+        listing = Page("o", page_size, cursor, page)
         
-        # Get total count
-        count_query = f"""
-            SELECT COUNT(*) as total
-            FROM `tabOrder` o
-            WHERE {where_clause}
-        """
-        total_result = frappe.db.sql(count_query, filter_values, as_dict=True)
-        total = total_result[0].total if total_result else 0
+        # Get total count (first load, or when asked for an exact total; cached in counts)
+        total, approximate = None, False
+        if not listing.uses_cursor or cint(exact_total):
+            total, approximate = get_total(
+                "Order", "o", filter_conditions, filter_values, scope=filter_values["merchant"], exact=cint(exact_total)
+            )
+        
+        listing.apply(filter_conditions, filter_values)
+        where_clause = " AND ".join(filter_conditions)
         
         # Get paginated orders
-        start = (int(page) - 1) * int(page_size)
         orders_query = f"""
             SELECT 
                 o.name as id,
@@ -169,17 +172,20 @@ def get_orders(filter_data=None, page=1, page_size=20, sort_by="creation", sort_
                 o.modified
             FROM `tabOrder` o
             WHERE {where_clause}
-            ORDER BY o.{sort_by} {sort_order.upper()}
-            LIMIT {int(page_size)} OFFSET {start}
+            ORDER BY {listing.order(sort_by, sort_order)}
+            {listing.limit}
         """
         
         orders = frappe.db.sql(orders_query, filter_values, as_dict=True)
+        orders, cursors = listing.result(orders, creation_key="date", name_key="id")
         
         return {
             "orders": orders,
             "total": total,
+            "total_approximate": approximate,
             "page": int(page),
-            "page_size": int(page_size)
+            "page_size": listing.page_size,
+            **cursors
         }
     
     except Exception as e:
@@ -187,8 +193,8 @@ def get_orders(filter_data=None, page=1, page_size=20, sort_by="creation", sort_
         return {"orders": [], "total": 0}
 
 @frappe.whitelist()
-def get_ledger_entries(filter_data=None, page=1, page_size=20):
-    """Get ledger entries using SQL - simplified without JOIN"""
+def get_ledger_entries(filter_data=None, page=1, page_size=20, cursor=None, exact_total=0):
+    """Get ledger entries using SQL - simplified without JOIN (keyset pages through `cursor`)"""
     try:
         merchant_email = frappe.session.user
         merchant_id = frappe.db.get_value("Merchant", {"company_email": merchant_email}, "name")
@@ -219,19 +225,19 @@ def get_ledger_entries(filter_data=None, page=1, page_size=20):
                 filter_conditions.append("l.creation <= %(to_date)s")
                 filter_values["to_date"] = clean_to
         
-        where_clause = " AND ".join(filter_conditions)
+        listing = Page("l", page_size, cursor, page)
         
-        # Get total count
-        count_query = f"""
-            SELECT COUNT(*) as total
-            FROM `tabLedger` l
-            WHERE {where_clause}
-        """
-        total_result = frappe.db.sql(count_query, filter_values, as_dict=True)
-        total = total_result[0].total if total_result else 0
+        # Get total count (first load, or when asked for an exact total; cached in counts)
+        total, approximate = None, False
+        if not listing.uses_cursor or cint(exact_total):
+            total, approximate = get_total(
+                "Ledger", "l", filter_conditions, filter_values, scope=filter_values["merchant"], exact=cint(exact_total)
+            )
+        
+        listing.apply(filter_conditions, filter_values)
+        where_clause = " AND ".join(filter_conditions)
         
         # Get paginated entries
-        start = (int(page) - 1) * int(page_size)
         entries_query = f"""
             SELECT 
                 l.name as id,
@@ -243,17 +249,20 @@ def get_ledger_entries(filter_data=None, page=1, page_size=20):
                 l.creation as date
             FROM `tabLedger` l
             WHERE {where_clause}
-            ORDER BY l.creation DESC
-            LIMIT {int(page_size)} OFFSET {start}
+            ORDER BY {listing.order_by}
+            {listing.limit}
         """
         
         entries = frappe.db.sql(entries_query, filter_values, as_dict=True)
+        entries, cursors = listing.result(entries, creation_key="date", name_key="id")
         
         return {
             "entries": entries,
             "total": total,
+            "total_approximate": approximate,
             "page": int(page),
-            "page_size": int(page_size)
+            "page_size": listing.page_size,
+            **cursors
         }
     
     except Exception as e:
@@ -261,8 +270,8 @@ def get_ledger_entries(filter_data=None, page=1, page_size=20):
         return {"entries": [], "total": 0}
 
 @frappe.whitelist()
-def get_van_logs(filter_data=None, page=1, page_size=20):
-    """Get Virtual Account Network logs using SQL"""
+def get_van_logs(filter_data=None, page=1, page_size=20, cursor=None, exact_total=0):
+    """Get Virtual Account Network logs using SQL (keyset pages through `cursor`)"""
     try:
         merchant_email = frappe.session.user
         merchant_id = frappe.db.get_value("Merchant", {"company_email": merchant_email}, "name")
@@ -293,19 +302,19 @@ def get_van_logs(filter_data=None, page=1, page_size=20):
                 filter_conditions.append("v.creation <= %(to_date)s")
                 filter_values["to_date"] = clean_to
         
-        where_clause = " AND ".join(filter_conditions)
+        listing = Page("v", page_size, cursor, page)
         
-        # Get total count
-        count_query = f"""
-            SELECT COUNT(*) as total
-            FROM `tabVirtual Account Logs` v
-            WHERE {where_clause}
-        """
-        total_result = frappe.db.sql(count_query, filter_values, as_dict=True)
-        total = total_result[0].total if total_result else 0
+        # Get total count (first load, or when asked for an exact total; cached in counts)
+        total, approximate = None, False
+        if not listing.uses_cursor or cint(exact_total):
+            total, approximate = get_total(
+                "Virtual Account Logs", "v", filter_conditions, filter_values, scope=filter_values["merchant"], exact=cint(exact_total)
+            )
+        
+        listing.apply(filter_conditions, filter_values)
+        where_clause = " AND ".join(filter_conditions)
         
         # Get paginated logs
-        start = (int(page) - 1) * int(page_size)
         logs_query = f"""
             SELECT 
                 v.name as id,
@@ -323,17 +332,20 @@ def get_van_logs(filter_data=None, page=1, page_size=20):
                 v.merchant
             FROM `tabVirtual Account Logs` v
             WHERE {where_clause}
-            ORDER BY v.creation DESC
-            LIMIT {int(page_size)} OFFSET {start}
+            ORDER BY {listing.order_by}
+            {listing.limit}
         """
         
         logs = frappe.db.sql(logs_query, filter_values, as_dict=True)
+        logs, cursors = listing.result(logs, creation_key="date", name_key="id")
         
         return {
             "logs": logs,
             "total": total,
+            "total_approximate": approximate,
             "page": int(page),
-            "page_size": int(page_size)
+            "page_size": listing.page_size,
+            **cursors
         }
     
     except Exception as e:
@@ -548,7 +560,7 @@ def get_virtual_accounts():
 
 @frappe.whitelist()
 def update_webhook_url(webhook_url):
-    """Update webhook URL and manage Webhook doctype"""
+    """Update the webhook URL of the merchant"""
     try:
         merchant_email = frappe.session.user
         merchant_id = frappe.db.get_value("Merchant", {"company_email": merchant_email}, "name")
@@ -558,12 +570,6 @@ def update_webhook_url(webhook_url):
             
         merchant = frappe.get_doc("Merchant", merchant_id)
         
-        # Check if Webhook doctype exists for this merchant
-        # We use merchant_email (user) as the name for Webhook doctype to be consistent with user snippet
-        # ideally it should be unique. The user snippet used `frappe.session.user`.
-        # Since merchant portal user IS the merchant email, this works.
-        webhook_name = merchant_email 
-        
         if not webhook_url:
              # Handle case where webhook is being cleared?
              # For now just update the merchant doc as the snippet didn't specify deletion logic
@@ -571,44 +577,15 @@ def update_webhook_url(webhook_url):
              merchant.save(ignore_permissions=True)
              return {"success": True, "message": "Webhook removed"}
 
-        exists = frappe.db.exists("Webhook", webhook_name)
-        
-        webhook_json_structure = """{
-            "crn":"{{doc.order}}",
-            "utr":"{{doc.transaction_reference_id}}",
-            "status": "{{doc.status}}",
-            "clientRefID": "{{doc.client_ref_id}}"
-        }"""
-        
-        if not exists:
-            frappe.get_doc({
-                'doctype': 'Webhook',
-                '__newname': webhook_name,
-                'webhook_doctype': 'Transaction',
-                'webhook_docevent': 'on_submit',
-                'condition': f"(doc.merchant == '{merchant_email}') and (doc.status in ['Success', 'Failed', 'Reversed'])",
-                'request_url': webhook_url,
-                'request_method': 'POST',
-                'request_structure': 'JSON',
-                'background_jobs_queue': 'long',
-                'webhook_json': webhook_json_structure
-            }).insert(ignore_permissions=True)
-            
-            merchant.webhook = webhook_url
-            merchant.save(ignore_permissions=True)
-            return {"success": True, "message": "Webhook created successfully"}
+        if merchant.webhook == webhook_url:
+            return {"success": True, "message": "Webhook unchanged"}
 
-        elif merchant.webhook != webhook_url:
-            webhook_doc = frappe.get_doc("Webhook", webhook_name)
-            webhook_doc.request_url = webhook_url
-            webhook_doc.save(ignore_permissions=True)
+        message = "Webhook updated successfully" if merchant.webhook else "Webhook created successfully"
 
-            merchant.webhook = webhook_url
-            merchant.save(ignore_permissions=True)
-            return {"success": True, "message": "Webhook updated successfully"}
-        
-        else:
-            return {"success": True, "message": "Webhook unchanged"}
+        # merchant_webhooks delivers to Merchant.webhook
+        merchant.webhook = webhook_url
+        merchant.save(ignore_permissions=True)
+        return {"success": True, "message": message}
 
     except Exception as e:
         frappe.log_error(f"Error in update_webhook_url: {str(e)}", "Merchant Portal API")
@@ -0,0 +1,346 @@
+import hashlib
+import hmac
+import json
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+
+import frappe
+from frappe.utils import add_to_date, now, now_datetime
+from frappe.utils.password import get_decrypted_password, set_encrypted_password
+
+from . import http_client
+from .admin_portal_api import check_admin_permission
+from .utils import after_commit
+
+# Merchant webhook dispatcher
+# When a Transaction is settled, order_state queues one Merchant Webhook Delivery
+# for its merchant: the endpoint comes from a Redis hash keyed by merchant (no
+# per-merchant conditions are evaluated) and the body is built with json.dumps
+# at that moment. Dispatch jobs claim due deliveries with FOR UPDATE SKIP LOCKED,
+# post them concurrently through one pooled client and record the response code
+# and latency on the row. The body is signed with the merchant's webhook secret:
+#
+#   X-iSwitch-Signature = hex HMAC-SHA256(secret, "<X-iSwitch-Timestamp>.<body>")
+#
+# Failed deliveries are retried with exponential backoff and parked as Failed
+# after MAX_ATTEMPTS; get_delivery_stats summarises delivery health per merchant.
+
+CACHE_KEY = "iswitch:merchant_webhooks"
+CLIENT_NAME = "Merchant Webhooks"
+
+# Settled Transaction statuses merchants are notified about
+EVENT_STATUSES = ("Success", "Failed", "Reversed")
+
+BATCH_SIZE = 200
+DISPATCH_WORKERS = 2
+DISPATCH_CONCURRENCY = 16
+DISPATCH_BUDGET = 50
+WRITE_BATCH = 20
+
+MAX_ATTEMPTS = 8
+RETRY_DELAY = 30
+MAX_RETRY_DELAY = 6 * 60 * 60
+
+# A claimed delivery not finished within this long belongs to a crashed job
+STALLED_AFTER = 10 * 60
+
+# Merchant endpoints answer within this (connect, read) timeout or the attempt fails
+TIMEOUT = (5.0, 10.0)
+
+CLIENT_CONFIG = dict(
+    http_client.DEFAULT_CONFIG,
+    read_timeout=TIMEOUT[1],
+    max_retries=0,
+    pool_size=DISPATCH_CONCURRENCY,
+    pool_connections=64
+)
+
+_client = None
+
+
+def get_endpoint(merchant):
+    """
+    Webhook URL of a merchant, or None when it has none
+    """
+    url = frappe.cache().hget(CACHE_KEY, merchant)
+    if url is None:
+        url = frappe.db.get_value("Merchant", merchant, "webhook") or ""
+        frappe.cache().hset(CACHE_KEY, merchant, url)
+    return url or None
+
+
+def clear_endpoint(doc, method=None):
+    """
+    Merchant on_update / on_trash: drop the cached endpoint
+    """
+    after_commit(partial(frappe.cache().hdel, CACHE_KEY, doc.name), run_now=True)
+
+
+def queue_delivery(transaction):
+    """
+    Queue the notification of a settled Transaction for its merchant.
+    Returns the delivery name, or None when the merchant has no webhook.
+    """
+    doc = frappe.db.get_value(
+        "Transaction", transaction,
+        ["name", "merchant", "order", "status", "transaction_reference_id", "client_ref_id"],
+        as_dict=True
+    )
+    if not doc or doc.status not in EVENT_STATUSES:
+        return None
+
+    url = get_endpoint(doc.merchant)
+    if not url:
+        return None
+
+    payload = json.dumps({
+        "crn": doc.order,
+        "utr": doc.transaction_reference_id or "",
+        "status": doc.status,
+        "clientRefID": doc.client_ref_id or ""
+    })
+
+    name = frappe.generate_hash(length=10)
+    timestamp = now()
+    frappe.db.bulk_insert("Merchant Webhook Delivery", fields=[
+        "name", "creation", "modified", "owner", "modified_by", "docstatus",
+        "merchant", "order", "transaction", "event_status", "status", "attempts", "url", "payload"
+    ], values=[(
+        name, timestamp, timestamp, frappe.session.user, frappe.session.user, 0,
+        doc.merchant, doc.order, doc.name, doc.status, "Pending", 0, url, payload
+    )])
+
+    after_commit(partial(_enqueue_dispatch, zlib.crc32(doc.merchant.encode()) % DISPATCH_WORKERS))
+    return name
+
+
+def schedule_dispatch():
+    """
+    Cron: requeue deliveries of crashed jobs and start the dispatch jobs
+    """
+    frappe.db.sql("""
+        UPDATE `tabMerchant Webhook Delivery`
+        SET status = 'Pending', modified = %s
+        WHERE status = 'Sending' AND modified < %s
+    """, (now(), add_to_date(now_datetime(), seconds=-STALLED_AFTER)))
+    frappe.db.commit()
+
+    for slot in range(DISPATCH_WORKERS):
+        _enqueue_dispatch(slot)
+
+
+def dispatch_deliveries():
+    """
+    Send due deliveries in batches until none are left or the budget is spent
+    """
+    deadline = time.monotonic() + DISPATCH_BUDGET
+    with ThreadPoolExecutor(max_workers=DISPATCH_CONCURRENCY, thread_name_prefix="merchant_webhook") as executor:
+        while time.monotonic() < deadline:
+            deliveries = _claim(BATCH_SIZE)
+            if not deliveries:
+                break
+            _send_batch(deliveries, executor)
+
+
+def sign(secret, timestamp, body):
+    return hmac.new(secret.encode(), f"{timestamp}.{body}".encode(), hashlib.sha256).hexdigest()
+
+
+def ensure_secret(merchant, regenerate=False):
+    """
+    Return the webhook secret of a merchant, creating it when missing
+    """
+    secret = None
+    if not regenerate:
+        secret = get_decrypted_password("Merchant", merchant, "webhook_secret", raise_exception=False)
+    if not secret:
+        secret = frappe.generate_hash(length=32)
+        set_encrypted_password("Merchant", merchant, secret, "webhook_secret")
+    return secret
+
+
+@frappe.whitelist()
+def get_webhook_secret(regenerate=False):
+    """
+    Webhook signing secret of the logged-in merchant
+    """
+    merchant = frappe.db.get_value("Merchant", {"company_email": frappe.session.user}, "name")
+    if not merchant:
+        frappe.throw("Merchant not found", frappe.PermissionError)
+
+    secret = ensure_secret(merchant, regenerate=frappe.utils.cint(regenerate))
+    frappe.db.commit()
+    return {"secret": secret}
+
+
+@frappe.whitelist()
+def retry_deliveries(names=None, merchant=None):
+    """
+    Queue Failed deliveries again: the given names, or all of a merchant (or everyone)
+    """
+    check_admin_permission()
+
+    values = {"modified": now()}
+    conditions = ["status = 'Failed'"]
+    if names:
+        conditions.append("name IN %(names)s")
+        values["names"] = tuple(frappe.parse_json(names) if isinstance(names, str) else names)
+    if merchant:
+        conditions.append("merchant = %(merchant)s")
+        values["merchant"] = merchant
+
+    frappe.db.sql("""
+        UPDATE `tabMerchant Webhook Delivery`
+        SET status = 'Pending', attempts = 0, next_attempt_at = NULL, error = NULL, modified = %(modified)s
+        WHERE {conditions}
+    """.format(conditions=" AND ".join(conditions)), values)
+    retried = frappe.db._cursor.rowcount
+    frappe.db.commit()
+
+    for slot in range(DISPATCH_WORKERS):
+        _enqueue_dispatch(slot)
+    return {"retried": retried}
+
+
+@frappe.whitelist()
+def get_delivery_stats(hours=24):
+    """
+    Delivery counts and latency per merchant over the last `hours`
+    """
+    check_admin_permission()
+
+    since = add_to_date(now_datetime(), hours=-frappe.utils.cint(hours))
+    rows = frappe.db.sql("""
+        SELECT
+            merchant,
+            COUNT(*) AS deliveries,
+            SUM(status = 'Delivered') AS delivered,
+            SUM(status = 'Failed') AS failed,
+            SUM(status IN ('Pending', 'Sending')) AS pending,
+            SUM(attempts) AS attempts,
+            AVG(CASE WHEN status = 'Delivered' THEN latency_ms END) AS avg_latency_ms,
+            MAX(CASE WHEN status = 'Delivered' THEN latency_ms END) AS max_latency_ms
+        FROM `tabMerchant Webhook Delivery`
+        WHERE creation >= %s
+        GROUP BY merchant
+        ORDER BY failed DESC, deliveries DESC
+    """, since, as_dict=True)
+
+    for row in rows:
+        finished = (row.delivered or 0) + (row.failed or 0)
+        row.failure_rate = round(row.failed / finished, 4) if finished else None
+        row.avg_latency_ms = round(row.avg_latency_ms, 2) if row.avg_latency_ms is not None else None
+    return rows
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        _client = http_client.Client(CLIENT_NAME, CLIENT_CONFIG)
+    return _client
+
+
+def _enqueue_dispatch(slot):
+    frappe.enqueue(
+        "iswitch.merchant_webhooks.dispatch_deliveries",
+        queue="short",
+        job_id=f"iswitch_merchant_webhook_dispatch_{slot}",
+        deduplicate=True
+    )
+
+
+def _claim(limit):
+    names = frappe.db.sql("""
+        SELECT name
+        FROM `tabMerchant Webhook Delivery`
+        WHERE status = 'Pending' AND (next_attempt_at IS NULL OR next_attempt_at <= %s)
+        ORDER BY creation
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    """, (now(), limit), pluck=True)
+    if not names:
+        frappe.db.commit()
+        return []
+
+    frappe.db.sql("""
+        UPDATE `tabMerchant Webhook Delivery`
+        SET status = 'Sending', attempts = attempts + 1, modified = %s
+        WHERE name IN %s
+    """, (now(), tuple(names)))
+    deliveries = frappe.db.sql("""
+        SELECT name, merchant, url, payload, attempts
+        FROM `tabMerchant Webhook Delivery`
+        WHERE name IN %s
+        ORDER BY creation
+    """, (tuple(names),), as_dict=True)
+    frappe.db.commit()
+    return deliveries
+
+
+def _send_batch(deliveries, executor):
+    """
+    Post a batch from worker threads and record the results from this thread
+    """
+    client = _get_client()
+    secrets = {}
+    futures = {}
+
+    for delivery in deliveries:
+        if delivery.merchant not in secrets:
+            secrets[delivery.merchant] = ensure_secret(delivery.merchant)
+
+        timestamp = str(int(time.time()))
+        headers = {
+            "Content-Type": "application/json",
+            "X-iSwitch-Delivery": delivery.name,
+            "X-iSwitch-Timestamp": timestamp,
+            "X-iSwitch-Signature": sign(secrets[delivery.merchant], timestamp, delivery.payload)
+        }
+        future = executor.submit(
+            http_client.send, client, "POST", delivery.url,
+            timeout=TIMEOUT, headers=headers, data=delivery.payload
+        )
+        futures[future] = delivery
+
+    recorded = 0
+    for future in as_completed(futures):
+        response, elapsed, error = future.result()
+        _record(futures[future], response, elapsed, error)
+        recorded += 1
+        if recorded % WRITE_BATCH == 0:
+            frappe.db.commit()
+    frappe.db.commit()
+
+
+def _record(delivery, response, elapsed, error):
+    values = {
+        "name": delivery.name,
+        "now": now(),
+        "response_code": response.status_code if response is not None else None,
+        "latency_ms": round(elapsed * 1000, 3)
+    }
+
+    if response is not None and 200 <= response.status_code < 300:
+        frappe.db.sql("""
+            UPDATE `tabMerchant Webhook Delivery`
+            SET status = 'Delivered', delivered_at = %(now)s, modified = %(now)s,
+                response_code = %(response_code)s, latency_ms = %(latency_ms)s, error = NULL
+            WHERE name = %(name)s
+        """, values)
+        return
+
+    if delivery.attempts >= MAX_ATTEMPTS:
+        values.update(status="Failed", next_attempt_at=None)
+    else:
+        delay = min(RETRY_DELAY * 2 ** (delivery.attempts - 1), MAX_RETRY_DELAY)
+        values.update(status="Pending", next_attempt_at=add_to_date(now_datetime(), seconds=delay))
+    values["error"] = str(error)[:1000] if error else f"HTTP {response.status_code}: {response.text[:500]}"
+
+    frappe.db.sql("""
+        UPDATE `tabMerchant Webhook Delivery`
+        SET status = %(status)s, next_attempt_at = %(next_attempt_at)s, modified = %(now)s,
+            response_code = %(response_code)s, latency_ms = %(latency_ms)s, error = %(error)s
+        WHERE name = %(name)s
+    """, values)
@@ -4,6 +4,15 @@ import requests
 import json
 import jwt
 from datetime import datetime as dt, timedelta as td
+from .audit_log import start_request_log, log_response
+from .idempotency import get_replay, claim_request, release_request, remember_response, IN_PROGRESS_RESPONSE
+from .auth_context import get_auth_context, is_ip_allowed, find_pricing
+from .routing import choose_integration
+from .pricing import get_pricing_rows
+from .platform_fee import record_fee
+from .wallet_service import hold_funds, capture_hold, release_hold
+from .order_state import complete, fail
+from . import http_client
 
 def generate_token(processor):
     try:
@@ -26,58 +35,49 @@ def generate_token(processor):
         frappe.log_error(frappe.get_traceback(), "Token Generation Failed")
         return None
 
-def handle_transaction_failure(name, status, error_message, transaction_id):
+def dispatch_topup(order, data):
     """
-    Common function to handle transaction failures and refund wallet
+    Second phase of a UPI order: request the payment links from the processor.
+    Runs after the order has committed. Returns (api_data, error).
     """
     try:
+        processor = frappe.get_doc("Integration", order.integration_id)
+        token = generate_token(processor)
+        headers = {
+            "Api-Key": processor.get_password("client_id"),
+            "Authorization": f"Bearer {token}"
+        }
 
-        doc = frappe.get_doc("Order", name)
-
-        wallet_row = frappe.db.sql("""
-            SELECT balance FROM `tabWallet`
-            WHERE name = %s FOR UPDATE
-        """, (doc.merchant_ref_id,), as_dict=True)
+        customer_id = frappe.db.get_value("Customer", {"mobile_number": data.get("customer_phone", "")}, "name")
+        payload = {
+            "epin_denomination": order.order_amount,
+            "external_order_id": order.name,
+            "delivery_details": {
+                "recipient_name": data["customer_name"],
+                "recipient_email": data["customer_email"],
+                "recipient_phone_number": data["customer_phone"],
+                "recipient_player_id": customer_id
+            }
+        }
+        url = processor.api_endpoint.rstrip("/") + "/transaction/top-up/"
 
-        frappe.set_user(doc.merchant_ref_id)
-        balance = float(wallet_row[0]["balance"]) or 0.0
-        # Apply balance change safely
-        new_balance = float(wallet_row[0]["balance"]) + float(doc.transaction_amount)
+        api_response = http_client.post(processor.name, url, headers=headers, json=payload, product=order.product)
+        if api_response.status_code != 200:
+            frappe.log_error("UPI API Failed", f"Status: {api_response.status_code}, Response: {api_response.text}")
+            return None, "UPI transaction failed"
 
-        frappe.db.sql("""
-            UPDATE `tabWallet`
-            SET balance = %s
-            WHERE name = %s
-        """, (new_balance, doc.merchant_ref_id))
+        api_data = api_response.json().get("data", {})
+        if not api_data:
+            return None, "Error in transaction processing"
 
-        ledger = frappe.get_doc({
-            "doctype": 'Ledger',
-            "order": doc.name,
-            "transaction_type": 'Credit',
-            'status': 'Reversed',
-            'transaction_id': transaction_id,
-            'client_ref_id': doc.client_ref_id,
-            'opening_balance': balance,
-            "closing_balance": new_balance
-        }).insert(ignore_permissions=True)
-        ledger.submit()
-                
-        # Refund Xettle Wallet
-        wallet = frappe.get_single("Xettle Wallet")
-        frappe.db.set_value("Xettle Wallet", None, "tax", float(wallet.tax) - float(doc.tax))
-        frappe.db.set_value("Xettle Wallet", None, "fee", float(wallet.fee) - float(doc.fee))
-        
-        doc.status = status
-        doc.cancellation_reason = error_message[:100]
-        doc.cancelled_at = frappe.utils.now()
-        doc.save(ignore_permissions=True)
-
-        frappe.db.commit()
-
-    except Exception as refund_error: 
-        frappe.db.rollback(save_point = "update_record")
-        frappe.log_error("Error",refund_error)
+        return api_data, None
 
+    except requests.RequestException as req_error:
+        frappe.log_error("UPI API Request Error", str(req_error))
+        return None, "UPI transaction failed"
+    except Exception as e:
+        frappe.log_error("UPI API Error", frappe.get_traceback())
+        return None, "UPI transaction failed"
 
 @frappe.whitelist()
 def create_order():
@@ -92,12 +92,7 @@ def create_order():
     
     auth_header = frappe.get_request_header("Authorization")
 
-    request_response = frappe.get_doc({
-        "doctype":"Request Response",
-        "request": data,
-        "header": auth_header,
-        "user": user_id
-    }).insert(ignore_permissions=True)
+    request_response = start_request_log(request=data, header=auth_header, user=user_id)
 
     if not auth_header or not auth_header.lower().startswith("token "):
         response = {
@@ -105,9 +100,7 @@ def create_order():
             "status": "MISSING_HEADER",
             "message": "Authorization header is missing."
         }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
         return response
     try:
         # Split token and extract parts
@@ -118,77 +111,70 @@ def create_order():
         response = {
             "Error in token format. Please verify and try again."
         }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
 
         return response
         
-    user_id = frappe.db.get_value("User", {"api_key": api_key},'email')
+    context = get_auth_context(api_key)
+    user_id = context.user if context else None
 
     frappe.set_user(user_id)
 
-    if not frappe.db.exists("Whitelist IP",{'merchant':user_id,'whitelisted_ip':ip_address}):
+    if not is_ip_allowed(context, ip_address):
         response = {
             "code": "0x0401",
             "status": "UNAUTHORIZED ACCESS", 
             "message": f"Originating IP {ip_address} is blocked by central firewall system. This incident will be reported."
         }
 
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
 
         return response
 
-    if user_id == "Guest":
+    if user_id == "Guest" or not context.merchant:
         response = {
             "code": "0x0401",
             "status": "UNAUTHORIZED", 
             "message": "Authentication required"
         }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
         return response
 
-    merchant = frappe.get_doc("Merchant", user_id)
-    if merchant.status != "Approved":
+    if context.merchant_status != "Approved":
         response =  {
             "code": "0x0404",
             "status": "VALIDATION_ERROR",
             "message": "Validation failed",
-            "data": f"Your Account is in {merchant.status} stage. Please contact Admin"
+            "data": f"Your Account is in {context.merchant_status} stage. Please contact Admin"
         }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
         return response 
 
-    if not merchant.integration:
+    if not context.integration:
         response =  {
             "code": "0x0404",
             "status": "VALIDATION_ERROR",
             "message": "Validation failed",
             "data": "Processor isn't configured yet to process your order. Please try after sometime."
         }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
         return response
 
-    wallet = frappe.get_doc("Wallet", merchant.name)
-    if wallet.status != "Active":
+    if context.wallet_status != "Active":
         response = {
                 "code": "0x0404",
                 "status": "VALIDATION_ERROR",
                 "message": "Validation failed",
-                "data": f"Your Wallet is {wallet.status}. Please contact Admin"
+                "data": f"Your Wallet is {context.wallet_status}. Please contact Admin"
             }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
         return response
+
+    # Retries of an already processed clientRefId get the first response back
+    replay = get_replay(context.merchant, data.get("clientRefId"))
+    if replay:
+        log_response(request_response, replay)
+        return replay
     
     if "mode" not in data:
         response = {
@@ -196,13 +182,10 @@ def create_order():
             "status": "MISSING_PARAMETER",
             "message": "mode is required"
         }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
         return response
 
-    product = frappe.db.exists("Product", {"product_name": data["mode"].upper(), "is_active":1})
-    if not product:
+    if data["mode"].upper() not in context.products:
         response = {
             "code": "0x0500",
             "status": "SERVER_DOWN",
@@ -212,50 +195,47 @@ def create_order():
                 ] 
             }
         }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
         return response
 
     order_amount = float(data["amount"])
 
-    product_pricing = frappe.db.sql("""
-        SELECT tax_fee_type, tax_fee, fee_type, fee
-        FROM `tabProduct Pricing`
-        WHERE parent = %s AND product = %s
-        AND %s >= start_value AND %s <= end_value
-    """, (merchant.name, data["mode"].upper(), order_amount, order_amount), as_dict=True)
+    pricing = find_pricing(context, data["mode"].upper(), order_amount)
     
-    if not product_pricing:
+    if not pricing:
         response = {
             "code": "0x0404",
             "status": "VALIDATION_ERROR",
             "message": "Validation failed",
             "data": "This payment mode or transaction limit is not active for you. Please contact Admin"
         }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
         return response
 
-    processor = frappe.get_doc("Integration", merchant.integration)
-
-    mode_verification = frappe.db.sql("""
-        SELECT tax_fee_type, tax_fee, fee_type, fee
-        FROM `tabProduct Pricing`
-        WHERE parent = %s AND product = %s
-    """, (processor.name, data["mode"].upper()), as_dict=True)
+    # Primary processor, or the secondary while the primary is failing
+    route = choose_integration(context, data["mode"].upper(), order_amount)
 
-    if not mode_verification:
+    if not route:
         response = {
             "code": "0x0404",
             "status": "VALIDATION_ERROR",
             "message": "Validation failed",
             "data": "This payment mode is not active for now. Please contact Admin"
         }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
+        return response
+
+    if not route.integration:
+        response = {
+            "code": "0x0500",
+            "status": "SERVER_DOWN",
+            "message": {
+                f"{data['mode']}": [
+                    f"{data['mode']} payment mode is down. Please try again after sometime."
+                ]
+            }
+        }
+        log_response(request_response, response)
         return response
 
     # frappe.log_error("User",user_id)
@@ -263,6 +243,7 @@ def create_order():
     if data.get("mode","").upper() == "UPI":
         fields = ["customer_name", "customer_email", "customer_phone", "amount", "purpose", "clientRefId"]
 
+    held = None
     frappe.db.savepoint("start_transaction") 
     try:
         
@@ -276,27 +257,11 @@ def create_order():
                     "message": {f"{field}": [f"{field} is missing."]}
                 }
                 # request_response = frappe.get_doc("Request Response", request_response.name)
-                request_response.response = json.dumps(response)
-                request_response.submit()
+                log_response(request_response, response)
                 return response
 
-        # Check duplicate client ref id
-        existing_order = frappe.db.exists("Order", {"client_ref_id": data["clientRefId"]})
-        if existing_order:
-            frappe.db.rollback(save_point = "start_transaction")
-            response = {
-                "code": "0x0203",
-                "status": "MISSING_PARAMETER",
-                "message": {"clientRefId": ["Client Ref Id already exists."]}
-            }
-            # request_response = frappe.get_doc("Request Response", request_response.name)
-            request_response.response = json.dumps(response)
-            request_response.submit()
-            return response
 
         # Calculate fees and total amount
-        processor = frappe.get_doc("Integration", merchant.integration)
-        pricing = product_pricing[0]
         fee = float(pricing.get("fee", 0))
         tax = 0
 
@@ -308,27 +273,17 @@ def create_order():
 
         total_amount = order_amount + fee + tax
 
-        wallet_row = frappe.db.sql("""
-            SELECT balance FROM `tabWallet`
-            WHERE name = %s FOR UPDATE
-        """, (merchant.name,), as_dict=True)
-        
-        if not wallet_row:
+        if not claim_request(context.merchant, data["clientRefId"]):
             frappe.db.rollback(save_point = "start_transaction")
-            response = {
-                "code": "0x0404",
-                "status": "VALIDATION_ERROR",
-                "message": "Validation failed",
-                "data": "No active wallet found"
-            }
-            request_response = frappe.get_doc("Request Response", request_response.name)
-            request_response.response = json.dumps(response)
-            request_response.submit()
-            return response
-            
-        balance = float(wallet_row[0].balance) or 0.0
+            log_response(request_response, IN_PROGRESS_RESPONSE)
+            return IN_PROGRESS_RESPONSE
 
-        if balance < total_amount:
+        # Reserve the funds; the hold commits so the wallet row is not locked
+        # while the order documents are created
+        held = hold_funds(context.merchant, total_amount, data["clientRefId"])
+
+        if not held:
+            release_request(context.merchant, data["clientRefId"])
             frappe.db.rollback(save_point = "start_transaction")
             response = {
                 "code": "0x0404",
@@ -336,23 +291,15 @@ def create_order():
                 "message": "Validation failed",
                 "data": "Insufficient wallet balance"
             }
-            request_response = frappe.get_doc("Request Response", request_response.name)
-            request_response.response = json.dumps(response)
-            request_response.submit()
+            if not frappe.db.exists("Wallet", context.merchant):
+                response["data"] = "No active wallet found"
+            log_response(request_response, response)
             return response
 
-        new_balance = balance - total_amount
+        frappe.db.savepoint("start_transaction")
 
-        frappe.db.sql("""
-            UPDATE `tabWallet`
-            SET balance = %s
-            WHERE name = %s
-        """, (new_balance, merchant.name))
-
-        # UPDATE XETTLE WALLET (PLATFORM FEES)
-        xettle_wallet = frappe.get_single("Xettle Wallet")
-        frappe.db.set_value("Xettle Wallet", None, "tax", float(xettle_wallet.tax) + float(tax))
-        frappe.db.set_value("Xettle Wallet", None, "fee", float(xettle_wallet.fee) + float(fee))
+        # JOURNAL PLATFORM FEES
+        record_fee(context.merchant, data["clientRefId"], fee, tax)
 
         # CREATE ORDER
         order = None
@@ -366,11 +313,12 @@ def create_order():
                 "order_amount": order_amount,
                 "purpose": data["purpose"],
                 "product": data["mode"].upper(),
-                "merchant_ref_id": merchant.name,
+                "merchant_ref_id": context.merchant,
                 "narration": data.get("narration", ""),
                 "remark": data.get("remark", ""),
                 "client_ref_id": data["clientRefId"],
-                "integration_id": processor.name,
+                "routing_decision": route.decision,
+                "integration_id": route.integration,
                 "tax": tax,
                 "fee": fee,
                 "transaction_amount": total_amount
@@ -383,11 +331,12 @@ def create_order():
                 "order_amount": order_amount,
                 "purpose": data["purpose"],
                 "product": "UPI",
-                "merchant_ref_id": merchant.name,
-                "integration_id": merchant.integration,
+                "merchant_ref_id": context.merchant,
+                "integration_id": route.integration,
                 "remark": data.get("remark", ""),
                 "client_ref_id": data["clientRefId"],
-                "integration_id": processor.name,
+                "routing_decision": route.decision,
+                "integration_id": route.integration,
                 "vpa": data.get("vpa",""),
                 "tax": tax,
                 "fee": fee,
@@ -414,14 +363,15 @@ def create_order():
             'status': 'Success',
             'client_ref_id': order.client_ref_id,
             'transaction_id': transaction.name,
-            'opening_balance': balance,
-            'closing_balance': new_balance
+            'opening_balance': held.opening_balance,
+            'closing_balance': held.closing_balance
         }).insert(ignore_permissions=True)
         ledger.submit()
 
+        capture_hold(held.hold, order.name)
+
         # FOR NON-UPI: Commit and return success
         if data.get("mode", "").upper() != "UPI":
-            frappe.db.commit()
             response = {
                 "code": "0x0200",
                 "message": "Order accepted successfully",
@@ -432,123 +382,58 @@ def create_order():
                     "status": order.status
                 }
             }
+            remember_response(order, response)
+            frappe.db.commit()
             #request_response = frappe.get_doc("Request Response", request_response.name)
-            request_response.response = json.dumps(response)
-            request_response.submit()
+            log_response(request_response, response)
             return response
 
-        # FOR UPI: Make API call within same transaction
+        # FOR UPI: Commit the order first, the processor is called with no transaction open
         else:
-            token = generate_token(processor)
-            headers = {
-                "Api-Key": processor.get_password("client_id"),
-                "Authorization": f"Bearer {token}"
-            }
+            frappe.db.commit()
+            held = None
+            frappe.db.savepoint("start_transaction")
+
+            api_data, error = dispatch_topup(order, data)
+
+            if error:
+                # Compensating refund for the committed debit
+                fail(order.name, error)
 
-            payload = {
-                "epin_denomination": order_amount,
-                "external_order_id": order.name,
-                "delivery_details": {
-                    "recipient_name": data["customer_name"],
-                    "recipient_email": data["customer_email"],
-                    "recipient_phone_number": data["customer_phone"],
-                    "recipient_player_id": customer_id
-                }
-            }
-            url = processor.api_endpoint.rstrip("/") + "/transaction/top-up/"
-            
-            # Make API call
-            try:
-                api_response = requests.post(url, headers=headers, json=payload, timeout=30)
-                
-                if api_response.status_code != 200:
-                    # API failed - rollback transaction
-                    frappe.log_error("UPI API Failed", f"Status: {api_response.status_code}, Response: {api_response.text}")
-                    frappe.db.rollback(save_point = "start_transaction")
-                    
-                    response = {
-                        "code": "0x0500",
-                        "status": "ERROR", 
-                        "message": "UPI transaction failed"
-                    }
-                    #request_response = frappe.get_doc("Request Response", request_response.name)
-                    request_response.response = json.dumps(response)
-                    request_response.submit()
-                    return response
-                
-                try:
-                    response_data = api_response.json()
-                    api_data = response_data.get("data", {})
-                    
-                    if not api_data:
-                        # Empty response - rollback
-                        frappe.db.rollback(save_point = "start_transaction")
-                        response = {
-                            "code": "0x0500",
-                            "status": "ERROR",
-                            "message": "Error in transaction processing"
-                        }
-                        #request_response = frappe.get_doc("Request Response", request_response.name)
-                        request_response.response = json.dumps(response)
-                        request_response.submit()
-                        
-                        return response
-                    
-                    # API successful - update order with payment URLs
-                    order.payment_url = api_data.get("payment_url", "")
-                    order.success_url = api_data.get("success_url", "")
-                    order.failed_url = api_data.get("failed_url", "")
-                    order.close_url = api_data.get("close_url", "")
-                    order.save(ignore_permissions=True)
-                    
-                    # Commit transaction
-                    frappe.db.commit()
-                    
-                    response = {
-                        "message": "Order initialized successfully",
-                        "payment_url": order.payment_url,
-                        "success_url": order.success_url,
-                        "failed_url": order.failed_url,
-                        "close_url": order.close_url
-                    }
-                    #request_response = frappe.get_doc("Request Response", request_response.name)
-                    request_response.response = json.dumps(response)
-                    request_response.submit()
-                    return response
-                    
-                except ValueError as json_error:
-                    # Invalid JSON response - rollback
-                    frappe.log_error("UPI API JSON Error", str(json_error))
-                    frappe.db.rollback(save_point = "start_transaction")
-                    
-                    response = {
-                        "code": "0x0500",
-                        "status": "ERROR", 
-                        "message": "UPI transaction failed"
-                    }
-                    #request_response = frappe.get_doc("Request Response", request_response.name)
-                    request_response.response = json.dumps(response)
-                    request_response.submit()
-                    
-                    return response
-                    
-            except requests.RequestException as req_error:
-                # Network/timeout error - rollback
-                frappe.log_error("UPI API Request Error", str(req_error))
-                frappe.db.rollback(save_point = "start_transaction")
                 response = {
                     "code": "0x0500",
                     "status": "ERROR",
-                    "message": "UPI transaction failed"
+                    "message": error
                 }
-                #request_response = frappe.get_doc("Request Response", request_response.name)
-                request_response.response = json.dumps(response)
-                request_response.submit()
-                
+                remember_response(order, response)
+                frappe.db.commit()
+                log_response(request_response, response)
                 return response
 
+            # API successful - update order with payment URLs
+            response = {
+                "message": "Order initialized successfully",
+                "payment_url": api_data.get("payment_url", ""),
+                "success_url": api_data.get("success_url", ""),
+                "failed_url": api_data.get("failed_url", ""),
+                "close_url": api_data.get("close_url", "")
+            }
+            frappe.db.set_value("Order", order.name, {
+                "payment_url": response["payment_url"],
+                "success_url": response["success_url"],
+                "failed_url": response["failed_url"],
+                "close_url": response["close_url"]
+            })
+            remember_response(order, response)
+            frappe.db.commit()
+            log_response(request_response, response)
+            return response
+
     except frappe.ValidationError as e:
         frappe.db.rollback(save_point = "start_transaction")
+        if held:
+            release_hold(held.hold)
+            release_request(context.merchant, data["clientRefId"])
         response = {
             "code": "0x0400",
             "status": "VALIDATION_ERROR", 
@@ -556,13 +441,15 @@ def create_order():
             "data": str(e)
         }
         #request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
         
         return response
         
     except Exception as e:
         frappe.db.rollback(save_point = "start_transaction")
+        if held:
+            release_hold(held.hold)
+            release_request(context.merchant, data["clientRefId"])
         frappe.log_error("Order Creation Error", frappe.get_traceback())
         response = {
             "code": "0x0500",
@@ -571,8 +458,7 @@ def create_order():
             "data": str(e)
         }
         #request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
         return response
 
 @frappe.whitelist()
@@ -595,14 +481,10 @@ def get_order_status():
             "Error in token format. Please verify and try again."
         }
 
-    user_id = frappe.db.get_value("User", {"api_key": api_key},'email')
+    context = get_auth_context(api_key)
+    user_id = context.user if context else None
     # frappe.log_error("User",user_id)
-    request_response = frappe.get_doc({
-        "doctype":"Request Response",
-        "request": data,
-        "header": auth_header,
-        "user": user_id
-    }).insert(ignore_permissions=True)
+    request_response = start_request_log(request=data, header=auth_header, user=user_id)
     
     if not data.get('orderRefId') and not data.get('clientRefId'):
         response = {
@@ -610,9 +492,7 @@ def get_order_status():
             "status": "MISSING_PARAMETER",
             "message": "Either orderRefId or clientRefId is required"
         }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
 
         return response
     
@@ -645,9 +525,7 @@ def get_order_status():
                 "status": order.status
             }
         }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
 
         return response
         
@@ -657,9 +535,7 @@ def get_order_status():
             "status": "NOT_FOUND",
             "message": "Order not found"
         }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
         return response
 
     except Exception as e:
@@ -669,9 +545,7 @@ def get_order_status():
             "message": "Error fetching order status",
             "data": str(e)
         }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
         return response
     pass
 
@@ -718,35 +592,27 @@ def get_wallet_balance():
                 "Error in token format. Please verify and try again."
             }
 
-        user_id = frappe.db.get_value("User", {"api_key": api_key},'email')
-        request_response = frappe.get_doc({
-            "doctype":"Request Response",
-            "header": auth_header,
-            "user": user_id
-        }).insert(ignore_permissions=True)
+        context = get_auth_context(api_key)
+        user_id = context.user if context else None
+        request_response = start_request_log(header=auth_header, user=user_id)
 
-        if not frappe.db.exists("Whitelist IP",{'merchant':user_id,'whitelisted_ip':ip_address}):
+        if not is_ip_allowed(context, ip_address):
             response = {
                 "code": "0x0401",
                 "status": "UNAUTHORIZED ACCESS", 
                 "message": f"Originating IP {ip_address} is blocked by central firewall system. This incident will be reported."
             }
-            request_response = frappe.get_doc("Request Response", request_response.name)
-            request_response.response = json.dumps(response)
-            request_response.submit()
+            log_response(request_response, response)
             return response
 
-        merchant = frappe.get_doc("Merchant", user_id)
-        if merchant.status != "Approved":
+        if context.merchant_status != "Approved":
             response = {
                 "code": "0x0404",
                 "status": "VALIDATION_ERROR",
                 "message": "Validation failed",
-                "data": f"Your Account is in {merchant.status} stage. Please contact Admin"
+                "data": f"Your Account is in {context.merchant_status} stage. Please contact Admin"
             }
-            request_response = frappe.get_doc("Request Response", request_response.name)
-            request_response.response = json.dumps(response)
-            request_response.submit()
+            log_response(request_response, response)
             return response
 
         balance, status = frappe.db.get_value("Wallet",user_id, ["balance","status"])
@@ -756,9 +622,7 @@ def get_wallet_balance():
             "balance": balance,
             "status": status
         }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
         return response
 
     except Exception as e:
@@ -768,9 +632,7 @@ def get_wallet_balance():
             "status": "SERVER_ERROR",
             "message": "Error in fetching wallet"
         }
-        request_response = frappe.get_doc("Request Response", request_response.name)
-        request_response.response = json.dumps(response)
-        request_response.submit()
+        log_response(request_response, response)
         
         return response
 
@@ -846,11 +708,7 @@ def get_merchant(merchant_name):
         """, merchant_name, as_dict=True)
 
         # 3. Get Product Pricing
-        product_pricing = frappe.db.sql("""
-            SELECT product, start_value, end_value, fee_type, fee, tax_fee_type, tax_fee
-            FROM `tabProduct Pricing`
-            WHERE parent = %s
-        """, merchant_name, as_dict=True)
+        product_pricing = get_pricing_rows(merchant_name)
 
         merchant["wallet_balance"] = wallet[0]["balance"] if wallet else 0
         merchant["product_pricing"] = product_pricing
@@ -931,58 +789,32 @@ def update_transaction_status():
         utr = data.get("utr","")
         remark = data.get("remark","")
 
-        doc = frappe.get_doc("Order",order_id)
-
-        frappe.set_user(doc.merchant_ref_id)
+        merchant = frappe.db.get_value("Order", order_id, "merchant_ref_id")
+        if not merchant:
+            frappe.throw(f"Order {order_id} not found")
 
-        transaction = frappe.get_doc("Transaction",{"order":order_id})
-
-        if transaction.docstatus == 1:
-            frappe.log_error(f"Transaction {transaction.name} is submitted. Current status: {transaction.docstatus}", "Webhook Processing")
-            return {
-                "Transaction is already submitted"
-            }
+        frappe.set_user(merchant)
 
+        updated = False
         if status == "FAILED":
-            transaction.status = "Failed"
-            transaction.remark = remark
-            transaction.save(ignore_permissions=True)
-            transaction.submit()
-
-            if status == "FAILED":
-                status = "Cancelled"
-
-            handle_transaction_failure(order_id,status,status,transaction.name)
-            return {
-                "Record updated successfully"
-            }
+            updated = fail(order_id, remark or "Cancelled")
 
         elif status == "REVERSED":
-            transaction.status = "Reversed"
-            transaction.remark = remark
-            transaction.save(ignore_permissions=True)
-            transaction.submit()
-
-            status = "Reversed"
+            updated = fail(order_id, remark or "Reversed", status="Reversed")
 
-            handle_transaction_failure(order_id,status,status,transaction.name)
-            return {
-                "Record updated successfully"
-            }
-            
         elif status == "SUCCESS":
-            transaction.status = "Success"
-            transaction.transaction_reference_id = utr
-            transaction.save(ignore_permissions=True)
-            transaction.submit()
-            
-            doc.status = "Processed"
-            doc.utr = utr
-            doc.save(ignore_permissions=True)
-            frappe.db.commit()
+            updated = complete(order_id, utr=utr, remark=remark)
+
+        if not updated:
+            frappe.log_error(f"Order {order_id} cannot move to {status}", "Webhook Processing")
             return {
-                "Record updated successfully"
+                "Transaction is already submitted"
             }
+
+        frappe.db.commit()
+        return {
+            "Record updated successfully"
+        }
         
     except Exception as e:
         frappe.db.rollback(save_point = "update_record")
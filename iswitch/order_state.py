@@ -0,0 +1,196 @@
+import frappe
+from frappe.utils import now
+
+from .counts import clear_totals
+from .merchant_webhooks import queue_delivery
+from .platform_fee import record_refund
+from .rollups import move_order
+from .wallet_service import credit
+
+# Order / Transaction state machine
+# Every status change of an order goes through one of the transitions below:
+#
+#   Queued -> Processing                          start_processing
+#   Queued | Processing -> Processed              complete
+#   Queued | Processing -> Cancelled | Reversed   fail (refunds the merchant)
+#   Processed -> Reversed                         fail(status="Reversed") (refunds)
+#
+# A transition is one guarded UPDATE of the Order row (WHERE status IN <allowed
+# sources>) followed by the writes that belong to it. When the guard matches no
+# row the order has already moved on, so a duplicate webhook, a requery racing a
+# callback or a retried job is a no-op and returns False. The guard holds the
+# Order row lock until the caller commits, which serialises concurrent callers:
+# the refund of an order can only ever be written once. Each transition also
+# moves the order between statuses in the dashboard rollups and analytics
+# buckets (rollups.py).
+# Transitions do not commit; callers commit with their own unit of work.
+
+QUEUED = "Queued"
+PROCESSING = "Processing"
+PROCESSED = "Processed"
+CANCELLED = "Cancelled"
+REVERSED = "Reversed"
+
+TRANSITIONS = {
+    PROCESSING: (QUEUED,),
+    PROCESSED: (QUEUED, PROCESSING),
+    CANCELLED: (QUEUED, PROCESSING),
+    REVERSED: (QUEUED, PROCESSING, PROCESSED)
+}
+
+# Transaction status written with each final order status
+TRANSACTION_STATUS = {
+    PROCESSED: "Success",
+    CANCELLED: "Failed",
+    REVERSED: "Reversed"
+}
+
+
+def start_processing(order):
+    """
+    Queued -> Processing. Only one caller gets True.
+    """
+    return _move(order, PROCESSING)
+
+
+def complete(order, utr=None, crn=None, remark=None):
+    """
+    Settle an order as Processed and submit its Transaction
+    """
+    if not _move(order, PROCESSED, {"utr": utr} if utr else None):
+        return False
+
+    _close_transaction(order, TRANSACTION_STATUS[PROCESSED], remark, crn, utr)
+    return True
+
+
+def fail(order, reason=None, status=CANCELLED, crn=None):
+    """
+    Cancel or reverse an order, submit its Transaction and refund the merchant
+    """
+    values = {
+        "cancellation_reason": (reason or status)[:100],
+        "cancelled_at": now()
+    }
+    if not _move(order, status, values):
+        return False
+
+    transaction = _close_transaction(order, TRANSACTION_STATUS[status], reason, crn)
+    _refund(order, transaction)
+    return True
+
+
+def mark_pending(order, crn=None, remark=None):
+    """
+    Record that the processor has not settled an open Transaction yet
+    """
+    values = {"status": "Pending", "modified": now()}
+    if crn:
+        values["crn"] = crn
+    if remark:
+        values["remark"] = remark
+
+    frappe.db.sql("""
+        UPDATE `tabTransaction`
+        SET {assignments}
+        WHERE `order` = %(order)s AND docstatus = 0 AND product != 'FEES AND CHARGES'
+    """.format(assignments=_assignments(values)), dict(values, order=order))
+    return bool(frappe.db._cursor.rowcount)
+
+
+def _move(order, status, values=None):
+    # Lock the row first: the status it leaves is moved in the dashboard rollups
+    current = frappe.db.sql("""
+        SELECT name, creation, merchant_ref_id, integration_id, product, status, order_amount, fee, tax
+        FROM `tabOrder`
+        WHERE name = %s
+        FOR UPDATE
+    """, order, as_dict=True)
+    if not current or current[0].status not in TRANSITIONS[status]:
+        return False
+
+    values = dict(values or {}, status=status, modified=now())
+    frappe.db.sql("""
+        UPDATE `tabOrder`
+        SET {assignments}
+        WHERE name = %(order)s AND status IN %(sources)s
+    """.format(assignments=_assignments(values)), dict(values, order=order, sources=TRANSITIONS[status]))
+    if not frappe.db._cursor.rowcount:
+        return False
+
+    move_order(current[0], status)
+    return True
+
+
+def _close_transaction(order, status, remark=None, crn=None, utr=None):
+    """
+    Submit the open Transaction of an order with its final status (a reversal
+    updates the submitted one). Returns its name.
+    """
+    name = frappe.db.get_value(
+        "Transaction",
+        {"order": order, "docstatus": 0, "product": ["!=", "FEES AND CHARGES"]},
+        "name"
+    )
+    docstatus = 0
+    if not name:
+        # Reversal of an order settled earlier: its Transaction is already submitted
+        docstatus = 1
+        name = frappe.db.get_value(
+            "Transaction", {"order": order, "docstatus": 1, "product": ["!=", "FEES AND CHARGES"]}, "name"
+        )
+        if not name:
+            return None
+
+    values = {"status": status, "docstatus": 1, "modified": now()}
+    if remark:
+        values["remark"] = remark[:140]
+    if crn:
+        values["crn"] = crn
+    if utr:
+        values["transaction_reference_id"] = utr
+
+    frappe.db.sql("""
+        UPDATE `tabTransaction`
+        SET {assignments}
+        WHERE name = %(name)s AND docstatus = %(docstatus)s
+    """.format(assignments=_assignments(values)), dict(values, name=name, docstatus=docstatus))
+
+    # Notify the merchant once the settlement commits (merchant_webhooks)
+    queue_delivery(name)
+    return name
+
+
+def _refund(order, transaction):
+    doc = frappe.db.get_value(
+        "Order", order,
+        ["name", "merchant_ref_id", "client_ref_id", "order_amount", "transaction_amount", "fee", "tax"],
+        as_dict=True
+    )
+
+    refund = credit(doc.merchant_ref_id, doc.transaction_amount)
+    if not refund:
+        frappe.throw(f"Wallet of {doc.merchant_ref_id} not found for the refund of {order}")
+
+    # The merchant owns the refund, whoever triggers it (admin, requery, webhook):
+    # the portal lists ledger entries by owner
+    timestamp = now()
+    frappe.db.bulk_insert("Ledger", fields=[
+        "name", "creation", "modified", "owner", "modified_by", "docstatus",
+        "order", "order_amount", "fee", "tax", "transaction_amount",
+        "transaction_type", "status", "transaction_id", "client_ref_id",
+        "opening_balance", "closing_balance"
+    ], values=[(
+        frappe.generate_hash(length=10), timestamp, timestamp, doc.merchant_ref_id, doc.merchant_ref_id, 1,
+        doc.name, doc.order_amount, doc.fee, doc.tax, doc.transaction_amount,
+        "Credit", "Reversed", transaction, doc.client_ref_id,
+        refund.opening_balance, refund.closing_balance
+    )])
+    clear_totals("Ledger", [doc.merchant_ref_id])
+
+    # Reverse the platform fee
+    record_refund(doc)
+
+
+def _assignments(values):
+    return ", ".join(f"`{field}` = %({field})s" for field in values)
@@ -0,0 +1,127 @@
+import base64
+import json
+import re
+
+import frappe
+from frappe.utils import cint, get_datetime
+
+# Keyset pagination
+# Portal listings are ordered by (creation, name), newest first. Instead of
+# LIMIT/OFFSET, which reads and discards every row before the page, a page
+# continues from the row it was reached from:
+#
+#   WHERE ... AND (creation < %(c)s OR (creation = %(c)s AND name < %(n)s))
+#   ORDER BY creation DESC, name DESC
+#
+# The position travels as an opaque cursor (next_cursor / prev_cursor in the
+# response). Offset paging is still accepted for the first MAX_OFFSET_PAGE pages,
+# so page=1 links keep working; deeper pages need a cursor.
+
+MAX_OFFSET_PAGE = 5
+MAX_PAGE_SIZE = 500
+
+NEXT = "next"
+PREV = "prev"
+
+
+class Page:
+    """
+    One page of a listing: adds the cursor condition, ordering and limit to a
+    query and builds the cursors of the rows it returns
+    """
+
+    def __init__(self, alias, page_size=20, cursor=None, page=1):
+        self.alias = alias
+        self.page_size = min(max(cint(page_size), 1), MAX_PAGE_SIZE)
+        self.page = max(cint(page), 1)
+        self.position = decode_cursor(cursor) if cursor else None
+        self.direction = self.position.direction if self.position else NEXT
+        self.keyset = True
+
+        if not self.position and self.page > MAX_OFFSET_PAGE:
+            frappe.throw(f"Pages after {MAX_OFFSET_PAGE} are only available through the cursor")
+
+    @property
+    def uses_cursor(self):
+        return bool(self.position)
+
+    def apply(self, conditions, values):
+        """
+        Add the keyset condition of the cursor to a condition list
+        """
+        if not self.position:
+            return
+
+        operator = "<" if self.direction == NEXT else ">"
+        conditions.append(
+            f"({self.alias}.creation {operator} %(cursor_creation)s OR "
+            f"({self.alias}.creation = %(cursor_creation)s AND {self.alias}.name {operator} %(cursor_name)s))"
+        )
+        values["cursor_creation"] = self.position.creation
+        values["cursor_name"] = self.position.name
+
+    @property
+    def order_by(self):
+        order = "DESC" if self.direction == NEXT else "ASC"
+        return f"{self.alias}.creation {order}, {self.alias}.name {order}"
+
+    def order(self, sort_by="creation", sort_order="desc"):
+        """
+        ORDER BY of a listing sortable by other fields; only newest first pages by cursor
+        """
+        if sort_by == "creation" and str(sort_order).lower() == "desc":
+            return self.order_by
+
+        if self.position:
+            frappe.throw("The cursor only pages the newest-first order")
+        if not re.fullmatch(r"\w+", sort_by or "") or str(sort_order).lower() not in ("asc", "desc"):
+            frappe.throw("Invalid sort order")
+
+        self.keyset = False
+        return f"{self.alias}.{sort_by} {sort_order.upper()}"
+
+    @property
+    def limit(self):
+        # One extra row tells whether another page follows
+        if self.position:
+            return f"LIMIT {self.page_size + 1}"
+        return f"LIMIT {self.page_size + 1} OFFSET {(self.page - 1) * self.page_size}"
+
+    def result(self, rows, creation_key="creation", name_key="name"):
+        """
+        Trim the look-ahead row and return (rows, cursors)
+        """
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.direction == PREV:
+            rows.reverse()
+
+        first = rows[0] if rows and self.keyset else None
+        last = rows[-1] if rows and self.keyset else None
+
+        if self.direction == NEXT:
+            has_next, has_prev = has_more, bool(self.position) or self.page > 1
+        else:
+            has_next, has_prev = True, has_more
+
+        return rows, {
+            "next_cursor": encode_cursor(last[creation_key], last[name_key], NEXT) if has_next and last else None,
+            "prev_cursor": encode_cursor(first[creation_key], first[name_key], PREV) if has_prev and first else None,
+            "has_more": has_next
+        }
+
+
+def encode_cursor(creation, name, direction=NEXT):
+    data = json.dumps([str(creation), name, direction], separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        creation, name, direction = json.loads(data)
+        if direction not in (NEXT, PREV):
+            raise ValueError(direction)
+        return frappe._dict({"creation": get_datetime(creation), "name": name, "direction": direction})
+    except Exception:
+        frappe.throw("Invalid cursor")
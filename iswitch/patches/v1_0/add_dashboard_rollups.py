@@ -0,0 +1,15 @@
+import frappe
+
+from iswitch.rollups import rebuild_rollups
+
+# Index the dashboard rollups (declared on the doctypes for new sites) and fill
+# them from the existing orders and VAN logs
+
+
+def execute():
+    frappe.db.add_index("Order Rollup", ["merchant", "day"], "merchant_day_index")
+    frappe.db.add_index("Order Rollup", ["day", "status"], "day_status_index")
+    frappe.db.add_index("VAN Rollup", ["merchant_email", "day"], "merchant_email_day_index")
+    frappe.db.add_index("VAN Rollup", ["day"], "day_index")
+
+    rebuild_rollups()
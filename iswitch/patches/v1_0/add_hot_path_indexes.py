@@ -0,0 +1,19 @@
+import frappe
+
+# Indexes for the hot query paths
+# The indexes are declared in the on_doctype_update of each doctype, which runs
+# when the doctype is installed. This patch adds them to sites installed before:
+#   - portal listings: WHERE merchant_ref_id / owner [AND status] ORDER BY creation
+#   - admin listings:  ORDER BY creation (transaction_date) with optional filters
+#   - refetch.update_record: WHERE status IN ('Queued', 'Processing')
+#   - dedup lookups:   Virtual Account Logs.utr (unique), Bank ReqRes.msgid
+
+DOCTYPES = [
+    "Order", "Transaction", "Ledger", "Virtual Account Logs", "Virtual Account",
+    "Bank ReqRes", "Customer", "Whitelist IP"
+]
+
+
+def execute():
+    for doctype in DOCTYPES:
+        frappe.get_attr(f"{frappe.get_controller(doctype).__module__}.on_doctype_update")()
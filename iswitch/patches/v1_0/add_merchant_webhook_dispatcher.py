@@ -0,0 +1,18 @@
+import frappe
+
+# Index the delivery queue (declared on Merchant Webhook Delivery for new sites)
+# and turn off the per-merchant Transaction webhooks it replaces, so settled
+# transactions are not notified twice
+
+
+def execute():
+    frappe.db.add_index("Merchant Webhook Delivery", ["status", "next_attempt_at", "creation"], "status_next_attempt_index")
+    frappe.db.add_index("Merchant Webhook Delivery", ["merchant", "creation"], "merchant_creation_index")
+
+    frappe.db.sql("""
+        UPDATE `tabWebhook`
+        SET enabled = 0
+        WHERE webhook_doctype = 'Transaction' AND webhook_docevent = 'on_submit'
+            AND name IN (SELECT name FROM `tabMerchant`)
+    """)
+    frappe.cache().delete_value("webhooks")
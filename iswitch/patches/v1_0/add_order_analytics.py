@@ -0,0 +1,18 @@
+import frappe
+
+from iswitch.analytics import rebuild_buckets
+
+# Index the hourly order analytics buckets (declared on the doctype for new sites)
+# and fill them from the existing orders
+
+
+def execute():
+    frappe.db.add_index("Order Analytics Bucket", ["bucket"], "bucket_index")
+    frappe.db.add_index("Order Analytics Bucket", ["merchant", "bucket"], "merchant_bucket_index")
+
+    merchants = frappe.db.sql(
+        "SELECT DISTINCT merchant_ref_id FROM `tabOrder` WHERE merchant_ref_id IS NOT NULL", pluck=True
+    )
+    for merchant in merchants:
+        rebuild_buckets(merchant)
+        frappe.db.commit()
@@ -0,0 +1,14 @@
+import frappe
+
+# Index the inbound webhook queue (declared on Blinkpe Webhook for new sites);
+# rows stored before it are already applied
+
+
+def execute():
+    frappe.db.add_index("Blinkpe Webhook", ["status", "next_attempt_at", "creation"], "status_next_attempt_index")
+
+    frappe.db.sql("""
+        UPDATE `tabBlinkpe Webhook`
+        SET status = 'Processed'
+        WHERE (status IS NULL OR status = '') AND docstatus = 1
+    """)
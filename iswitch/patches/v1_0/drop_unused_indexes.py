@@ -0,0 +1,17 @@
+import frappe
+
+# Indexes no query reads from: orders are never filtered on status together with
+# integration, and ledger entries / VAN logs are never looked up by order or
+# account number. They only slowed down every insert.
+
+INDEXES = [
+    ("Order", "status_integration_index"),
+    ("Ledger", "order_index"),
+    ("Virtual Account Logs", "account_number_index"),
+]
+
+
+def execute():
+    for doctype, index_name in INDEXES:
+        if frappe.db.has_index(f"tab{doctype}", index_name):
+            frappe.db.sql_ddl(f"ALTER TABLE `tab{doctype}` DROP INDEX `{index_name}`")
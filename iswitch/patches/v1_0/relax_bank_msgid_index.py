@@ -0,0 +1,10 @@
+import frappe
+
+# Bank ReqRes keeps a row per request, duplicates included: replace the unique
+# msgid index (dedup moved to the unique dedup_key) with a plain one
+
+
+def execute():
+    if frappe.db.has_index("tabBank ReqRes", "unique_msgid"):
+        frappe.db.sql_ddl("ALTER TABLE `tabBank ReqRes` DROP INDEX `unique_msgid`")
+    frappe.db.add_index("Bank ReqRes", ["msgid"], "msgid_index")
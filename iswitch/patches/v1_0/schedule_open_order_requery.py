@@ -0,0 +1,15 @@
+import frappe
+from frappe.utils import now_datetime
+
+# Index the requery schedule (declared on Order for new sites) and make every
+# open order due for a first check
+
+
+def execute():
+    frappe.db.add_index("Order", ["status", "next_check_at"], "status_next_check_index")
+
+    frappe.db.sql("""
+        UPDATE `tabOrder`
+        SET next_check_at = %s
+        WHERE status IN ('Queued', 'Processing') AND next_check_at IS NULL
+    """, now_datetime())
@@ -0,0 +1,155 @@
+import frappe
+
+from .admin_portal_api import check_admin_permission
+from .utils import acquire_lock, release_lock
+
+# Platform fee journal
+# Orders and refunds append a Platform Fee Journal row instead of rewriting the
+# tax/fee values of the Xettle Wallet single, so concurrent orders never wait on
+# (or overwrite) one shared row. roll_up_platform_fees folds unrolled entries into
+# Xettle Wallet on a schedule; get_platform_fees adds the entries still pending.
+
+LOCK_KEY = "iswitch:platform_fee_rollup_lock"
+LOCK_TTL = 300
+
+ROLLUP_BATCH_SIZE = 5000
+
+
+def record_fee(merchant, client_ref_id, fee, tax, order=None):
+    """
+    Journal the fee and tax charged on an order
+    """
+    _append("Charge", merchant, client_ref_id, order, float(fee or 0), float(tax or 0))
+
+
+def record_fees(entries):
+    """
+    Journal the fees of many orders in one insert.
+    entries: dicts with merchant, client_ref_id, order, fee and tax
+    """
+    if not entries:
+        return
+
+    timestamp = frappe.utils.now()
+    values = [(
+        frappe.generate_hash(length=10), timestamp, timestamp, frappe.session.user, frappe.session.user,
+        "Charge", entry["merchant"], entry["client_ref_id"], entry.get("order"),
+        float(entry.get("fee") or 0), float(entry.get("tax") or 0), 0
+    ) for entry in entries]
+
+    frappe.db.bulk_insert("Platform Fee Journal", fields=[
+        "name", "creation", "modified", "owner", "modified_by",
+        "entry_type", "merchant", "client_ref_id", "order", "fee", "tax", "rolled_up"
+    ], values=values)
+
+
+def record_refund(order):
+    """
+    Journal the reversal of the fee and tax of a failed order
+    """
+    _append(
+        "Refund", order.merchant_ref_id, order.client_ref_id, order.name,
+        -float(order.fee or 0), -float(order.tax or 0)
+    )
+
+
+def roll_up_platform_fees():
+    """
+    Add unrolled journal entries to Xettle Wallet, one batch per transaction
+    """
+    lock = acquire_lock(LOCK_KEY, LOCK_TTL)
+    if not lock:
+        return
+
+    try:
+        while True:
+            entries = frappe.db.sql("""
+                SELECT name, fee, tax
+                FROM `tabPlatform Fee Journal`
+                WHERE rolled_up = 0
+                ORDER BY creation
+                LIMIT %s
+            """, (ROLLUP_BATCH_SIZE,), as_dict=True)
+            if not entries:
+                break
+
+            frappe.db.sql("""
+                UPDATE `tabPlatform Fee Journal`
+                SET rolled_up = 1
+                WHERE name IN %(names)s AND rolled_up = 0
+            """, {"names": tuple(entry.name for entry in entries)})
+
+            totals = _lock_wallet_totals()
+            frappe.db.set_single_value("Xettle Wallet", {
+                "fee": totals["fee"] + sum(float(entry.fee or 0) for entry in entries),
+                "tax": totals["tax"] + sum(float(entry.tax or 0) for entry in entries)
+            })
+            frappe.db.commit()
+
+            if len(entries) < ROLLUP_BATCH_SIZE:
+                break
+    except Exception as e:
+        frappe.db.rollback()
+        frappe.log_error("Error in platform fee roll-up", str(e))
+    finally:
+        release_lock(LOCK_KEY, lock)
+
+
+@frappe.whitelist()
+def get_platform_fees(as_of=None):
+    """
+    Exact platform fee and tax totals, now or as of a past datetime.
+    Rolled-up and pending entries are read in one statement, so a roll-up
+    running at the same time cannot make an entry count twice or not at all.
+    """
+    check_admin_permission()
+
+    as_of = frappe.utils.get_datetime(as_of) if as_of else None
+    totals = frappe.db.sql("""
+        SELECT
+            COALESCE((
+                SELECT CAST(value AS DECIMAL(21, 9)) FROM `tabSingles`
+                WHERE doctype = 'Xettle Wallet' AND field = 'fee'
+            ), 0)
+            + COALESCE(SUM(CASE WHEN rolled_up = 0 THEN fee ELSE 0 END), 0)
+            - COALESCE(SUM(CASE WHEN %(as_of)s IS NOT NULL AND creation > %(as_of)s THEN fee ELSE 0 END), 0) AS fee,
+            COALESCE((
+                SELECT CAST(value AS DECIMAL(21, 9)) FROM `tabSingles`
+                WHERE doctype = 'Xettle Wallet' AND field = 'tax'
+            ), 0)
+            + COALESCE(SUM(CASE WHEN rolled_up = 0 THEN tax ELSE 0 END), 0)
+            - COALESCE(SUM(CASE WHEN %(as_of)s IS NOT NULL AND creation > %(as_of)s THEN tax ELSE 0 END), 0) AS tax
+        FROM `tabPlatform Fee Journal`
+        WHERE rolled_up = 0 OR (%(as_of)s IS NOT NULL AND creation > %(as_of)s)
+    """, {"as_of": as_of}, as_dict=True)[0]
+
+    return {
+        "fee": float(totals.fee or 0),
+        "tax": float(totals.tax or 0),
+        "as_of": as_of or frappe.utils.now_datetime()
+    }
+
+
+def _append(entry_type, merchant, client_ref_id, order, fee, tax):
+    frappe.get_doc({
+        "doctype": "Platform Fee Journal",
+        "entry_type": entry_type,
+        "merchant": merchant,
+        "client_ref_id": client_ref_id,
+        "order": order,
+        "fee": fee,
+        "tax": tax
+    }).insert(ignore_permissions=True)
+
+
+def _lock_wallet_totals():
+    rows = frappe.db.sql("""
+        SELECT field, value FROM `tabSingles`
+        WHERE doctype = 'Xettle Wallet' AND field IN ('fee', 'tax')
+        FOR UPDATE
+    """, as_dict=True)
+
+    totals = {"fee": 0.0, "tax": 0.0}
+    for row in rows:
+        totals[row.field] = float(row.value or 0)
+    return totals
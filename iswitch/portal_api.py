@@ -3,6 +3,9 @@ from frappe import _
 import json
 from datetime import datetime, timedelta
 from werkzeug.wrappers import Response
+from .counts import get_total
+from .exports import csv_response
+from .pagination import Page
 
 @frappe.whitelist()
 def get_dashboard_stats():
@@ -13,18 +16,18 @@ def get_dashboard_stats():
         # Get wallet balance
         wallet = frappe.db.get_value("Wallet", user_id, ["balance", "status"], as_dict=True)
         
-        # Get transaction statistics
+        # Get transaction statistics from the all-time rollup rows (rollups.py)
         stats = frappe.db.sql("""
             SELECT 
-                COUNT(*) as total_orders,
-                SUM(CASE WHEN status = 'Processed' THEN 1 ELSE 0 END) as processed_orders,
-                SUM(CASE WHEN status = 'Processing' THEN 1 ELSE 0 END) as pending_orders,
-                SUM(CASE WHEN status = 'Cancelled' THEN 1 ELSE 0 END) as cancelled_orders,
+                COALESCE(SUM(order_count), 0) as total_orders,
+                SUM(CASE WHEN status = 'Processed' THEN order_count ELSE 0 END) as processed_orders,
+                SUM(CASE WHEN status = 'Processing' THEN order_count ELSE 0 END) as pending_orders,
+                SUM(CASE WHEN status = 'Cancelled' THEN order_count ELSE 0 END) as cancelled_orders,
                 SUM(CASE WHEN status = 'Processed' THEN order_amount ELSE 0 END) as total_processed_amount,
                 SUM(CASE WHEN status = 'Processing' THEN order_amount ELSE 0 END) as total_pending_amount,
                 SUM(CASE WHEN status = 'Cancelled' THEN order_amount ELSE 0 END) as total_cancelled_amount
-            FROM `tabOrder`
-            WHERE merchant_ref_id = %s
+            FROM `tabOrder Rollup`
+            WHERE merchant = %s AND day IS NULL
         """, (user_id,), as_dict=True)[0]
         
         # Get merchant info
@@ -58,13 +61,13 @@ def get_dashboard_stats():
         return Response(f'<div class="empty-state"><h3>Error loading dashboard</h3><p>{str(e)}</p></div>')
 
 @frappe.whitelist()
-def get_merchant_orders(page=1, limit=10, status=None, from_date=None, to_date=None):
-    """Get paginated orders for the current merchant with filters"""
+def get_merchant_orders(page=1, limit=10, status=None, from_date=None, to_date=None, cursor=None, total=None):
+    """Get paginated orders for the current merchant with filters (keyset pages through `cursor`)"""
     try:
         user_id = frappe.session.user
         page = int(page)
-        limit = int(limit)
-        offset = (page - 1) * limit
+        listing = Page("o", limit, cursor, page)
+        limit = listing.page_size
         
         # Build filter conditions
         conditions = ["merchant_ref_id = %(user_id)s"]
@@ -83,14 +86,14 @@ def get_merchant_orders(page=1, limit=10, status=None, from_date=None, to_date=N
             conditions.append("creation <= %(to_date)s")
             params["to_date"] = f"{to_date} 23:59:59"
         
-        where_clause = " AND ".join(conditions)
+        # Get total count (cursor pages carry the total of the first page)
+        if listing.uses_cursor and total is not None:
+            total = int(total)
+        else:
+            total, _approximate = get_total("Order", "o", conditions, params, scope=user_id)
         
-        # Get total count
-        total = frappe.db.sql(f"""
-            SELECT COUNT(*) as count
-            FROM `tabOrder`
-            WHERE {where_clause}
-        """, params, as_dict=True)[0]["count"]
+        listing.apply(conditions, params)
+        where_clause = " AND ".join(conditions)
         
         # Get orders
         orders = frappe.db.sql(f"""
@@ -98,11 +101,12 @@ def get_merchant_orders(page=1, limit=10, status=None, from_date=None, to_date=N
                 name, client_ref_id, customer_name, order_amount,
                 fee, tax, transaction_amount, product, status,
                 utr, creation, modified
-            FROM `tabOrder`
+            FROM `tabOrder` o
             WHERE {where_clause}
-            ORDER BY creation DESC
-            LIMIT %(limit)s OFFSET %(offset)s
-        """, {**params, "limit": limit, "offset": offset}, as_dict=True)
+            ORDER BY {listing.order_by}
+            {listing.limit}
+        """, params, as_dict=True)
+        orders, cursors = listing.result(orders)
         
         context = {
             "orders": orders,
@@ -110,7 +114,8 @@ def get_merchant_orders(page=1, limit=10, status=None, from_date=None, to_date=N
                 "page": page,
                 "limit": limit,
                 "total": total,
-                "pages": (total + limit - 1) // limit if total > 0 else 1
+                "pages": (total + limit - 1) // limit if total > 0 else 1,
+                **cursors
             },
             "filters": {
                 "status": status,
@@ -150,8 +155,8 @@ def export_merchant_orders(status=None, from_date=None, to_date=None):
         
         where_clause = " AND ".join(conditions)
         
-        # Get orders
-        orders = frappe.db.sql(f"""
+        # Orders to export
+        query = f"""
             SELECT 
                 name as 'Order ID',
                 creation as 'Date',
@@ -166,7 +171,15 @@ def export_merchant_orders(status=None, from_date=None, to_date=None):
             FROM `tabOrder`
             WHERE {where_clause}
             ORDER BY creation DESC
-        """, params, as_dict=True)
+        """
+        
+        # Any row at all? (the CSV itself is streamed)
+        orders = frappe.db.sql(f"""
+            SELECT 1
+            FROM `tabOrder`
+            WHERE {where_clause}
+            LIMIT 1
+        """, params)
         
         if not orders:
             # Return HTML that redirects back with a message
@@ -186,34 +199,27 @@ def export_merchant_orders(status=None, from_date=None, to_date=None):
             '''
             return Response(html, content_type='text/html')
             
-        # Generate CSV
-        import csv
-        from io import StringIO
-        
-        f = StringIO()
-        writer = csv.DictWriter(f, fieldnames=orders[0].keys())
-        writer.writeheader()
-        writer.writerows(orders)
-        
-        frappe.response['filename'] = f'Orders_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-        frappe.response['filecontent'] = f.getvalue()
-        frappe.response['type'] = 'download'
+        return csv_response(
+            query, params,
+            f'Orders_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv',
+            title="Export Merchant Orders Error"
+        )
         
     except Exception as e:
         frappe.log_error("Export Merchant Orders Error", str(e))
         frappe.throw(str(e))
 
 @frappe.whitelist()
-def get_merchant_ledger(page=1, limit=10, transaction_type=None, from_date=None, to_date=None):
-    """Get paginated ledger entries for the current merchant"""
+def get_merchant_ledger(page=1, limit=10, transaction_type=None, from_date=None, to_date=None, cursor=None, total=None):
+    """Get paginated ledger entries for the current merchant (keyset pages through `cursor`)"""
     try:
         user_id = frappe.session.user
         page = int(page)
-        limit = int(limit)
-        offset = (page - 1) * limit
+        listing = Page("l", limit, cursor, page)
+        limit = listing.page_size
         
         # Build filter conditions
-        conditions = ["o.merchant_ref_id = %(user_id)s"]
+        conditions = ["l.owner = %(user_id)s"]
         params = {"user_id": user_id}
         
         if transaction_type:
@@ -228,15 +234,14 @@ def get_merchant_ledger(page=1, limit=10, transaction_type=None, from_date=None,
             conditions.append("l.creation <= %(to_date)s")
             params["to_date"] = f"{to_date} 23:59:59"
         
-        where_clause = " AND ".join(conditions)
+        # Get total count (cursor pages carry the total of the first page)
+        if listing.uses_cursor and total is not None:
+            total = int(total)
+        else:
+            total, _approximate = get_total("Ledger", "l", conditions, params, scope=user_id)
         
-        # Get total count
-        total = frappe.db.sql(f"""
-            SELECT COUNT(*) as count
-            FROM `tabLedger` l
-            LEFT JOIN `tabOrder` o ON l.order = o.name
-            WHERE {where_clause}
-        """, params, as_dict=True)[0]["count"]
+        listing.apply(conditions, params)
+        where_clause = " AND ".join(conditions)
         
         # Get ledger entries
         ledger = frappe.db.sql(f"""
@@ -247,11 +252,11 @@ def get_merchant_ledger(page=1, limit=10, transaction_type=None, from_date=None,
                 l.transaction_amount,
                 l.creation, l.modified
             FROM `tabLedger` l
-            LEFT JOIN `tabOrder` o ON l.order = o.name
             WHERE {where_clause}
-            ORDER BY l.creation DESC
-            LIMIT %(limit)s OFFSET %(offset)s
-        """, {**params, "limit": limit, "offset": offset}, as_dict=True)
+            ORDER BY {listing.order_by}
+            {listing.limit}
+        """, params, as_dict=True)
+        ledger, cursors = listing.result(ledger)
         
         context = {
             "ledger": ledger,
@@ -259,7 +264,8 @@ def get_merchant_ledger(page=1, limit=10, transaction_type=None, from_date=None,
                 "page": page,
                 "limit": limit,
                 "total": total,
-                "pages": (total + limit - 1) // limit if total > 0 else 1
+                "pages": (total + limit - 1) // limit if total > 0 else 1,
+                **cursors
             },
             "filters": {
                 "transaction_type": transaction_type,
@@ -301,8 +307,8 @@ def export_merchant_ledger(transaction_type=None, from_date=None, to_date=None):
         
         where_clause = " AND ".join(conditions)
         
-        # Get ledger entries
-        ledger = frappe.db.sql(f"""
+        # Ledger entries to export
+        query = f"""
             SELECT 
                 l.name as 'Ledger ID',
                 l.creation as 'Date',
@@ -316,7 +322,15 @@ def export_merchant_ledger(transaction_type=None, from_date=None, to_date=None):
             FROM `tabLedger` l
             WHERE {where_clause}
             ORDER BY l.creation DESC
-        """, params, as_dict=True)
+        """
+        
+        # Any row at all? (the CSV itself is streamed)
+        ledger = frappe.db.sql(f"""
+            SELECT 1
+            FROM `tabLedger` l
+            WHERE {where_clause}
+            LIMIT 1
+        """, params)
         
         if not ledger:
             html = '''
@@ -335,18 +349,11 @@ def export_merchant_ledger(transaction_type=None, from_date=None, to_date=None):
             '''
             return Response(html, content_type='text/html')
             
-        # Generate CSV
-        import csv
-        from io import StringIO
-        
-        f = StringIO()
-        writer = csv.DictWriter(f, fieldnames=ledger[0].keys())
-        writer.writeheader()
-        writer.writerows(ledger)
-        
-        frappe.response['filename'] = f'Ledger_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-        frappe.response['filecontent'] = f.getvalue()
-        frappe.response['type'] = 'download'
+        return csv_response(
+            query, params,
+            f'Ledger_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv',
+            title="Export Merchant Ledger Error"
+        )
         
     except Exception as e:
         frappe.log_error("Export Merchant Ledger Error", str(e))
@@ -354,45 +361,46 @@ def export_merchant_ledger(transaction_type=None, from_date=None, to_date=None):
 
 
 @frappe.whitelist()
-def get_merchant_van_logs(page=1, limit=10, from_date=None, to_date=None):
-    """Get Virtual Account logs for the current merchant"""
+def get_merchant_van_logs(page=1, limit=10, from_date=None, to_date=None, cursor=None, total=None):
+    """Get Virtual Account logs for the current merchant (keyset pages through `cursor`)"""
     try:
         user_id = frappe.session.user
         page = int(page)
-        limit = int(limit)
-        offset = (page - 1) * limit
+        listing = Page("v", limit, cursor, page)
+        limit = listing.page_size
         
         # Build filter conditions
-        conditions = ["owner = %(user_id)s"]
+        conditions = ["v.owner = %(user_id)s"]
         params = {"user_id": user_id}
         
         if from_date:
-            conditions.append("creation >= %(from_date)s")
+            conditions.append("v.creation >= %(from_date)s")
             params["from_date"] = from_date
             
         if to_date:
-            conditions.append("creation <= %(to_date)s")
+            conditions.append("v.creation <= %(to_date)s")
             params["to_date"] = f"{to_date} 23:59:59"
         
-        where_clause = " AND ".join(conditions)
+        # Get total count (cursor pages carry the total of the first page)
+        if listing.uses_cursor and total is not None:
+            total = int(total)
+        else:
+            total, _approximate = get_total("Virtual Account Logs", "v", conditions, params, scope=user_id)
         
-        # Get total count
-        total = frappe.db.sql(f"""
-            SELECT COUNT(*) as count
-            FROM `tabVirtual Account Logs`
-            WHERE {where_clause}
-        """, params, as_dict=True)[0]["count"]
+        listing.apply(conditions, params)
+        where_clause = " AND ".join(conditions)
         
         # Get logs
         logs = frappe.db.sql(f"""
             SELECT 
-                name, account_number, amount, merchant,
-                merchant_email, utr, creation, modified
-            FROM `tabVirtual Account Logs`
+                v.name, v.account_number, v.amount, v.merchant,
+                v.merchant_email, v.utr, v.creation, v.modified
+            FROM `tabVirtual Account Logs` v
             WHERE {where_clause}
-            ORDER BY creation DESC
-            LIMIT %(limit)s OFFSET %(offset)s
-        """, {**params, "limit": limit, "offset": offset}, as_dict=True)
+            ORDER BY {listing.order_by}
+            {listing.limit}
+        """, params, as_dict=True)
+        logs, cursors = listing.result(logs)
         
         context = {
             "logs": logs,
@@ -400,7 +408,8 @@ def get_merchant_van_logs(page=1, limit=10, from_date=None, to_date=None):
                 "page": page,
                 "limit": limit,
                 "total": total,
-                "pages": (total + limit - 1) // limit if total > 0 else 1
+                "pages": (total + limit - 1) // limit if total > 0 else 1,
+                **cursors
             },
             "filters": {
                 "from_date": from_date,
@@ -435,8 +444,8 @@ def export_merchant_van_logs(from_date=None, to_date=None):
         
         where_clause = " AND ".join(conditions)
         
-        # Get logs
-        logs = frappe.db.sql(f"""
+        # Logs to export
+        query = f"""
             SELECT 
                 name as 'TXN ID',
                 account_number as 'Account Number',
@@ -449,7 +458,15 @@ def export_merchant_van_logs(from_date=None, to_date=None):
             FROM `tabVirtual Account Logs`
             WHERE {where_clause}
             ORDER BY creation DESC
-        """, params, as_dict=True)
+        """
+        
+        # Any row at all? (the CSV itself is streamed)
+        logs = frappe.db.sql(f"""
+            SELECT 1
+            FROM `tabVirtual Account Logs`
+            WHERE {where_clause}
+            LIMIT 1
+        """, params)
         
         if not logs:
             html = '''
@@ -468,18 +485,11 @@ def export_merchant_van_logs(from_date=None, to_date=None):
             '''
             return Response(html, content_type='text/html')
             
-        # Generate CSV
-        import csv
-        from io import StringIO
-        
-        f = StringIO()
-        writer = csv.DictWriter(f, fieldnames=logs[0].keys())
-        writer.writeheader()
-        writer.writerows(logs)
-        
-        frappe.response['filename'] = f'VAN_Logs_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-        frappe.response['filecontent'] = f.getvalue()
-        frappe.response['type'] = 'download'
+        return csv_response(
+            query, params,
+            f'VAN_Logs_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv',
+            title="Export VAN Logs Error"
+        )
         
     except Exception as e:
         frappe.log_error("Export VAN Logs Error", str(e))
@@ -0,0 +1,203 @@
+from bisect import bisect_right
+from functools import partial
+
+import frappe
+from frappe import _
+
+from .utils import after_commit
+
+# Pricing engine
+# Product Pricing rows of a Merchant or Integration compiled into one sorted slab
+# list per product. Lookups are a binary search over the slab start values.
+# Compiled tables live in Redis keyed by parent and are rebuilt per parent on save.
+
+CACHE_KEY = "iswitch:pricing"
+
+PRICING_FIELDS = ["product", "start_value", "end_value", "fee_type", "fee", "tax_fee_type", "tax_fee"]
+
+# Slabs are configured in whole rupees (0-1000, 1001-25000), so a step of up to
+# one rupee between consecutive slabs is not a gap
+MAX_SLAB_STEP = 1
+
+
+def get_pricing(parent):
+    """
+    Return the compiled pricing of a Merchant or Integration: {product: {"starts", "slabs"}}
+    """
+    if not parent:
+        return {}
+
+    compiled = frappe.cache().hget(CACHE_KEY, parent)
+    if compiled is None:
+        compiled = compile_rows(_load_rows([parent]).get(parent, []))
+        frappe.cache().hset(CACHE_KEY, parent, compiled)
+    return compiled
+
+
+def get_pricing_map(parents):
+    """
+    Compiled pricing for several parents, loading all cache misses in one query
+    """
+    result = {}
+    missing = []
+    for parent in parents:
+        compiled = frappe.cache().hget(CACHE_KEY, parent)
+        if compiled is None:
+            missing.append(parent)
+        else:
+            result[parent] = compiled
+
+    if missing:
+        rows_by_parent = _load_rows(missing)
+        for parent in missing:
+            compiled = compile_rows(rows_by_parent.get(parent, []))
+            frappe.cache().hset(CACHE_KEY, parent, compiled)
+            result[parent] = compiled
+
+    return result
+
+
+def get_pricing_rows(parent):
+    """
+    Flat list of pricing slabs of a parent, as returned to the portals
+    """
+    return flatten(get_pricing(parent))
+
+
+def flatten(compiled):
+    return [slab for product in sorted(compiled) for slab in compiled[product]["slabs"]]
+
+
+def find_slab(compiled, product, amount, inclusive_end=True):
+    """
+    Return the slab of a product that covers an amount, or None
+    """
+    table = compiled.get(product)
+    if not table:
+        return None
+
+    index = bisect_right(table["starts"], amount) - 1
+    if index < 0:
+        return None
+
+    slab = table["slabs"][index]
+    if amount < slab.end_value or (inclusive_end and amount == slab.end_value):
+        return slab
+
+    # A slab ending exactly where the next one starts keeps its inclusive upper bound
+    if inclusive_end and index > 0 and amount == table["slabs"][index - 1].end_value:
+        return table["slabs"][index - 1]
+
+    return None
+
+
+def find_slabs(compiled, product, amounts, inclusive_end=True):
+    """
+    Slabs of a product for many amounts, in input order. The amounts are sorted
+    and matched in one pass, so each slab is looked up once however many amounts
+    fall into it.
+    """
+    table = compiled.get(product)
+    if not table:
+        return [None] * len(amounts)
+
+    result = [None] * len(amounts)
+    slab = None
+    for position in sorted(range(len(amounts)), key=lambda i: amounts[i]):
+        amount = amounts[position]
+        if slab is None or not _covers(slab, amount, inclusive_end):
+            slab = find_slab(compiled, product, amount, inclusive_end)
+        result[position] = slab
+    return result
+
+
+def has_product(compiled, product):
+    return product in compiled
+
+
+def compile_rows(rows):
+    compiled = {}
+    for row in sorted(rows, key=lambda r: (r.product, r.start_value)):
+        table = compiled.setdefault(row.product, {"starts": [], "slabs": []})
+        table["starts"].append(row.start_value)
+        table["slabs"].append(row)
+    return compiled
+
+
+def validate_pricing(doc, method=None):
+    """
+    Reject overlapping or gapped slabs on a Merchant or Integration before it is saved
+    """
+    rows = [_normalise(row) for row in doc.get("product_pricing") or []]
+
+    for row in rows:
+        if row.start_value > row.end_value:
+            frappe.throw(
+                _("Pricing slab {0} - {1} for {2} starts after it ends").format(
+                    row.start_value, row.end_value, row.product
+                ),
+                frappe.ValidationError
+            )
+
+    for product, table in compile_rows(rows).items():
+        slabs = table["slabs"]
+        for previous, current in zip(slabs, slabs[1:]):
+            if current.start_value < previous.end_value:
+                frappe.throw(
+                    _("Pricing slabs {0} - {1} and {2} - {3} for {4} overlap").format(
+                        previous.start_value, previous.end_value,
+                        current.start_value, current.end_value, product
+                    ),
+                    frappe.ValidationError
+                )
+            if current.start_value - previous.end_value > MAX_SLAB_STEP:
+                frappe.throw(
+                    _("Pricing for {0} has no slab between {1} and {2}").format(
+                        product, previous.end_value, current.start_value
+                    ),
+                    frappe.ValidationError
+                )
+
+
+def rebuild_pricing(doc, method=None):
+    """
+    Recompile the pricing of the saved parent from the document itself
+    """
+    compiled = compile_rows([_normalise(row) for row in doc.get("product_pricing") or []])
+    after_commit(partial(_store, doc.name, compiled))
+
+
+def clear_pricing(doc, method=None):
+    after_commit(partial(frappe.cache().hdel, CACHE_KEY, doc.name), run_now=True)
+
+
+def _covers(slab, amount, inclusive_end):
+    return slab.start_value <= amount and (
+        amount < slab.end_value or (inclusive_end and amount == slab.end_value)
+    )
+
+
+def _store(parent, compiled):
+    frappe.cache().hset(CACHE_KEY, parent, compiled)
+
+
+def _load_rows(parents):
+    rows = frappe.db.sql("""
+        SELECT parent, product, start_value, end_value, fee_type, fee, tax_fee_type, tax_fee
+        FROM `tabProduct Pricing`
+        WHERE parent IN %(parents)s
+    """, {"parents": tuple(parents)}, as_dict=True)
+
+    rows_by_parent = {}
+    for row in rows:
+        rows_by_parent.setdefault(row.pop("parent"), []).append(_normalise(row))
+    return rows_by_parent
+
+
+def _normalise(row):
+    slab = frappe._dict({field: row.get(field) for field in PRICING_FIELDS})
+    slab.start_value = float(slab.start_value or 0)
+    slab.end_value = float(slab.end_value or 0)
+    slab.fee = float(slab.fee or 0)
+    slab.tax_fee = float(slab.tax_fee or 0)
+    return slab
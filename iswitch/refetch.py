@@ -1,10 +1,15 @@
 import frappe
-import requests
 import jwt
 import json
 from datetime import datetime as dt, timedelta as td
 import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from .bank import JSONEncryptionDecryption
+from .order_state import complete, fail
+from . import http_client
+from .utils import acquire_lock, extend_lock, release_lock
+from frappe.utils import add_to_date, get_datetime, now_datetime
 
 def generate_hash(merchant_id, parameters, hashing_method, secret_key, key_order):
     hash_data = str(merchant_id)
@@ -51,153 +56,269 @@ def generate_token(processor):
         return None
 
 
-@frappe.whitelist(allow_guest=True)
-def update_record():
-    results = frappe.db.sql("""
-        SELECT name, integration_id FROM `tabOrder`
-        WHERE status IN ('Queued', 'Processing')
-    """, as_dict=True)
-    frappe.log_error("Order to processed",results)
-    
-    for result in results:
-        frappe.db.savepoint("status_process")
-        try:
-            txn_status = ""
-            utr = ""
-
-            if result.integration_id == "Airtel Payment Bank":
-
-                processor = frappe.get_doc("Integration", result.integration_id)
-                rrn = frappe.db.get_value("Transaction",{"order":result.name},'crn')
-                headers = {
-                    "Content-Type": "application/v2+json"
-                }
-
-                payload = {
-                    "channel": processor.get_password("client_id"),
-                    "feSessionId": result.name,
-                    "hdnOrderID": result.name,
-                    "merchantId": processor.get_password("client_id"),
-                    "ver": "2.0",
-                    "rrn": rrn
-                }
-                hash_string = get_hash_string(payload,processor.get_password("secret_key"))
-
-                hash_code = hashlib.sha512(hash_string.encode('utf-8')).hexdigest()
-
-                payload["hash"] = hash_code
-
-                url = processor.api_endpoint.rstrip("/") + "/upiMerCollectCheckTxn"
-                api_response = requests.post(url, headers = headers, json = payload, timeout = 30)
-
-                try:
-                    api_data = api_response.json()
-                    frappe.log_error(f"Requery API Response {result.name}", api_data)
-                    status = api_data.get("txnStatus")
-                    if status == "SUCCESS":
-                        txn_status = "Success"
-                    elif status == "FAILURE":
-                        txn_status = "Failed"
-                    
-                except Exception as e:
-                    frappe.db.rollback(save_point = "status_process")
-                    frappe.log_error(f"Error in requery {result.name}", api_response.text)
-            
-            if txn_status == "Success":
-                doc = frappe.get_doc("Order", result.name)
-                frappe.set_user(doc.merchant_ref_id)
-                
-                name = frappe.db.get_value("Transaction",{"order":doc.name}, ['name'])
-                
-                transaction = frappe.get_doc("Transaction",name)
-                if transaction.docstatus != 1:
-                    transaction.status = txn_status
-                    transaction.transaction_reference_id = utr
-                    transaction.remark = "Transaction Completed"
-                    transaction.save(ignore_permissions=True)
-                    transaction.submit()
-
-                    doc.status = "Processed"
-                    doc.utr = utr
-                    doc.save(ignore_permissions=True)
-                    frappe.db.commit()
-
-            elif txn_status == "Failed" or txn_status == "Reversed":
-                
-                doc = frappe.get_doc("Order", result.name)
-                frappe.set_user(doc.merchant_ref_id)
-
-                name = frappe.db.get_value("Transaction",{"order":doc.name, "merchant":doc.merchant_ref_id}, ['name'])
-                transaction = frappe.get_doc("Transaction",name)
-                
-                if transaction.docstatus == 0:
-                    transaction.status = txn_status
-                    transaction.remark = "Failed transaction"
-                    transaction.save(ignore_permissions=True)
-                    transaction.submit()
-        
-                    if txn_status == "Failed":
-                        txn_status = "Cancelled"
+# Requery schedule
+# Every open order (Queued / Processing) carries next_check_at and
+# requery_attempts. A new order is first checked FIRST_CHECK_DELAY seconds after
+# creation, then with exponential backoff up to MAX_DELAY; orders older than
+# STALE_AFTER are only checked every STALE_DELAY, so a stuck backlog cannot
+# crowd out fresh orders. The cron only queues update_record (a scheduler job,
+# not an API), which holds a site-wide lock, claims due orders in batches of
+# BATCH_SIZE (locking the rows and moving their next_check_at forward before the
+# processor is called) and keeps going until RUN_BUDGET is spent, so overlapping
+# runs never requery the same order.
+#
+# Within a batch the status enquiries run on one thread pool per Integration,
+# sized by its requery_concurrency. Worker threads only do HTTP; this thread
+# reads what the calls need up front and applies the results as they arrive,
+# committing every WRITE_BATCH orders, so a run holds a single DB connection.
+# A call that is still queued in its pool when RUN_BUDGET runs out is not sent
+# (the order waits for its next check), and every commit renews the lock, so a
+# slow batch cannot outlive it.
 
-                    handle_transaction_failure(doc.name, txn_status, txn_status, transaction.name)
+LOCK_KEY = "iswitch:requery_lock"
 
-                    frappe.db.commit()
-        except Exception as e:
-            frappe.db.rollback(save_point = "status_process")
-            frappe.log_error(frappe.get_traceback(), f"Error updating transaction for Order: {result.name}")
+BATCH_SIZE = 200
+WRITE_BATCH = 20
+DEFAULT_CONCURRENCY = 8
+RUN_BUDGET = 50
+# Covers a processor call still in flight when the budget runs out; renewed on every commit
+LOCK_TTL = RUN_BUDGET + 60
 
+FIRST_CHECK_DELAY = 15
+BASE_DELAY = 30
+MAX_DELAY = 60 * 60
+STALE_AFTER = 24 * 60 * 60
+STALE_DELAY = 6 * 60 * 60
+
+
+def schedule_requery():
+    """
+    Cron: queue a requery run unless one is already queued
+    """
+    frappe.enqueue(
+        "iswitch.refetch.update_record",
+        queue="long",
+        job_id="iswitch_requery",
+        deduplicate=True
+    )
 
 
-def handle_transaction_failure(name, status, error_message, transaction_id):
+def first_check_at():
+    return add_to_date(now_datetime(), seconds=FIRST_CHECK_DELAY)
+
+
+def get_next_check_at(attempts, created):
+    """
+    When to check an order again after `attempts` requeries
+    """
+    current = now_datetime()
+    if (current - get_datetime(created)).total_seconds() > STALE_AFTER:
+        return add_to_date(current, seconds=STALE_DELAY)
+    return add_to_date(current, seconds=min(BASE_DELAY * 2 ** attempts, MAX_DELAY))
+
+
+def update_record():
     """
-    Common function to handle transaction failures and refund wallet
+    Requery due orders until the run budget is spent
     """
+    lock = acquire_lock(LOCK_KEY, LOCK_TTL)
+    if not lock:
+        return
+
+    executors = {}
     try:
+        deadline = time.monotonic() + RUN_BUDGET
+        while time.monotonic() < deadline:
+            orders = claim_due_orders(BATCH_SIZE)
+            if orders:
+                requery_orders(orders, executors, deadline, lock)
+                continue
+
+            # Wait for the next order that falls due within this run, if any
+            wait = _seconds_to_next_due()
+            if wait is None or time.monotonic() + wait >= deadline:
+                break
+            time.sleep(max(wait, 1))
+    finally:
+        for executor in executors.values():
+            executor.shutdown(wait=True)
+        release_lock(LOCK_KEY, lock)
 
-        doc = frappe.get_doc("Order", name)
-        frappe.set_user(doc.merchant_ref_id)
 
-        # wallet_row = frappe.db.sql("""
-        #     SELECT balance FROM `tabWallet`
-        #     WHERE name = %s FOR UPDATE
-        # """, (doc.merchant_ref_id,), as_dict=True)
+def claim_due_orders(limit):
+    """
+    Take the next due orders and move their next check forward. Returns the claimed orders.
+    The rows stay locked until the commit, and rows another claim holds are skipped.
+    """
+    orders = frappe.db.sql("""
+        SELECT name, integration_id, merchant_ref_id, requery_attempts, creation
+        FROM `tabOrder`
+        WHERE status IN ('Queued', 'Processing') AND next_check_at <= %s
+        ORDER BY next_check_at
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    """, (now_datetime(), limit), as_dict=True)
 
-        # balance = float(wallet_row[0]["balance"])
-        balance = frappe.db.get_value("Wallet", doc.merchant_ref_id, "balance") or 0.0
-        # Apply balance change safely
+    for order in orders:
         frappe.db.sql("""
-            UPDATE `tabWallet`
-            SET balance = balance + %s
+            UPDATE `tabOrder`
+            SET next_check_at = %s, requery_attempts = requery_attempts + 1
             WHERE name = %s
-        """, (doc.transaction_amount, doc.merchant_ref_id))
-
-        new_balance = float(balance) + float(doc.transaction_amount)
-
-        ledger = frappe.get_doc({
-            "doctype": 'Ledger',
-            "order": doc.name,
-            "transaction_type": 'Credit',
-            'status': 'Reversed',
-            'transaction_id': transaction_id,
-            'client_ref_id': doc.client_ref_id,
-            'opening_balance': balance,
-            'closing_balance': new_balance
-        }).insert(ignore_permissions=True)
-        ledger.submit()
-                
-        
-        doc.status = 'Reversed'
-        doc.cancellation_reason = error_message[:100]
-        doc.cancelled_at = frappe.utils.now()
-        doc.save(ignore_permissions=True)
+        """, (get_next_check_at(order.requery_attempts or 0, order.creation), order.name))
+    frappe.db.commit()
 
-        #frappe.db.commit()
+    return orders
 
-    except Exception as e:
+
+def requery_orders(orders, executors, deadline, lock):
+    """
+    Requery a batch of orders concurrently and apply the results from this thread.
+    Calls that have not started by the deadline are skipped.
+    """
+    crns = _get_crns([order.name for order in orders])
+    processors = {}
+    futures = {}
+
+    for order in orders:
+        call = prepare_requery(order, crns.get(order.name), processors)
+        if not call:
+            continue
+
+        executor = executors.get(order.integration_id)
+        if executor is None:
+            executor = executors[order.integration_id] = ThreadPoolExecutor(
+                max_workers=_get_concurrency(order.integration_id),
+                thread_name_prefix="requery"
+            )
+        futures[executor.submit(_send, call, deadline)] = order
+
+    applied = 0
+    for future in as_completed(futures):
+        order = futures[future]
+        result = future.result()
+        if result is None:
+            continue
+
+        response, elapsed, error = result
+        http_client.record_call(order.integration_id, elapsed, response.status_code if response is not None else None)
+
+        apply_requery_result(order, response, error)
+        applied += 1
+        if applied % WRITE_BATCH == 0:
+            frappe.db.commit()
+            extend_lock(LOCK_KEY, lock, LOCK_TTL)
+    frappe.db.commit()
+    extend_lock(LOCK_KEY, lock, LOCK_TTL)
+
+
+def _send(call, deadline):
+    # Runs on a worker thread; None when the run budget is spent before the call starts
+    if time.monotonic() >= deadline:
+        return None
+    return http_client.send(
+        call.client, "POST", call.url,
+        idempotent=True, headers=call.headers, json=call.payload
+    )
+
+
+def prepare_requery(order, rrn, processors):
+    """
+    Build the status enquiry of an order. None when its processor has no requery.
+    """
+    if order.integration_id != "Airtel Payment Bank":
+        return None
+
+    processor = processors.get(order.integration_id)
+    if processor is None:
+        doc = frappe.get_cached_doc("Integration", order.integration_id)
+        processor = processors[order.integration_id] = frappe._dict({
+            "client": http_client.get_client(doc.name),
+            "url": doc.api_endpoint.rstrip("/") + "/upiMerCollectCheckTxn",
+            "client_id": doc.get_password("client_id"),
+            "secret_key": doc.get_password("secret_key")
+        })
+
+    headers = {
+        "Content-Type": "application/v2+json"
+    }
+
+    payload = {
+        "channel": processor.client_id,
+        "feSessionId": order.name,
+        "hdnOrderID": order.name,
+        "merchantId": processor.client_id,
+        "ver": "2.0",
+        "rrn": rrn
+    }
+    hash_string = get_hash_string(payload, processor.secret_key)
+
+    hash_code = hashlib.sha512(hash_string.encode('utf-8')).hexdigest()
+
+    payload["hash"] = hash_code
+
+    return frappe._dict({
+        "client": processor.client,
+        "url": processor.url,
+        "headers": headers,
+        "payload": payload
+    })
+
+
+def apply_requery_result(order, api_response, error=None):
+    """
+    Move an order to the status its processor reported. Does not commit.
+    """
+    if error is not None:
+        frappe.log_error(f"Error in requery {order.name}", str(error))
+        return
+
+    try:
+        api_data = api_response.json()
+    except Exception:
+        frappe.log_error(f"Error in requery {order.name}", api_response.text)
+        return
+
+    status = api_data.get("txnStatus")
+    if status not in ("SUCCESS", "FAILURE"):
+        return
+
+    frappe.db.savepoint("status_process")
+    try:
+        frappe.set_user(order.merchant_ref_id)
+        if status == "SUCCESS":
+            complete(order.name, remark="Transaction Completed")
+        else:
+            fail(order.name, "Failed transaction", status="Cancelled")
+    except Exception:
         frappe.db.rollback(save_point = "status_process")
-        frappe.log_error("error in handling transaction",str(e))
+        frappe.log_error(frappe.get_traceback(), f"Error updating transaction for Order: {order.name}")
 
 
+def _get_crns(orders):
+    if not orders:
+        return {}
+    rows = frappe.get_all(
+        "Transaction",
+        filters={"order": ["in", orders], "product": ["!=", "FEES AND CHARGES"]},
+        fields=["order", "crn"]
+    )
+    return {row.order: row.crn for row in rows}
+
+
+def _get_concurrency(integration):
+    return frappe.get_cached_doc("Integration", integration).get("requery_concurrency") or DEFAULT_CONCURRENCY
+
+
+def _seconds_to_next_due():
+    next_due = frappe.db.sql("""
+        SELECT MIN(next_check_at)
+        FROM `tabOrder`
+        WHERE status IN ('Queued', 'Processing')
+    """)[0][0]
+    if not next_due:
+        return None
+    return max((get_datetime(next_due) - now_datetime()).total_seconds(), 0)
+
 def get_hash_string(payload, secret_key):
     """
     Dynamically generate hash string from all payload fields.
@@ -0,0 +1,328 @@
+import zlib
+from collections import defaultdict
+
+import frappe
+from frappe.utils import getdate, now
+
+from . import analytics
+
+# Dashboard rollups
+# Dashboards and reports read order and VAN totals from rollup rows instead of
+# aggregating tabOrder / tabVirtual Account Logs on every load:
+#   Order Rollup   per merchant, creation day and status: count, amount, fee, tax
+#   VAN Rollup     per merchant and creation day: submitted log count and amount
+# Every key also has an all-time row (blank day). Dashboards read those, so a
+# dashboard sums a handful of rows however much history there is.
+#
+# Rollups change in the transaction that changes their source: order inserts
+# (after_insert, bulk orders), every status transition of order_state, desk
+# edits of an order and VAN log submission. A change is one
+# INSERT ... ON DUPLICATE KEY UPDATE adding the deltas to the day and all-time
+# rows. Each key is spread over SHARDS rows picked by the source name, so
+# concurrent orders of one merchant rarely wait on the same rollup row.
+#
+# The same changes feed the hourly order analytics buckets (analytics.py).
+#
+# rebuild_rollups recomputes the rows from the source tables (backfill), and
+# check_rollups compares both sides daily (repair=True rebuilds what drifted):
+#   bench --site <site> execute iswitch.rollups.rebuild_rollups
+#   bench --site <site> execute iswitch.rollups.check_rollups --kwargs "{'repair': True}"
+
+SHARDS = 8
+ALL_TIME = "total"
+
+# Amount difference tolerated by the checker (float sums)
+TOLERANCE = 0.01
+
+ORDER_SUMS = ("order_count", "order_amount", "fee", "tax")
+VAN_SUMS = ("log_count", "amount")
+
+
+def record_order(doc, method=None):
+    """
+    Order after_insert: count the new order in its status
+    """
+    add_orders([doc])
+
+
+def add_orders(orders):
+    """
+    Count new orders (docs or dicts with name, creation, merchant_ref_id, status,
+    order_amount, fee and tax)
+    """
+    deltas = defaultdict(lambda: [0, 0.0, 0.0, 0.0])
+    buckets = analytics.new_deltas()
+    for order in orders:
+        _add_order(deltas, order, order.status, 1)
+        analytics.add_order(buckets, order, order.status, 1, created=True)
+    _write_orders(deltas)
+    analytics.write(buckets)
+
+
+def move_order(order, status):
+    """
+    Move an order, as read before its transition, from its status to a new one
+    """
+    deltas = defaultdict(lambda: [0, 0.0, 0.0, 0.0])
+    _add_order(deltas, order, order.status, -1)
+    _add_order(deltas, order, status, 1)
+    _write_orders(deltas)
+
+    buckets = analytics.new_deltas()
+    analytics.add_order(buckets, order, order.status, -1)
+    analytics.add_order(buckets, order, status, 1)
+    analytics.write(buckets)
+
+
+def on_order_update(doc, method=None):
+    """
+    Order on_update: edits saved through the desk
+    """
+    previous = doc.get_doc_before_save()
+    fields = ("status", "order_amount", "fee", "tax", "integration_id", "product")
+    if not previous or all(previous.get(field) == doc.get(field) for field in fields):
+        return
+
+    deltas = defaultdict(lambda: [0, 0.0, 0.0, 0.0])
+    _add_order(deltas, previous, previous.status, -1)
+    _add_order(deltas, doc, doc.status, 1)
+    _write_orders(deltas)
+
+    buckets = analytics.new_deltas()
+    analytics.add_order(buckets, previous, previous.status, -1, created=True)
+    analytics.add_order(buckets, doc, doc.status, 1, created=True)
+    analytics.write(buckets)
+
+
+def record_van_log(doc, method=None):
+    """
+    Virtual Account Logs on_submit: add the log to the rollup of its merchant
+    """
+    add_van_logs([doc])
+
+
+def add_van_logs(logs):
+    deltas = defaultdict(lambda: [0, 0.0])
+    attributes = {}
+    for log in logs:
+        shard = _shard(log.name)
+        for day in (getdate(log.creation), None):
+            key = (log.merchant_email or "", day, shard)
+            deltas[key][0] += 1
+            deltas[key][1] += float(log.amount or 0)
+            attributes[key] = (log.merchant, log.account_number)
+    _write_van_logs(deltas, attributes)
+
+
+def rebuild_rollups(merchant=None):
+    """
+    Recompute the rollup rows from the source tables, one merchant per transaction.
+    The source rows are read with share locks, so transitions of the merchant
+    running meanwhile wait and land on the rebuilt rows.
+    """
+    merchants = [merchant] if merchant else frappe.db.sql("""
+        SELECT DISTINCT merchant_ref_id FROM `tabOrder` WHERE merchant_ref_id IS NOT NULL
+        UNION
+        SELECT DISTINCT merchant FROM `tabOrder Rollup`
+    """, pluck=True)
+    for name in merchants:
+        _rebuild_orders(name)
+        frappe.db.commit()
+
+    emails = [merchant] if merchant else frappe.db.sql("""
+        SELECT DISTINCT COALESCE(merchant_email, '') FROM `tabVirtual Account Logs` WHERE docstatus = 1
+        UNION
+        SELECT DISTINCT merchant_email FROM `tabVAN Rollup`
+    """, pluck=True)
+    for email in emails:
+        _rebuild_van_logs(email)
+        frappe.db.commit()
+
+
+@frappe.whitelist()
+def check_rollups(repair=False):
+    """
+    Compare the rollups with the source tables and log the merchants that drifted.
+    Both sides are read in one transaction, so from the same snapshot.
+    """
+    from .admin_portal_api import check_admin_permission
+
+    check_admin_permission()
+
+    orders = _drift(
+        frappe.db.sql("""
+            SELECT merchant_ref_id AS merchant, status, COUNT(*) AS order_count,
+                SUM(COALESCE(order_amount, 0)) AS order_amount,
+                SUM(COALESCE(fee, 0)) AS fee, SUM(COALESCE(tax, 0)) AS tax
+            FROM `tabOrder`
+            WHERE merchant_ref_id IS NOT NULL
+            GROUP BY merchant_ref_id, status
+        """, as_dict=True),
+        _rollup_sums("Order Rollup", "merchant, status", ORDER_SUMS),
+        ("merchant", "status"), ORDER_SUMS
+    )
+    van_logs = _drift(
+        frappe.db.sql("""
+            SELECT COALESCE(merchant_email, '') AS merchant_email, COUNT(*) AS log_count,
+                SUM(COALESCE(amount, 0)) AS amount
+            FROM `tabVirtual Account Logs`
+            WHERE docstatus = 1
+            GROUP BY COALESCE(merchant_email, '')
+        """, as_dict=True),
+        _rollup_sums("VAN Rollup", "merchant_email", VAN_SUMS),
+        ("merchant_email",), VAN_SUMS
+    )
+
+    report = {"orders": sorted(orders), "van_logs": sorted(van_logs)}
+    if orders or van_logs:
+        frappe.log_error("Dashboard rollup drift", frappe.as_json(report))
+
+    if frappe.utils.cint(repair):
+        for merchant in orders:
+            _rebuild_orders(merchant)
+            frappe.db.commit()
+        for email in van_logs:
+            _rebuild_van_logs(email)
+            frappe.db.commit()
+
+    return report
+
+
+def _add_order(deltas, order, status, sign):
+    if not order.merchant_ref_id:
+        return
+
+    shard = _shard(order.name)
+    for day in (getdate(order.creation), None):
+        row = deltas[(order.merchant_ref_id, day, status, shard)]
+        row[0] += sign
+        row[1] += sign * float(order.order_amount or 0)
+        row[2] += sign * float(order.fee or 0)
+        row[3] += sign * float(order.tax or 0)
+
+
+def _write_orders(deltas):
+    rows = [
+        (_row_name(merchant, day, status, shard), merchant, day, status, shard, *sums)
+        for (merchant, day, status, shard), sums in deltas.items()
+        if any(sums)
+    ]
+    _write("Order Rollup", ("merchant", "day", "status", "shard") + ORDER_SUMS, rows, ORDER_SUMS)
+
+
+def _write_van_logs(deltas, attributes):
+    rows = [
+        (_row_name(email, day, shard), email, day, shard, *attributes[(email, day, shard)], *sums)
+        for (email, day, shard), sums in deltas.items()
+    ]
+    _write(
+        "VAN Rollup", ("merchant_email", "day", "shard", "merchant", "account_number") + VAN_SUMS,
+        rows, VAN_SUMS, ("merchant", "account_number")
+    )
+
+
+def _write(doctype, fields, rows, sums, attributes=()):
+    """
+    Add the sums of rows (name, *fields) to their rollup rows, creating missing ones
+    """
+    if not rows:
+        return
+
+    # Same lock order in every transaction
+    rows.sort(key=lambda row: row[0])
+
+    timestamp = now()
+    user = frappe.session.user
+    columns = ("name", "creation", "modified", "owner", "modified_by") + fields
+    updates = [f"`{field}` = `{field}` + VALUES(`{field}`)" for field in sums]
+    updates += [f"`{field}` = VALUES(`{field}`)" for field in attributes + ("modified",)]
+    placeholders = "(" + ", ".join(["%s"] * len(columns)) + ")"
+
+    frappe.db.sql(f"""
+        INSERT INTO `tab{doctype}` ({", ".join(f"`{column}`" for column in columns)})
+        VALUES {", ".join([placeholders] * len(rows))}
+        ON DUPLICATE KEY UPDATE {", ".join(updates)}
+    """, [value for row in rows for value in (row[0], timestamp, timestamp, user, user, *row[1:])])
+
+
+def _rebuild_orders(merchant):
+    frappe.db.sql("DELETE FROM `tabOrder Rollup` WHERE merchant = %s", merchant)
+    days = frappe.db.sql("""
+        SELECT DATE(creation) AS day, status, COUNT(*) AS order_count,
+            SUM(COALESCE(order_amount, 0)) AS order_amount,
+            SUM(COALESCE(fee, 0)) AS fee, SUM(COALESCE(tax, 0)) AS tax
+        FROM `tabOrder`
+        WHERE merchant_ref_id = %s
+        GROUP BY DATE(creation), status
+        LOCK IN SHARE MODE
+    """, merchant, as_dict=True)
+
+    deltas = defaultdict(lambda: [0, 0.0, 0.0, 0.0])
+    for row in days:
+        for day in (row.day, None):
+            sums = deltas[(merchant, day, row.status, 0)]
+            for i, field in enumerate(ORDER_SUMS):
+                sums[i] += float(row[field] or 0)
+    _write_orders(deltas)
+    analytics.rebuild_buckets(merchant)
+
+
+def _rebuild_van_logs(email):
+    frappe.db.sql("DELETE FROM `tabVAN Rollup` WHERE merchant_email = %s", email)
+    days = frappe.db.sql("""
+        SELECT DATE(creation) AS day, MAX(merchant) AS merchant, MAX(account_number) AS account_number,
+            COUNT(*) AS log_count, SUM(COALESCE(amount, 0)) AS amount
+        FROM `tabVirtual Account Logs`
+        WHERE docstatus = 1 AND COALESCE(merchant_email, '') = %s
+        GROUP BY DATE(creation)
+        LOCK IN SHARE MODE
+    """, email, as_dict=True)
+
+    deltas = defaultdict(lambda: [0, 0.0])
+    attributes = {}
+    for row in days:
+        for day in (row.day, None):
+            key = (email, day, 0)
+            deltas[key][0] += row.log_count
+            deltas[key][1] += float(row.amount or 0)
+            attributes[key] = (row.merchant, row.account_number)
+    _write_van_logs(deltas, attributes)
+
+
+def _rollup_sums(doctype, group_by, sums):
+    """
+    Sums of the day rows and of the all-time rows, per group
+    """
+    return frappe.db.sql(f"""
+        SELECT {group_by}, day IS NULL AS all_time,
+            {", ".join(f"SUM({field}) AS {field}" for field in sums)}
+        FROM `tab{doctype}`
+        GROUP BY {group_by}, day IS NULL
+    """, as_dict=True)
+
+
+def _drift(source, rollups, keys, sums):
+    """
+    First key (merchant) of every group whose day or all-time rollup differs from its source
+    """
+    expected = {tuple(row[key] for key in keys): row for row in source}
+    found = defaultdict(dict)
+    for row in rollups:
+        found[tuple(row[key] for key in keys)][bool(row.all_time)] = row
+
+    drifted = set()
+    for group in set(expected) | set(found):
+        for all_time in (False, True):
+            actual = found.get(group, {}).get(all_time, {})
+            wanted = expected.get(group, {})
+            if any(abs(float(actual.get(field) or 0) - float(wanted.get(field) or 0)) > TOLERANCE for field in sums):
+                drifted.add(group[0])
+    return drifted
+
+
+def _shard(name):
+    return zlib.crc32(name.encode()) % SHARDS
+
+
+def _row_name(*parts):
+    return "|".join(str(part) if part is not None else ALL_TIME for part in parts)
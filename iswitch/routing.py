@@ -0,0 +1,174 @@
+import time
+
+import frappe
+
+from .admin_portal_api import check_admin_permission
+from .pricing import find_slab, get_pricing
+
+# Processor routing
+# Orders go to the merchant's primary Integration unless it is unhealthy for the
+# product, in which case they fail over to the merchant's secondary Integration
+# when that one prices the product and amount. Health is judged from the
+# outcomes of processor calls (http_client reports them here):
+#   - FAILURE_THRESHOLD consecutive failures, or an error rate of MAX_ERROR_RATE
+#     over the window, open the circuit for COOLDOWN_SECONDS
+#   - a p95 latency above the Integration's limit marks it degraded for as long
+# Both states expire on their own; the first call after that is the probe, and a
+# failure re-opens the circuit straight away.
+
+KEY_PREFIX = "iswitch:routing"
+
+WINDOW = 100
+MIN_SAMPLES = 20
+MAX_ERROR_RATE = 0.5
+FAILURE_THRESHOLD = 5
+COOLDOWN_SECONDS = 60
+
+# Health is read from Redis at most this often per worker
+LOCAL_TTL = 2
+
+CIRCUIT_OPEN = "circuit_open"
+DEGRADED = "degraded"
+
+_local_health = {}
+
+
+def choose_integration(context, product, amount):
+    """
+    Pick the Integration for an order.
+    Returns _dict(integration, decision), or None when no configured processor
+    offers the product. integration is None when the primary is down and there is
+    no usable secondary.
+    """
+    primary = context.integration
+    secondary = context.get("secondary_integration")
+
+    primary_offers = product in context.integration_products
+    secondary_offers = bool(secondary) and secondary != primary and bool(
+        find_slab(get_pricing(secondary), product, amount)
+    )
+
+    if not primary_offers and not secondary_offers:
+        return None
+
+    if not primary_offers:
+        return _route(secondary, f"Secondary: {primary} does not offer {product}")
+
+    state = get_health(primary, product)
+    if not state:
+        return _route(primary, "Primary")
+
+    if secondary_offers and get_health(secondary, product) != CIRCUIT_OPEN:
+        reason = "circuit open" if state == CIRCUIT_OPEN else "p95 latency above limit"
+        return _route(secondary, f"Failover from {primary}: {reason}")
+
+    if state == CIRCUIT_OPEN:
+        return _route(None, f"{primary}: circuit open")
+
+    return _route(primary, "Primary (degraded, no secondary available)")
+
+
+def get_health(integration, product):
+    """
+    None when healthy, else CIRCUIT_OPEN or DEGRADED
+    """
+    key = (integration, product)
+    cached = _local_health.get(key)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+
+    cache = frappe.cache()
+    try:
+        circuit, degraded = cache.mget([
+            cache.make_key(_key(CIRCUIT_OPEN, integration, product)),
+            cache.make_key(_key(DEGRADED, integration, product))
+        ])
+    except Exception:
+        circuit = degraded = None
+
+    state = CIRCUIT_OPEN if circuit else DEGRADED if degraded else None
+    _local_health[key] = (time.monotonic() + LOCAL_TTL, state)
+    return state
+
+
+def record_outcome(integration, product, failed, elapsed_ms):
+    """
+    Add a processor call outcome to the rolling window of an Integration and product
+    """
+    cache = frappe.cache()
+    window_key = cache.make_key(_key("window", integration, product))
+    failures_key = cache.make_key(_key("failures", integration, product))
+
+    try:
+        pipeline = cache.pipeline(transaction=False)
+        pipeline.lpush(window_key, f"{int(failed)}:{elapsed_ms}")
+        pipeline.ltrim(window_key, 0, WINDOW - 1)
+        pipeline.lrange(window_key, 0, -1)
+        if failed:
+            pipeline.incr(failures_key)
+        else:
+            pipeline.delete(failures_key)
+        samples, consecutive = pipeline.execute()[2:]
+
+        outcomes = [_parse(sample) for sample in samples]
+        if failed and (consecutive >= FAILURE_THRESHOLD or _error_rate(outcomes) >= MAX_ERROR_RATE):
+            cache.set(cache.make_key(_key(CIRCUIT_OPEN, integration, product)), 1, ex=COOLDOWN_SECONDS)
+
+        limit = _latency_limit(integration)
+        if limit and len(outcomes) >= MIN_SAMPLES and _p95([ms for _failed, ms in outcomes]) > limit:
+            cache.set(cache.make_key(_key(DEGRADED, integration, product)), 1, ex=COOLDOWN_SECONDS)
+    except Exception:
+        # Routing statistics must never fail a processor call
+        pass
+
+
+@frappe.whitelist()
+def get_route_stats(integration, product):
+    """
+    Rolling success rate, p95 latency (ms) and state of an Integration and product
+    """
+    check_admin_permission()
+
+    cache = frappe.cache()
+    samples = cache.lrange(cache.make_key(_key("window", integration, product)), 0, -1) or []
+    outcomes = [_parse(sample) for sample in samples]
+    return frappe._dict({
+        "samples": len(outcomes),
+        "success_rate": sum(1 for failed, _ms in outcomes if not failed) / len(outcomes) if outcomes else None,
+        "p95_ms": _p95([ms for _failed, ms in outcomes]) if outcomes else None,
+        "state": get_health(integration, product)
+    })
+
+
+def _route(integration, decision):
+    return frappe._dict({"integration": integration, "decision": decision})
+
+
+def _key(kind, integration, product):
+    return f"{KEY_PREFIX}:{kind}:{integration}:{product}"
+
+
+def _parse(sample):
+    if isinstance(sample, bytes):
+        sample = sample.decode()
+    failed, elapsed_ms = sample.split(":", 1)
+    return failed == "1", float(elapsed_ms)
+
+
+def _error_rate(outcomes):
+    if len(outcomes) < MIN_SAMPLES:
+        return 0
+    return sum(1 for failed, _ms in outcomes if failed) / len(outcomes)
+
+
+def _p95(latencies):
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+def _latency_limit(integration):
+    try:
+        return frappe.get_cached_doc("Integration", integration).get("latency_limit_ms") or 0
+    except frappe.DoesNotExistError:
+        frappe.clear_last_message()
+        return 0
@@ -0,0 +1,65 @@
+# Copyright (c) 2026, Xettle and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import set_request
+from frappe.utils.password import set_encrypted_password
+
+from iswitch.bank import JSONEncryptionDecryption, bank_login, bank_webhook
+from iswitch.crypto import clear_passphrase
+
+# Bank msgid dedup test
+# Posts the same msgid twice and checks that the repeat gets the encrypted
+# "Duplicate" reply (not an error) and that both requests are logged, with
+# only the first one holding the msgid's dedup_key.
+
+PASSPHRASE = "bank-test-passphrase"
+MSGID = "bank-test-msgid"
+
+
+class TestBank(FrappeTestCase):
+    def setUp(self):
+        set_encrypted_password("Global Config", "Global Config", PASSPHRASE, "passpharse")
+        clear_passphrase()
+
+    def tearDown(self):
+        frappe.db.rollback()
+        clear_passphrase()
+
+    def test_repeated_login_msgid(self):
+        request = {
+            "msgid": MSGID,
+            "reqdata": JSONEncryptionDecryption.encrypt_json({"requestType": "login", "data": {}}, PASSPHRASE)
+        }
+
+        first = _decrypt(_post(bank_login, request))
+        self.assertEqual(first["errorMsg"], "Missing username or password")
+
+        repeat = _decrypt(_post(bank_login, request))
+        self.assertEqual(repeat["errorMsg"], "Duplicate transaction not allowed.")
+
+        self.assertEqual(_remarks(), ["Missing username or password", "Duplicate msgId"])
+        self.assertEqual(frappe.db.count("Bank ReqRes", {"dedup_key": MSGID}), 1)
+
+    def test_rejected_webhook_retried(self):
+        # Rejected requests are logged with their msgid but do not claim it
+        for _attempt in range(2):
+            response = _post(bank_webhook, {"msgId": MSGID, "reqData": ""})
+            self.assertEqual(response["msgId"], MSGID)
+
+        self.assertEqual(_remarks(), ["X-Bank-Auth headers are missing"] * 2)
+        self.assertFalse(frappe.db.exists("Bank ReqRes", {"dedup_key": MSGID}))
+
+
+def _post(method, body):
+    set_request(method="POST", path=f"/api/method/iswitch.bank.{method.__name__}", json=body)
+    return method()
+
+
+def _decrypt(response):
+    return JSONEncryptionDecryption.decrypt_json(response, PASSPHRASE, return_as_dict=True)
+
+
+def _remarks():
+    return frappe.get_all("Bank ReqRes", {"msgid": MSGID}, pluck="remark", order_by="creation, modified")
@@ -0,0 +1,170 @@
+# Copyright (c) 2026, Xettle and Contributors
+# See license.txt
+
+import json
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import flt, set_request
+
+from iswitch import auth_context, bulk_order, pricing
+from iswitch.bulk_order import _process_chunk, create_bulk_orders
+from iswitch.pricing import compile_rows
+from iswitch.tests.utils import clear, insert
+
+# Bulk order tests
+# Upload cells are not always strings (spreadsheets turn bank codes into
+# numbers): a numeric cell must be priced and stored, or rejected on its own
+# row, without failing the rest of the chunk. The endpoint tests post whole
+# batches (NDJSON and JSON) as a merchant and check the per-row results and
+# what the wallet is left with.
+
+SEED_PREFIX = "bulk-test"
+MERCHANT = f"{SEED_PREFIX}-merchant@example.com"
+INTEGRATION = f"{SEED_PREFIX}-integration"
+CLIENT_IP = "10.20.30.40"
+BALANCE = 10000
+
+# Flat 5 fee and 18% tax on it, for every IMPS amount
+PRICING = {"product": "IMPS", "start_value": 0.0, "end_value": 100000.0,
+    "fee_type": "Flat", "fee": 5.0, "tax_fee_type": "Percentage", "tax_fee": 18.0}
+ORDER_TOTAL = 100 + 5 + 0.9
+
+
+class TestBulkOrder(FrappeTestCase):
+    def setUp(self):
+        _clear_seed()
+        self.api_key = frappe.generate_hash(length=15)
+
+        insert("Wallet", [{"name": MERCHANT, "merchant_id": MERCHANT, "status": "Active", "balance": BALANCE}],
+            owner=MERCHANT)
+        insert("User", [{"name": MERCHANT, "email": MERCHANT, "first_name": "Bulk Test", "enabled": 1,
+            "api_key": self.api_key}], owner=MERCHANT)
+        insert("Merchant", [{"name": MERCHANT, "company_email": MERCHANT, "status": "Approved",
+            "integration": INTEGRATION}], owner=MERCHANT)
+        insert("Whitelist IP", [{"name": f"{SEED_PREFIX}-ip", "merchant": MERCHANT, "whitelisted_ip": CLIENT_IP}],
+            owner=MERCHANT)
+        insert("Product Pricing", [
+            dict(PRICING, name=f"{SEED_PREFIX}-{parenttype}", parent=parent, parenttype=parenttype,
+                parentfield="product_pricing")
+            for parent, parenttype in ((MERCHANT, "Merchant"), (INTEGRATION, "Integration"))
+        ], owner=MERCHANT)
+        if not frappe.db.exists("Product", "IMPS"):
+            insert("Product", [{"name": "IMPS", "product_name": "IMPS", "is_active": 1}])
+        frappe.db.commit()
+        frappe.set_user("Administrator")
+
+    def tearDown(self):
+        frappe.set_user("Administrator")
+        frappe.cache().hdel(auth_context.CACHE_KEY, self.api_key)
+        _clear_seed()
+
+    def test_non_string_cells(self):
+        chunk = [
+            (1, _row("1", bank=12345)),
+            (2, _row("2", mode=7)),
+            (3, _row("3", bank="hdfc"))
+        ]
+        results = {result["row"]: result for result in _process_chunk(_context(), chunk, set(), f"{SEED_PREFIX}-hold")}
+
+        self.assertEqual(results[1]["code"], "0x0200")
+        self.assertEqual(results[2]["code"], "0x0500")
+        self.assertEqual(results[3]["code"], "0x0200")
+
+        banks = frappe.get_all("Order", {"merchant_ref_id": MERCHANT}, pluck="bank", order_by="client_ref_id")
+        self.assertEqual(banks, ["12345", "HDFC"])
+
+    def test_ndjson_batch(self):
+        lines = [json.dumps(row) for row in (_row("1"), _row("2"), _row("1"), _row("3", mode="UPI"))]
+        lines.insert(2, "{not json")
+        response = self._post("\n".join(lines) + "\n", "application/x-ndjson")
+
+        self.assertEqual(response["code"], "0x0200")
+        self.assertEqual(response["data"]["accepted"], 2)
+        self.assertEqual(_codes(response["data"]), {1: "0x0200", 2: "0x0200", 3: "0x0203", 4: "0x0203", 5: "0x0404"})
+        self.assertEqual(response["data"]["results"][3]["message"], {"clientRefId": ["Client Ref Id is repeated in this batch."]})
+
+        orders = frappe.get_all("Order", {"merchant_ref_id": MERCHANT}, pluck="client_ref_id", order_by="client_ref_id")
+        self.assertEqual(orders, [f"{SEED_PREFIX}-1", f"{SEED_PREFIX}-2"])
+        self.assertEqual(_balance(), flt(BALANCE - 2 * ORDER_TOTAL, 2))
+
+    def test_json_batch(self):
+        response = self._post(json.dumps({"orders": [_row("1"), _row("2", bank=12345)]}), "application/json")
+
+        self.assertEqual(_codes(response["data"]), {1: "0x0200", 2: "0x0200"})
+        self.assertEqual(_balance(), flt(BALANCE - 2 * ORDER_TOTAL, 2))
+
+    def test_repeat_across_chunks(self):
+        with patch.object(bulk_order, "CHUNK_SIZE", 2):
+            response = self._post(_ndjson(_row("1"), _row("2"), _row("1")), "application/x-ndjson")
+
+        self.assertEqual(_codes(response["data"]), {1: "0x0200", 2: "0x0200", 3: "0x0203"})
+        self.assertEqual(_balance(), flt(BALANCE - 2 * ORDER_TOTAL, 2))
+
+    def test_too_many_rows(self):
+        with patch.object(bulk_order, "MAX_ROWS", 2):
+            response = self._post(_ndjson(_row("1"), _row("2"), _row("3")), "application/x-ndjson")
+
+        # The rows up to the limit are processed, the rest are not
+        self.assertEqual(response["code"], "0x0404")
+        self.assertEqual(_codes(response["batch"]), {1: "0x0200", 2: "0x0200"})
+        self.assertEqual(_balance(), flt(BALANCE - 2 * ORDER_TOTAL, 2))
+
+    def test_failed_insert_releases_hold(self):
+        with patch.object(bulk_order, "_insert_orders", side_effect=Exception("insert failed")):
+            response = self._post(_ndjson(_row("1"), _row("2")), "application/x-ndjson")
+
+        self.assertEqual(_codes(response["data"]), {1: "0x0500", 2: "0x0500"})
+        self.assertFalse(frappe.db.exists("Order", {"merchant_ref_id": MERCHANT}))
+        self.assertEqual(frappe.get_all("Wallet Hold", {"merchant": MERCHANT}, pluck="status"), ["Released"])
+        self.assertEqual(_balance(), BALANCE)
+
+    def _post(self, body, content_type):
+        set_request(
+            method="POST", path="/api/method/bulk_order", data=body, content_type=content_type,
+            headers={"Authorization": f"token {self.api_key}:secret", "X-Real-Ip": CLIENT_IP}
+        )
+        return create_bulk_orders()
+
+
+def _context():
+    return frappe._dict({
+        "merchant": MERCHANT,
+        "user": MERCHANT,
+        "integration": INTEGRATION,
+        "secondary_integration": None,
+        "products": {"IMPS"},
+        "integration_products": {"IMPS"},
+        "pricing": compile_rows([frappe._dict(PRICING)])
+    })
+
+
+def _row(number, mode="IMPS", bank="SBIN"):
+    return {
+        "customer_name": "Test Beneficiary",
+        "accountNo": "000111222333",
+        "ifsc": "SBIN0000001",
+        "bank": bank,
+        "amount": 100,
+        "purpose": "Payout",
+        "mode": mode,
+        "clientRefId": f"{SEED_PREFIX}-{number}"
+    }
+
+
+def _ndjson(*rows):
+    return "\n".join(json.dumps(row) for row in rows)
+
+
+def _codes(batch):
+    return {result["row"]: result["code"] for result in batch["results"]}
+
+
+def _balance():
+    return flt(frappe.db.get_value("Wallet", MERCHANT, "balance"), 2)
+
+
+def _clear_seed():
+    clear(SEED_PREFIX, [MERCHANT])
+    frappe.cache().hdel(pricing.CACHE_KEY, INTEGRATION)
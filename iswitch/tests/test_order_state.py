@@ -0,0 +1,66 @@
+# Copyright (c) 2026, Xettle and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import now_datetime
+
+from iswitch.order_state import fail
+from iswitch.portal_api import get_merchant_ledger
+from iswitch.tests.utils import clear, insert
+
+# Order state machine test
+# Fails and reverses seeded orders as Administrator (as the admin API, the
+# requery job and processor webhooks do) and checks what the merchant gets:
+# the refund in their ledger listing and a webhook for the final status.
+
+SEED_PREFIX = "state-test"
+MERCHANT = f"{SEED_PREFIX}-merchant@example.com"
+ORDER = f"{SEED_PREFIX}-order"
+TRANSACTION = f"{SEED_PREFIX}-transaction"
+
+
+class TestOrderState(FrappeTestCase):
+    def setUp(self):
+        clear(SEED_PREFIX, [MERCHANT])
+        frappe.set_user("Administrator")
+
+    def tearDown(self):
+        frappe.set_user("Administrator")
+        clear(SEED_PREFIX, [MERCHANT])
+
+    def test_refund_belongs_to_merchant(self):
+        _seed(order_status="Processing", transaction_status="Pending", docstatus=0)
+
+        self.assertTrue(fail(ORDER, "Rejected by processor"))
+        owner = frappe.db.get_value("Ledger", {"order": ORDER, "transaction_type": "Credit"}, "owner")
+        self.assertEqual(owner, MERCHANT)
+
+        frappe.set_user(MERCHANT)
+        listing = get_merchant_ledger().get_data(as_text=True)
+        self.assertIn(TRANSACTION, listing)
+
+    def test_reversal_updates_transaction_and_notifies(self):
+        _seed(order_status="Processed", transaction_status="Success", docstatus=1)
+
+        self.assertTrue(fail(ORDER, "Returned by beneficiary bank", status="Reversed", crn="crn-1"))
+        transaction = frappe.db.get_value("Transaction", TRANSACTION, ["status", "remark", "crn"], as_dict=True)
+        self.assertEqual(transaction.status, "Reversed")
+        self.assertEqual(transaction.remark, "Returned by beneficiary bank")
+        self.assertEqual(transaction.crn, "crn-1")
+
+        deliveries = frappe.get_all("Merchant Webhook Delivery", {"transaction": TRANSACTION}, pluck="event_status")
+        self.assertEqual(deliveries, ["Reversed"])
+
+
+def _seed(order_status, transaction_status, docstatus):
+    insert("Merchant", [{"name": MERCHANT, "webhook": "https://merchant.example.com/webhook"}], owner=MERCHANT)
+    insert("Wallet", [{"name": MERCHANT, "merchant_id": MERCHANT, "status": "Active", "balance": 0}], owner=MERCHANT)
+    insert("Order", [{
+        "name": ORDER, "merchant_ref_id": MERCHANT, "client_ref_id": f"{SEED_PREFIX}-client",
+        "status": order_status, "order_amount": 100, "fee": 2, "tax": 0.36, "transaction_amount": 102.36
+    }], owner=MERCHANT)
+    insert("Transaction", [{
+        "name": TRANSACTION, "order": ORDER, "merchant": MERCHANT, "status": transaction_status,
+        "transaction_date": now_datetime(), "amount": 100, "client_ref_id": f"{SEED_PREFIX}-client"
+    }], owner=MERCHANT, docstatus=docstatus)
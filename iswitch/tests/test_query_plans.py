@@ -0,0 +1,185 @@
+# Copyright (c) 2026, Xettle and Contributors
+# See license.txt
+
+import re
+from contextlib import contextmanager
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_to_date, now_datetime
+
+from iswitch import admin_portal_api, merchant_portal_api, portal_api
+from iswitch.bank import claim_msgid
+from iswitch.order_state import _close_transaction
+from iswitch.pagination import encode_cursor
+from iswitch.refetch import BATCH_SIZE, claim_due_orders
+from iswitch.tests.utils import clear, insert
+
+# Query plan regression test
+# Checks that the installed schema carries the hot path indexes (declared by the
+# doctypes, not added by a patch), seeds enough rows for the optimizer to prefer
+# them, then runs the portal, admin, API and requery code, EXPLAINs every SELECT
+# it sends to a hot table and fails when any of them reads with a full scan
+# (EXPLAIN type ALL). The queries are the ones the code builds (filters, keyset
+# cursor condition, count and claim), not copies of them.
+
+SEED_PREFIX = "qp-test"
+MERCHANTS = 50
+ROWS_PER_MERCHANT = 40
+
+MERCHANT = f"{SEED_PREFIX}-merchant-7@example.com"
+START = add_to_date(now_datetime(), days=-30)
+END = now_datetime()
+
+# A row in the middle of MERCHANT's listings, to page on from
+CURSOR = encode_cursor(add_to_date(START, minutes=7 * ROWS_PER_MERCHANT + 20), f"{SEED_PREFIX}-7-20")
+ORDER_CURSOR = encode_cursor(add_to_date(START, minutes=7 * ROWS_PER_MERCHANT + 20), f"{SEED_PREFIX}-order-7-20")
+RECENT = str(add_to_date(START, minutes=MERCHANTS * ROWS_PER_MERCHANT - 20))
+
+HOT_TABLES = re.compile(
+    r"`tab(Order|Transaction|Ledger|Virtual Account Logs|Virtual Account|Bank ReqRes|Customer|Whitelist IP)`"
+)
+
+# label: (user, call)
+CALLS = {
+    "portal: orders": (MERCHANT, lambda: merchant_portal_api.get_orders()),
+    "portal: orders by status and date": (MERCHANT, lambda: merchant_portal_api.get_orders(
+        filter_data={"status": "Processed", "from_date": str(START), "to_date": str(END)}
+    )),
+    "portal: orders, next page": (MERCHANT, lambda: merchant_portal_api.get_orders(cursor=ORDER_CURSOR)),
+    "portal: ledger": (MERCHANT, lambda: merchant_portal_api.get_ledger_entries()),
+    "portal: ledger, next page": (MERCHANT, lambda: merchant_portal_api.get_ledger_entries(cursor=CURSOR)),
+    "portal: ledger (customer portal)": (MERCHANT, lambda: portal_api.get_merchant_ledger(cursor=CURSOR)),
+    "portal: van logs": (MERCHANT, lambda: merchant_portal_api.get_van_logs()),
+    "portal: van logs, next page": (MERCHANT, lambda: merchant_portal_api.get_van_logs(cursor=CURSOR)),
+    "portal: virtual accounts": (MERCHANT, lambda: merchant_portal_api.get_virtual_accounts()),
+    "portal: whitelisted ips": (MERCHANT, lambda: merchant_portal_api.get_whitelist_ips()),
+    "admin: orders": ("Administrator", lambda: admin_portal_api.get_orders()),
+    "admin: orders, next page": ("Administrator", lambda: admin_portal_api.get_orders(cursor=ORDER_CURSOR)),
+    "admin: transactions": ("Administrator", lambda: admin_portal_api.get_transactions()),
+    "admin: van logs": ("Administrator", lambda: admin_portal_api.get_van_logs()),
+    "admin: recent ledger export": ("Administrator", lambda: admin_portal_api.export_ledger_to_excel(
+        filters={"from_date": RECENT}
+    )),
+    "api: bank msgid dedup": ("Administrator", lambda: claim_msgid({}, f"{SEED_PREFIX}-msgid-7-3")),
+    "api: transaction of order": ("Administrator", lambda: _close_transaction(f"{SEED_PREFIX}-no-order", "Success")),
+    # Inline lookups of bank.bank_webhook and order.dispatch_topup, made the same way
+    "api: van utr dedup": ("Administrator", lambda: frappe.db.exists(
+        "Virtual Account Logs", {"utr": f"{SEED_PREFIX}-utr-7-3"}
+    )),
+    "api: customer by mobile": ("Administrator", lambda: frappe.db.get_value(
+        "Customer", {"mobile_number": "9000000007"}, "name"
+    )),
+    "refetch: due orders": ("Administrator", lambda: claim_due_orders(BATCH_SIZE)),
+}
+
+# (doctype, index name) declared in on_doctype_update
+INDEXES = [
+    ("Order", "merchant_creation_index"),
+    ("Order", "merchant_status_creation_index"),
+    ("Order", "creation_index"),
+    ("Order", "status_next_check_index"),
+    ("Transaction", "transaction_date_index"),
+    ("Ledger", "owner_creation_index"),
+    ("Ledger", "creation_index"),
+    ("Virtual Account Logs", "unique_utr"),
+    ("Virtual Account Logs", "owner_creation_index"),
+    ("Virtual Account Logs", "creation_index"),
+    ("Virtual Account", "merchant_creation_index"),
+    ("Bank ReqRes", "msgid_index"),
+    ("Customer", "mobile_number_index"),
+    ("Whitelist IP", "merchant_ip_index"),
+]
+
+
+class TestQueryPlans(FrappeTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        _seed()
+        for table in ("Order", "Transaction", "Ledger", "Virtual Account Logs", "Virtual Account",
+                "Bank ReqRes", "Customer", "Whitelist IP"):
+            frappe.db.sql(f"ANALYZE TABLE `tab{table}`")
+
+    @classmethod
+    def tearDownClass(cls):
+        clear(SEED_PREFIX)
+        super().tearDownClass()
+
+    def test_installed_indexes(self):
+        for doctype, index_name in INDEXES:
+            with self.subTest(index=f"{doctype}.{index_name}"):
+                self.assertTrue(frappe.db.has_index(f"tab{doctype}", index_name))
+
+    def tearDown(self):
+        frappe.set_user("Administrator")
+
+    def test_no_full_scans(self):
+        for label, (user, call) in CALLS.items():
+            with self.subTest(call=label):
+                frappe.set_user(user)
+                with _captured_queries() as queries:
+                    call()
+                self.assertTrue(queries, f"{label}: no query on a hot table")
+
+                for query, values in queries:
+                    plan = frappe.db.sql(f"EXPLAIN {query}", values, as_dict=True)
+                    full_scans = [row.table for row in plan if row.type == "ALL"]
+                    self.assertFalse(full_scans, f"{label}: full scan of {', '.join(full_scans)} in {query}")
+
+
+@contextmanager
+def _captured_queries():
+    """
+    Record the SELECTs on hot tables sent through frappe.db.sql while the block runs
+    """
+    queries = []
+    sql = frappe.db.sql
+
+    def capture(query, values=(), *args, **kwargs):
+        if str(query).lstrip().upper().startswith("SELECT") and HOT_TABLES.search(str(query)):
+            queries.append((str(query), values))
+        return sql(query, values, *args, **kwargs)
+
+    with patch.object(frappe.db, "sql", capture):
+        yield queries
+
+
+def _seed():
+    clear(SEED_PREFIX)
+
+    rows = {doctype: [] for doctype in ("Order", "Transaction", "Ledger", "Virtual Account Logs", "Bank ReqRes",
+        "Merchant", "Virtual Account", "Customer", "Whitelist IP")}
+    for merchant_index in range(MERCHANTS):
+        merchant = f"{SEED_PREFIX}-merchant-{merchant_index}@example.com"
+        for row in range(ROWS_PER_MERCHANT):
+            timestamp = add_to_date(START, minutes=merchant_index * ROWS_PER_MERCHANT + row)
+            order = f"{SEED_PREFIX}-order-{merchant_index}-{row}"
+            msgid = f"{SEED_PREFIX}-msgid-{merchant_index}-{row}"
+            common = {"name": f"{SEED_PREFIX}-{merchant_index}-{row}", "creation": timestamp, "owner": merchant,
+                "docstatus": 1}
+
+            rows["Order"].append({
+                "name": order, "creation": timestamp, "owner": merchant, "merchant_ref_id": merchant,
+                # Most orders are settled; only a few stay open for refetch
+                "status": "Queued" if row == 0 else "Processed",
+                "integration_id": "qp-integration", "client_ref_id": f"{SEED_PREFIX}-client-{merchant_index}-{row}",
+                "next_check_at": timestamp
+            })
+            rows["Transaction"].append(dict(common, order=order, merchant=merchant, status="Success",
+                transaction_date=timestamp, amount=100))
+            rows["Ledger"].append(dict(common, order=order, transaction_type="Debit", status="Success"))
+            rows["Virtual Account Logs"].append(dict(common, utr=f"{SEED_PREFIX}-utr-{merchant_index}-{row}",
+                account_number=f"{SEED_PREFIX}-account-{merchant_index}", merchant=merchant, amount=100))
+            rows["Bank ReqRes"].append(dict(common, msgid=msgid, dedup_key=msgid))
+
+        common = {"name": f"{SEED_PREFIX}-{merchant_index}", "creation": START, "owner": merchant}
+        rows["Merchant"].append({"name": merchant, "creation": START, "owner": merchant, "company_email": merchant})
+        rows["Virtual Account"].append(dict(common, merchant=merchant))
+        rows["Customer"].append(dict(common, mobile_number=f"90000000{merchant_index:02d}"))
+        rows["Whitelist IP"].append(dict(common, merchant=merchant, whitelisted_ip=f"10.0.{merchant_index}.1"))
+
+    for doctype, doctype_rows in rows.items():
+        insert(doctype, doctype_rows)
+    frappe.db.commit()
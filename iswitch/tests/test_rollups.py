@@ -0,0 +1,86 @@
+# Copyright (c) 2026, Xettle and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_to_date, now_datetime
+
+from iswitch.analytics import get_order_analytics
+from iswitch.order_state import start_processing
+from iswitch.rollups import add_orders, check_rollups, move_order, rebuild_rollups
+from iswitch.tests.utils import clear, insert
+
+# Dashboard rollup and analytics consistency test
+# Moves seeded orders through transitions and checks that the rollup rows agree
+# with tabOrder, that check_rollups finds and repairs a change made behind the
+# rollups' back, and that the analytics buckets follow the transitions.
+
+SEED_PREFIX = "rollup-test"
+MERCHANT = f"{SEED_PREFIX}-merchant@example.com"
+ORDERS = 6
+
+INTEGRATION = f"{SEED_PREFIX}-integration"
+
+
+class TestRollups(FrappeTestCase):
+    def setUp(self):
+        clear(SEED_PREFIX, [MERCHANT])
+        _insert_orders(range(ORDERS), days_ago=2)
+        rebuild_rollups(MERCHANT)
+
+    def tearDown(self):
+        clear(SEED_PREFIX, [MERCHANT])
+
+    def test_transitions_keep_rollups_consistent(self):
+        self.assertTrue(start_processing(f"{SEED_PREFIX}-order-0"))
+        self.assertTrue(start_processing(f"{SEED_PREFIX}-order-1"))
+        # A repeated transition is a no-op and must not move the order twice
+        self.assertFalse(start_processing(f"{SEED_PREFIX}-order-1"))
+        add_orders(_insert_orders(range(ORDERS, ORDERS + 2), days_ago=0))
+
+        self.assertNotIn(MERCHANT, check_rollups()["orders"])
+        self.assertEqual(_all_time_counts(), {"Queued": ORDERS, "Processing": 2})
+
+    def test_check_repairs_drift(self):
+        frappe.db.sql("UPDATE `tabOrder` SET status = 'Processed' WHERE name = %s", f"{SEED_PREFIX}-order-2")
+        self.assertIn(MERCHANT, check_rollups()["orders"])
+
+        check_rollups(repair=True)
+        self.assertNotIn(MERCHANT, check_rollups()["orders"])
+        self.assertEqual(_all_time_counts(), {"Queued": ORDERS - 1, "Processed": 1})
+
+    def test_analytics_buckets_follow_transitions(self):
+        orders = frappe.db.sql(
+            "SELECT * FROM `tabOrder` WHERE merchant_ref_id = %s ORDER BY name", MERCHANT, as_dict=True
+        )
+        move_order(orders[0], "Processed")
+        move_order(orders[1], "Cancelled")
+
+        analytics = get_order_analytics(days=3, interval="day", group_by="integration", merchant=MERCHANT)
+        points = analytics["series"][INTEGRATION]
+        self.assertEqual(sum(point["order_count"] for point in points), ORDERS)
+        self.assertEqual(sum(point["success_count"] for point in points), 1)
+        self.assertEqual(sum(point["failure_count"] for point in points), 1)
+        self.assertEqual([point["success_rate"] for point in points], [50.0])
+
+
+def _insert_orders(numbers, days_ago):
+    return insert("Order", [{
+        "name": f"{SEED_PREFIX}-order-{number}",
+        "merchant_ref_id": MERCHANT,
+        "integration_id": INTEGRATION,
+        "status": "Queued",
+        "order_amount": 100,
+        "fee": 2,
+        "tax": 0.36
+    } for number in numbers], creation=add_to_date(now_datetime(), days=-days_ago), owner=MERCHANT)
+
+
+def _all_time_counts():
+    return dict(frappe.db.sql("""
+        SELECT status, SUM(order_count)
+        FROM `tabOrder Rollup`
+        WHERE merchant = %s AND day IS NULL
+        GROUP BY status
+        HAVING SUM(order_count) != 0
+    """, MERCHANT))
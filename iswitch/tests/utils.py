@@ -0,0 +1,75 @@
+# Copyright (c) 2026, Xettle and Contributors
+# See license.txt
+
+import frappe
+from frappe.utils import now_datetime
+
+from iswitch import merchant_webhooks, pricing
+
+# Test fixtures
+# Tests seed their rows with insert (bulk_insert: no doc events, no naming
+# series) under a name prefix of their own, for merchants of their own. Most of
+# the code under test commits, so a rollback cannot undo it: clear deletes the
+# seeded rows and everything the code wrote for those merchants, and commits.
+
+COMMON_FIELDS = ["name", "creation", "modified", "owner", "modified_by", "docstatus"]
+
+# Field holding the merchant of the rows the code under test writes (None: only
+# seeded rows, found by name)
+MERCHANT_FIELDS = {
+    "Order": "merchant_ref_id",
+    "Transaction": "merchant",
+    "Ledger": "owner",
+    "Wallet Hold": "merchant",
+    "Platform Fee Journal": "merchant",
+    "Order Rollup": "merchant",
+    "Order Analytics Bucket": "merchant",
+    "Merchant Webhook Delivery": "merchant",
+    "Virtual Account Logs": "owner",
+    "Virtual Account": "merchant",
+    "Whitelist IP": "merchant",
+    "Product Pricing": "parent",
+    "Bank ReqRes": None,
+    "Customer": None,
+    "Wallet": "name",
+    "Merchant": "name",
+    "User": "name",
+}
+
+
+def insert(doctype, rows, **defaults):
+    """
+    Insert rows (dicts with a name) in one statement, without doc events.
+    creation, owner and docstatus default to now, Administrator and 0 (or to
+    `defaults`); modified and modified_by follow creation and owner.
+    Returns the rows as inserted.
+    """
+    timestamp = now_datetime()
+    rows = [
+        frappe._dict({"creation": timestamp, "owner": "Administrator", "docstatus": 0, **defaults, **row})
+        for row in rows
+    ]
+    for row in rows:
+        row.setdefault("modified", row.creation)
+        row.setdefault("modified_by", row.owner)
+
+    fields = COMMON_FIELDS + [field for field in rows[0] if field not in COMMON_FIELDS]
+    frappe.db.bulk_insert(doctype, fields, [tuple(row[field] for field in fields) for row in rows])
+    return rows
+
+
+def clear(prefix, merchants=()):
+    """
+    Delete the rows seeded under `prefix` and everything written for `merchants`
+    (with their cached webhook endpoint and pricing), and commit
+    """
+    merchants = tuple(merchants)
+    for doctype, field in MERCHANT_FIELDS.items():
+        frappe.db.sql(f"DELETE FROM `tab{doctype}` WHERE name LIKE %s", f"{prefix}-%")
+        if field and merchants:
+            frappe.db.sql(f"DELETE FROM `tab{doctype}` WHERE `{field}` IN %s", [merchants])
+
+    for merchant in merchants:
+        frappe.cache().hdel(merchant_webhooks.CACHE_KEY, merchant)
+        frappe.cache().hdel(pricing.CACHE_KEY, merchant)
+    frappe.db.commit()
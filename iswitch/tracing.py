@@ -0,0 +1,165 @@
+import time
+from bisect import bisect_left
+from functools import wraps
+
+import frappe
+from werkzeug.wrappers import Response
+
+from .admin_portal_api import check_admin_permission
+
+# Hot-path tracing
+# Stages of the order endpoints are wrapped in spans:
+#
+#   with span("create_order", "wallet_hold"):
+#       held = hold_funds(...)
+#
+# Tracing is off unless the site config sets enable_tracing; a disabled span is a
+# shared no-op object, so the instrumented paths pay one config lookup per span.
+# When enabled, durations are added to per-request histograms in memory and
+# written to Redis in one pipeline after the request or job, from where
+# get_metrics serves them in the Prometheus text format.
+
+KEY_PREFIX = "iswitch:trace"
+SERIES_KEY = f"{KEY_PREFIX}:series"
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRIC = "iswitch_stage_duration_seconds"
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    __slots__ = ("endpoint", "stage", "started")
+
+    def __init__(self, endpoint, stage):
+        self.endpoint = endpoint
+        self.stage = stage
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        _record(self.endpoint, self.stage, time.perf_counter() - self.started)
+        return False
+
+
+def is_enabled():
+    return bool(frappe.conf.get("enable_tracing"))
+
+
+def span(endpoint, stage):
+    """
+    Context manager timing one stage of an endpoint
+    """
+    if not is_enabled():
+        return NOOP_SPAN
+    return Span(endpoint, stage)
+
+
+def traced(endpoint):
+    """
+    Decorator timing a whole endpoint as its "total" stage
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not is_enabled():
+                return fn(*args, **kwargs)
+            with Span(endpoint, "total"):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def flush_spans(*args, **kwargs):
+    """
+    after_request / after_job: add the spans of this request to the shared histograms
+    """
+    pending = getattr(frappe.local, "iswitch_spans", None)
+    if not pending:
+        return
+    frappe.local.iswitch_spans = None
+
+    cache = frappe.cache()
+    try:
+        pipeline = cache.pipeline(transaction=False)
+        for (endpoint, stage), (count, total, buckets) in pending.items():
+            key = cache.make_key(f"{KEY_PREFIX}:{endpoint}:{stage}")
+            pipeline.sadd(cache.make_key(SERIES_KEY), f"{endpoint}:{stage}")
+            pipeline.hincrby(key, "count", count)
+            pipeline.hincrbyfloat(key, "sum", total)
+            for index, hits in enumerate(buckets):
+                if hits:
+                    pipeline.hincrby(key, index, hits)
+        pipeline.execute()
+    except Exception:
+        # Tracing must never fail a request
+        pass
+
+
+@frappe.whitelist()
+def get_metrics():
+    """
+    Stage histograms of every traced endpoint, in the Prometheus text format
+    """
+    check_admin_permission()
+
+    cache = frappe.cache()
+    series = sorted(_text(name) for name in cache.smembers(cache.make_key(SERIES_KEY)) or [])
+
+    pipeline = cache.pipeline(transaction=False)
+    for name in series:
+        pipeline.hgetall(cache.make_key(f"{KEY_PREFIX}:{name}"))
+    histograms = pipeline.execute() if series else []
+
+    lines = [
+        f"# HELP {METRIC} Time spent in each stage of an iSwitch endpoint.",
+        f"# TYPE {METRIC} histogram"
+    ]
+    for name, values in zip(series, histograms):
+        endpoint, stage = name.split(":", 1)
+        values = {_text(key): float(value) for key, value in (values or {}).items()}
+        labels = f'endpoint="{endpoint}",stage="{stage}"'
+
+        cumulative = 0
+        for index, bound in enumerate(BUCKETS):
+            cumulative += values.get(str(index), 0)
+            lines.append(f'{METRIC}_bucket{{{labels},le="{bound}"}} {int(cumulative)}')
+        lines.append(f'{METRIC}_bucket{{{labels},le="+Inf"}} {int(values.get("count", 0))}')
+        lines.append(f"{METRIC}_sum{{{labels}}} {values.get('sum', 0)}")
+        lines.append(f"{METRIC}_count{{{labels}}} {int(values.get('count', 0))}")
+
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+
+def _record(endpoint, stage, elapsed):
+    pending = getattr(frappe.local, "iswitch_spans", None)
+    if pending is None:
+        pending = frappe.local.iswitch_spans = {}
+
+    entry = pending.get((endpoint, stage))
+    if entry is None:
+        # count, sum, hits per bucket (the last one is +Inf)
+        entry = pending[(endpoint, stage)] = [0, 0.0, [0] * (len(BUCKETS) + 1)]
+    entry[0] += 1
+    entry[1] += elapsed
+    entry[2][bisect_left(BUCKETS, elapsed)] += 1
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
@@ -1,171 +1,138 @@
 import frappe
-import requests
 import jwt
 import json
 from datetime import datetime as dt, timedelta as td
 import hashlib
 from .bank import JSONEncryptionDecryption
+from .order_state import start_processing, complete, fail, mark_pending
 from frappe.utils import today, getdate
+from . import http_client
+from .tracing import span, traced
 
 
-def handle_transaction_failure(name, status, error_message, transaction_id):
+@traced("handle_transaction")
+def handle_transaction(doc,method):
+    """
+    Ledger on_submit: queue processor dispatch for the order once it has committed.
+    The order request never waits on the processor with its transaction open.
     """
-    Common function to handle transaction failures and refund wallet
+    if doc.transaction_type != "Debit":
+        return
+
+    if frappe.db.get_value("Order", doc.order, "product") != "UPI":
+        return
+
+    with span("handle_transaction", "enqueue"):
+        frappe.enqueue(
+            "iswitch.transaction_processing.dispatch_transaction",
+            queue="short",
+            order=doc.order,
+            transaction_id=doc.transaction_id,
+            enqueue_after_commit=True
+        )
+
+@traced("dispatch_transaction")
+def dispatch_transaction(order, transaction_id):
     """
+    Second phase of an order: call the processor outside any open transaction,
+    then record the outcome in a short transaction of its own. A failed dispatch
+    refunds the merchant.
+    """
+    # Only one worker moves an order out of Queued
+    with span("dispatch_transaction", "start_processing"):
+        if not start_processing(order):
+            return
+        frappe.db.commit()
+
+    doc = frappe.get_doc("Order", order)
+    frappe.set_user(doc.merchant_ref_id)
+
     try:
-        doc = frappe.get_doc("Order", name)
+        with span("dispatch_transaction", "processor_call"):
+            status, remark, utr, crn = upi_transaction_processing(doc)
+    except Exception as e:
+        frappe.db.rollback()
+        frappe.log_error("Error in transaction processing",str(e))
 
-        # wallet_row = frappe.db.sql("""
-        #     SELECT balance FROM `tabWallet`
-        #     WHERE name = %s FOR UPDATE
-        # """, (doc.merchant_ref_id,), as_dict=True)
-        frappe.set_user(doc.merchant_ref_id)
+        try:
+            fail(doc.name, str(e))
+            frappe.db.commit()
+        except Exception as refund_error:
+            frappe.db.rollback()
+            frappe.log_error("Error in handling failed transaction",str(refund_error))
+        return
 
-        balance = frappe.db.get_value("Wallet", doc.merchant_ref_id, "balance") or 0.0
-        
-        # balance = float(wallet_row[0]["balance"]) or 0.0
-        # Apply balance change safely
-        frappe.db.sql("""
-            UPDATE `tabWallet`
-            SET balance = balance + %s
-            WHERE name = %s
-        """, (doc.transaction_amount, doc.merchant_ref_id))
-        
-        new_balance = float(balance) + float(doc.transaction_amount)
-
-        ledger = frappe.get_doc({
-            "doctype": 'Ledger',
-            "order": doc.name,
-            "transaction_type": 'Credit',
-            'status': 'Reversed',
-            'transaction_id': transaction_id,
-            'client_ref_id': doc.client_ref_id,
-            'opening_balance': balance,
-            'closing_balance': new_balance
-        }).insert(ignore_permissions=True)
-        ledger.submit()
-                
-        # Refund Xettle Wallet
-        wallet = frappe.get_single("Xettle Wallet")
-        frappe.db.set_value("Xettle Wallet", None, "tax", float(wallet.tax) - float(doc.tax))
-        frappe.db.set_value("Xettle Wallet", None, "fee", float(wallet.fee) - float(doc.fee))
-        
-        doc.status = status
-        doc.cancellation_reason = error_message[:100]
-        doc.cancelled_at = frappe.utils.now()
-        doc.save(ignore_permissions=True)
+    try:
+        with span("dispatch_transaction", "record_outcome"):
+            record_transaction_outcome(doc, status, remark, utr, crn)
+            frappe.db.commit()
+    except Exception as e:
+        frappe.db.rollback()
+        frappe.log_error("Error in recording transaction outcome",str(e))
+
+def upi_transaction_processing(doc):
+    """
+    Send the collect request to the processor. Reads only, nothing is written here.
+    Returns (status, remark, utr, crn).
+    """
+    processor = frappe.get_doc("Integration", doc.integration_id)
 
-    except Exception as refund_error: 
-        frappe.db.rollback(save_point = "process_transaction")
-        frappe.log_error("Error in handling failed transaction",refund_error)
+    status = "Pending"
+    remark = ""
+    utr = ""
+    crn = ""
+
+    if processor.name == "Airtel Payment Bank":
+        headers = {
+            "Content-Type": "application/v2+json "
+        }
+        
+        payload = {
+            "amount": str(doc.order_amount),
+            "feSessionId": doc.name,
+            "hdnOrderID": doc.name,
+            "mid": processor.get_password("client_id"),
+            "payeeVirtualAdd": "AnshikaFintech@appl",
+            "payerMobNo": "9999999999",
+            "payerVirtualAdd": doc.vpa,
+            "remarks": "Payout",
+            "ver": "2.0"
+        }
+
+        hash_string = get_hash_string(payload, processor.get_password("secret_key"))
+        hash_code = hashlib.sha512(hash_string.encode('utf-8')).hexdigest()
+
+        payload["hash"] = hash_code
+
+        url = processor.api_endpoint.rstrip("/") + "/upiMerCollect"
+        api_response = http_client.post(processor.name, url, headers = headers, json = payload, product = doc.product)
 
-def handle_transaction(doc,method):
-    if doc.transaction_type == "Debit":
         try:
-            transaction = frappe.get_doc("Transaction",doc.transaction_id)
-            order = frappe.get_doc("Order",transaction.order)
-            if order.product =="UPI":
-                upi_transaction_processing(order,transaction)
-                
+            api_data = api_response.json()
+            frappe.log_error("API Response", api_data)
+            crn = api_data.get("rrn")
+            remark = api_data.get("messageText")
+
         except Exception as e:
-            transaction = frappe.get_doc("Transaction", doc.transaction_id)
-            transaction.status = "Failed"
-            transaction.save(ignore_permissions=True)
-            transaction.submit()
+            frappe.log_error("API Response", api_response.text)
 
-            handle_transaction_failure(doc.order,"Cancelled","Failed",transaction.name)
-            frappe.log_error("Error in transaction handling",str(e))
+    return status, remark, utr, crn
 
-def upi_transaction_processing(doc,transaction):
-    try:
-        doc.status = "Processing"
-        doc.save(ignore_permissions=True)
-        
-        frappe.db.savepoint("process_transaction")
+def record_transaction_outcome(doc, status, remark, utr, crn):
+    """
+    Apply a processor outcome to the Order and its Transaction
+    """
+    if status == "Failed":
+        fail(doc.name, remark, crn=crn)
 
-        processor = frappe.get_doc("Integration", doc.integration_id)
-        
-        frappe.set_user(doc.merchant_ref_id)
-
-        status = "Pending"
-        remark = ""
-        utr = ""
-        crn = ""
-
-        if processor.name == "Airtel Payment Bank":
-            headers = {
-                "Content-Type": "application/v2+json "
-            }
-            
-            payload = {
-                "amount": str(doc.order_amount),
-                "feSessionId": doc.name,
-                "hdnOrderID": doc.name,
-                "mid": processor.get_password("client_id"),
-                "payeeVirtualAdd": "AnshikaFintech@appl",
-                "payerMobNo": "9999999999",
-                "payerVirtualAdd": doc.vpa,
-                "remarks": "Payout",
-                "ver": "2.0"
-            }
-
-            hash_string = get_hash_string(payload, processor.get_password("secret_key"))
-            hash_code = hashlib.sha512(hash_string.encode('utf-8')).hexdigest()
-
-            payload["hash"] = hash_code
-
-            url = processor.api_endpoint.rstrip("/") + "/upiMerCollect"
-            api_response = requests.post(url, headers = headers, json = payload, timeout = 30)
-
-            try:
-                api_data = api_response.json()
-                frappe.log_error("API Response", api_data)
-                crn = api_data.get("rrn")
-                remark = api_data.get("messageText")
-
-            except Exception as e:
-                frappe.log_error("API Response", api_response.text)
-            
-        if status == "Failed" or status == "Reversed":
-            txn = frappe.db.get_value("Transaction",{"order":doc.name, "merchant":doc.merchant_ref_id}, ['name'])
-            transaction = frappe.get_doc("Transaction", txn)
-            transaction.status = status
-            transaction.remark = remark
-            transaction.crn = crn
-            transaction.save(ignore_permissions=True)
-            transaction.submit()
-            
-            if status == "Failed":
-                status = "Cancelled"
-
-            handle_transaction_failure(doc.name,status,remark,transaction.name)
-
-        elif status == "Success":
-            txn = frappe.db.get_value("Transaction",{"order":doc.name, "merchant":doc.merchant_ref_id}, ['name'])
-            transaction = frappe.get_doc("Transaction", txn)
-            
-            transaction.status = status
-            transaction.crn = crn
-            transaction.transaction_reference_id = utr
-            transaction.save(ignore_permissions=True)
-            transaction.submit()
-
-            doc.status = "Processed"
-            doc.utr = utr
-            doc.save(ignore_permissions=True)
-        
-        elif status == "Pending":
-            txn = frappe.db.get_value("Transaction",{"order":doc.name, "merchant":doc.merchant_ref_id}, ['name'])
-            transaction = frappe.get_doc("Transaction", txn)
-            
-            transaction.status = status
-            transaction.crn = crn
-            transaction.remark = remark
-            transaction.save(ignore_permissions=True)
-            
-    except Exception as e:
-        frappe.db.rollback(save_point = "process_transaction")
-        frappe.log_error("Error in transaction processing",str(e))
+    elif status == "Reversed":
+        fail(doc.name, remark, status="Reversed", crn=crn)
+
+    elif status == "Success":
+        complete(doc.name, utr=utr, crn=crn)
+
+    elif status == "Pending":
+        mark_pending(doc.name, crn=crn, remark=remark)
 
 
 def get_hash_string(payload, secret_key):
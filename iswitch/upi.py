@@ -1,8 +1,16 @@
 import frappe
-import requests
 import json
 import jwt
 from datetime import datetime as dt, timedelta as td
+from .audit_log import start_request_log, log_response
+from .idempotency import get_replay, claim_request, release_request, remember_response, IN_PROGRESS_RESPONSE
+from .auth_context import get_auth_context, is_ip_allowed, find_pricing
+from .routing import choose_integration
+from .platform_fee import record_fee
+from .wallet_service import hold_funds, capture_hold, release_hold
+from .order import dispatch_topup
+from .order_state import fail
+from .tracing import span, traced
 
 def generate_token(processor):
     try:
@@ -27,7 +35,9 @@ def generate_token(processor):
 
 
 @frappe.whitelist()
+@traced("initiate_upi")
 def initiate_upi():
+    held = None
     try:
         data = frappe.request.get_json()
 
@@ -40,12 +50,7 @@ def initiate_upi():
         
         auth_header = frappe.get_request_header("Authorization")
 
-        request_response = frappe.get_doc({
-            "doctype":"Request Response",
-            "request": data,
-            "header": auth_header,
-            "user": user_id
-        }).insert(ignore_permissions=True)
+        request_response = start_request_log(request=data, header=auth_header, user=user_id)
 
 
         if not auth_header or not auth_header.lower().startswith("token "):
@@ -63,74 +68,70 @@ def initiate_upi():
                 "Error in token format. Please verify and try again."
             }
 
-        user_id = frappe.db.get_value("User", {"api_key": api_key},'email')
+        with span("initiate_upi", "auth"):
+            context = get_auth_context(api_key)
+        user_id = context.user if context else None
         
         frappe.set_user(user_id)
 
-        if not frappe.db.exists("Whitelist IP",{'merchant':user_id,'whitelisted_ip':ip_address}):
+        if not is_ip_allowed(context, ip_address):
             response = {
                 "code": "0x0401",
                 "status": "UNAUTHORIZED ACCESS", 
                 "message": f"Originating IP {ip_address} is blocked by central firewall system. This incident will be reported."
             }
 
-            request_response = frappe.get_doc("Request Response", request_response.name)
-            request_response.response = json.dumps(response)
-            request_response.submit()
+            log_response(request_response, response)
 
             return response
 
-        if user_id == "Guest":
+        if user_id == "Guest" or not context.merchant:
             response = {
                 "code": "0x0401",
                 "status": "UNAUTHORIZED", 
                 "message": "Authentication required"
             }
-            request_response = frappe.get_doc("Request Response", request_response.name)
-            request_response.response = json.dumps(response)
-            request_response.submit()
+            log_response(request_response, response)
             return response
 
-        merchant = frappe.get_doc("Merchant", user_id)
-        if merchant.status != "Approved":
+        if context.merchant_status != "Approved":
             response =  {
                 "code": "0x0404",
                 "status": "VALIDATION_ERROR",
                 "message": "Validation failed",
-                "data": f"Your Account is in {merchant.status} stage. Please contact Admin"
+                "data": f"Your Account is in {context.merchant_status} stage. Please contact Admin"
             }
-            request_response = frappe.get_doc("Request Response", request_response.name)
-            request_response.response = json.dumps(response)
-            request_response.submit()
+            log_response(request_response, response)
             return response 
 
-        if not merchant.integration:
+        if not context.integration:
             response =  {
                 "code": "0x0404",
                 "status": "VALIDATION_ERROR",
                 "message": "Validation failed",
                 "data": "Processor isn't configured yet to process your order. Please try after sometime."
             }
-            request_response = frappe.get_doc("Request Response", request_response.name)
-            request_response.response = json.dumps(response)
-            request_response.submit()
+            log_response(request_response, response)
             return response
 
-        wallet = frappe.get_doc("Wallet", merchant.name)
-        if wallet.status != "Active":
+        if context.wallet_status != "Active":
             response = {
                     "code": "0x0404",
                     "status": "VALIDATION_ERROR",
                     "message": "Validation failed",
-                    "data": f"Your Wallet is {wallet.status}. Please contact Admin"
+                    "data": f"Your Wallet is {context.wallet_status}. Please contact Admin"
                 }
-            request_response = frappe.get_doc("Request Response", request_response.name)
-            request_response.response = json.dumps(response)
-            request_response.submit()
+            log_response(request_response, response)
             return response
+
+        # Retries of an already processed clientRefId get the first response back
+        with span("initiate_upi", "idempotency"):
+            replay = get_replay(context.merchant, data.get("clientRefId"))
+        if replay:
+            log_response(request_response, replay)
+            return replay
         
-        product = frappe.db.exists("Product", {"product_name": data["mode"].upper(), "is_active":1})
-        if not product:
+        if data["mode"].upper() not in context.products:
             response = {
                 "code": "0x0203",
                 "status": "MISSING_PARAMETER",
@@ -140,50 +141,49 @@ def initiate_upi():
                     ] 
                 }
             }
-            request_response = frappe.get_doc("Request Response", request_response.name)
-            request_response.response = json.dumps(response)
-            request_response.submit()
+            log_response(request_response, response)
             return response
 
         order_amount = float(data["amount"])
 
-        product_pricing = frappe.db.sql("""
-            SELECT tax_fee_type, tax_fee, fee_type, fee
-            FROM `tabProduct Pricing`
-            WHERE parent = %s AND product = %s
-            AND %s >= start_value AND %s < end_value
-        """, (merchant.name, data["mode"].upper(), order_amount, order_amount), as_dict=True)
+        with span("initiate_upi", "pricing"):
+            pricing = find_pricing(context, data["mode"].upper(), order_amount, inclusive_end=False)
         
-        if not product_pricing:
+        if not pricing:
             response = {
                 "code": "0x0404",
                 "status": "VALIDATION_ERROR",
                 "message": "Validation failed",
                 "data": "This payment mode or transaction limit is not active for you. Please contact Admin"
             }
-            request_response = frappe.get_doc("Request Response", request_response.name)
-            request_response.response = json.dumps(response)
-            request_response.submit()
+            log_response(request_response, response)
             return response
 
-        processor = frappe.get_doc("Integration", merchant.integration)
-
-        mode_verification = frappe.db.sql("""
-            SELECT tax_fee_type, tax_fee, fee_type, fee
-            FROM `tabProduct Pricing`
-            WHERE parent = %s AND product = %s
-        """, (processor.name, data["mode"].upper()), as_dict=True)
+        # Primary processor, or the secondary while the primary is failing
+        with span("initiate_upi", "routing"):
+            route = choose_integration(context, data["mode"].upper(), order_amount)
 
-        if not mode_verification:
+        if not route:
             response = {
                 "code": "0x0404",
                 "status": "VALIDATION_ERROR",
                 "message": "Validation failed",
                 "data": "This payment mode is not active for now. Please contact Admin"
             }
-            request_response = frappe.get_doc("Request Response", request_response.name)
-            request_response.response = json.dumps(response)
-            request_response.submit()
+            log_response(request_response, response)
+            return response
+
+        if not route.integration:
+            response = {
+                "code": "0x0500",
+                "status": "SERVER_DOWN",
+                "message": {
+                    f"{data['mode']}": [
+                        f"{data['mode']} payment mode is down. Please try again after sometime."
+                    ]
+                }
+            }
+            log_response(request_response, response)
             return response
 
 
@@ -199,28 +199,9 @@ def initiate_upi():
                         ]
                     }
                 }
-                request_response = frappe.get_doc("Request Response", request_response.name)
-                request_response.response = json.dumps(response)
-                request_response.submit()
+                log_response(request_response, response)
                 return response
 
-        existing_order = frappe.db.exists("Order", {"client_ref_id": data["clientRefId"]})
-        if existing_order:
-            response = {
-                "code": "0x0203",
-                "status": "MISSING_PARAMETER",
-                "message": {
-                    "clientRefId": [
-                        "Client Ref Id already exists."
-                    ]
-                }
-            }
-            request_response = frappe.get_doc("Request Response", request_response.name)
-            request_response.response = json.dumps(response)
-            request_response.submit()
-            return response
-
-        pricing = product_pricing[0]
 
         fee = float(pricing.get("fee",0))
         tax = 0
@@ -236,23 +217,22 @@ def initiate_upi():
         # Now all values are floats, safe to add
         total_amount = order_amount + fee + tax
         
-        wallet_row = frappe.db.sql("""
-            SELECT balance FROM `tabWallet`
-            WHERE name = %s FOR UPDATE
-        """, (merchant.name,), as_dict=True)
+        if not claim_request(context.merchant, data["clientRefId"]):
+            log_response(request_response, IN_PROGRESS_RESPONSE)
+            return IN_PROGRESS_RESPONSE
 
-        balance = float(wallet_row[0].balance) or 0.0
+        with span("initiate_upi", "wallet_hold"):
+            held = hold_funds(context.merchant, total_amount, data["clientRefId"])
 
-        if balance < total_amount:
+        if not held:
+            release_request(context.merchant, data["clientRefId"])
             response = {
                 "code": "0x0404",
                 "status": "VALIDATION_ERROR",
                 "message": "Validation failed",
                 "data": "Insufficient wallet balance"
             }
-            request_response = frappe.get_doc("Request Response", request_response.name)
-            request_response.response = json.dumps(response)
-            request_response.submit()
+            log_response(request_response, response)
             return response
 
         customer_id = None
@@ -267,21 +247,8 @@ def initiate_upi():
         else:
             customer_id = frappe.db.get_value("Customer",{"mobile_number":data.get("customer_phone","")},'name')
 
-        
-        new_balance = balance - total_amount
-
-        frappe.db.sql("""
-            UPDATE `tabWallet`
-            SET balance = %s
-            WHERE name = %s
-        """, (new_balance, merchant.name))
-
-        wallet = frappe.get_single("Xettle Wallet")
 
-        frappe.db.set_value("Xettle Wallet", None, "tax", float(wallet.tax) + float(tax))
-        frappe.db.set_value("Xettle Wallet", None, "fee", float(wallet.fee) + float(fee))
-        
-        frappe.db.commit()
+        record_fee(context.merchant, data["clientRefId"], fee, tax)
 
         order = frappe.get_doc({
             "doctype": "Order",
@@ -290,149 +257,95 @@ def initiate_upi():
             "order_amount": order_amount,
             "purpose": data["purpose"],
             "product": "UPI",
-            "merchant_ref_id": merchant.name,
+            "merchant_ref_id": context.merchant,
             "remark": data.get("remark", ""),
             "client_ref_id": data["clientRefId"],
-            "integration_id": processor.name,
+            "routing_decision": route.decision,
+            "integration_id": route.integration,
             "tax": tax,
             "fee": fee,
             "transaction_amount": total_amount
-        }).insert(ignore_permissions=True)
-
-        transaction = frappe.get_doc({
-            "doctype": 'Transaction',
-            "order": order.name,
-            "merchant": order.merchant_ref_id,
-            "amount": order.order_amount,
-            "integration": order.integration_id,
-            "status": "Processing",
-            "product": order.product,
-            "transaction_date": frappe.utils.now()
-        }).insert(ignore_permissions=True)
-
-        ledger = frappe.get_doc({
-            "doctype": 'Ledger',
-            "order": order.name,
-            "transaction_type": 'Debit',
-            'status': 'Success',
-            'client_ref_id': order.client_ref_id,
-            'transaction_id': transaction.name,
-            'opening_balance': balance,
-            'closing_balance': new_balance
-        }).insert(ignore_permissions=True)
-        ledger.submit()
-        
-        frappe.db.commit()
-
-        token = generate_token(processor)
-        headers = {
-            "Api-Key": processor.get_password("client_id"),
-            "Authorization": f"Bearer {token}"
-        }
-
-        payload = {
-            "epin_denomination": order_amount,
-            "external_order_id": order.name,
-            "delivery_details": {
-                "recipient_name": data["customer_name"],
-                "recipient_email": data["customer_email"],
-                "recipient_phone_number": data["customer_phone"],
-                "recipient_player_id": customer_id
+        })
+
+        with span("initiate_upi", "naming"):
+            order.set_new_name()
+        with span("initiate_upi", "order_insert"):
+            order.insert(ignore_permissions=True)
+
+        with span("initiate_upi", "transaction_insert"):
+            transaction = frappe.get_doc({
+                "doctype": 'Transaction',
+                "order": order.name,
+                "merchant": order.merchant_ref_id,
+                "amount": order.order_amount,
+                "integration": order.integration_id,
+                "status": "Processing",
+                "product": order.product,
+                "transaction_date": frappe.utils.now()
+            }).insert(ignore_permissions=True)
+
+        with span("initiate_upi", "ledger_submit"):
+            ledger = frappe.get_doc({
+                "doctype": 'Ledger',
+                "order": order.name,
+                "transaction_type": 'Debit',
+                'status': 'Success',
+                'client_ref_id': order.client_ref_id,
+                'transaction_id': transaction.name,
+                'opening_balance': held.opening_balance,
+                'closing_balance': held.closing_balance
+            }).insert(ignore_permissions=True)
+            ledger.submit()
+
+        with span("initiate_upi", "capture_hold"):
+            capture_hold(held.hold, order.name)
+        with span("initiate_upi", "commit"):
+            frappe.db.commit()
+        held = None
+
+        # Second phase, with no transaction open: the debit has committed, so any
+        # failure from here on is refunded through the state machine
+        with span("initiate_upi", "processor_call"):
+            api_data, error = dispatch_topup(order, data)
+
+        if error:
+            fail(order.name, error)
+            response = {
+                "code": "0x0500",
+                "status": "ERROR",
+                "message": error
             }
+            remember_response(order, response)
+            frappe.db.commit()
+            log_response(request_response, response)
+            return response
+
+        result = {
+            "message": "Order initialized successfully",
+            "payment_url": api_data.get("payment_url", ""),
+            "success_url": api_data.get("success_url", ""),
+            "failed_url": api_data.get("failed_url", ""),
+            "close_url": api_data.get("close_url", "")
         }
-        url = processor.api_endpoint.rstrip("/") + "/transaction/top-up/"
-        frappe.log_error("Headers",headers)
-        response = requests.post(url, headers = headers, json = payload)
-        frappe.log_error("API Response",response.json())
-        if response.status_code == 200:
-            api_response = response.json()
-            data = api_response.get("data",{})
-            if not data:
-                transaction = frappe.get_doc("Transaction",transaction.name)
-                transaction.status = "Failed"
-                transaction.remark = "API returning empty json response"
-                transaction.save(ignore_permissions = True)
-                transaction.submit()
-                handle_transaction_failure(order.name,"Cancelled", "Error in upi transaction processing",transaction.name)
-
-            order = frappe.get_doc("Order",order.name)
-            order.payment_url = data.get("payment_url","")
-            order.success_url = data.get("success_url","")
-            order.failed_url = data.get("failed_url","")
-            order.close_url = data.get("close_url","")
-            order.save(ignore_permissions = True)
-            return {
-                "message": "Order initialized successfully",
-                "payment_url": order.payment_url,
-                "success_url": order.success_url,
-                "failed_url": order.failed_url,
-                "close_url": order.close_url
-            }
+        with span("initiate_upi", "order_update"):
+            frappe.db.set_value("Order", order.name, {
+                "payment_url": result["payment_url"],
+                "success_url": result["success_url"],
+                "failed_url": result["failed_url"],
+                "close_url": result["close_url"]
+            })
+        remember_response(order, result)
+        frappe.db.commit()
+        log_response(request_response, result)
+        return result
 
-        else:
-            transaction = frappe.get_doc("Transaction",transaction.name)
-            transaction.status = "Failed"
-            transaction.remark = "API returning empty json response"
-            transaction.save(ignore_permissions = True)
-            transaction.submit()
-            handle_transaction_failure(order.name,"Cancelled", "Error in upi transaction processing",transaction.name)
-
-    
     except Exception as e:
+        if held:
+            # The order never committed, hand the reserved funds back
+            frappe.db.rollback()
+            release_hold(held.hold)
+            release_request(context.merchant, data["clientRefId"])
         frappe.log_error("Error in upi initilization",str(e))
         return {
             "Error in upi initilization"
         }
-
-
-
-def handle_transaction_failure(name, status, error_message, transaction_id):
-    """
-    Common function to handle transaction failures and refund wallet
-    """
-    try:
-
-        doc = frappe.get_doc("Order", name)
-
-        wallet_row = frappe.db.sql("""
-            SELECT balance FROM `tabWallet`
-            WHERE name = %s FOR UPDATE
-        """, (doc.merchant_ref_id,), as_dict=True)
-
-        frappe.set_user(doc.merchant_ref_id)
-        balance = float(wallet_row[0]["balance"])
-        # Apply balance change safely
-        new_balance = float(wallet_row[0]["balance"]) + float(doc.transaction_amount)
-
-        ledger = frappe.get_doc({
-            "doctype": 'Ledger',
-            "order": doc.name,
-            "transaction_type": 'Credit',
-            'status': 'Reversed',
-            'transaction_id': transaction_id,
-            'client_ref_id': doc.client_ref_id,
-            'opening_balance': balance,
-            "closing_balance": new_balance
-        }).insert(ignore_permissions=True)
-        ledger.submit()
-
-        frappe.db.sql("""
-            UPDATE `tabWallet`
-            SET balance = %s
-            WHERE name = %s
-        """, (new_balance, doc.merchant_ref_id))
-                
-        # Refund Xettle Wallet
-        wallet = frappe.get_single("Xettle Wallet")
-        frappe.db.set_value("Xettle Wallet", None, "tax", float(wallet.tax) - float(doc.tax))
-        frappe.db.set_value("Xettle Wallet", None, "fee", float(wallet.fee) - float(doc.fee))
-        
-        doc.status = status
-        doc.cancellation_reason = error_message[:100]
-        doc.cancelled_at = frappe.utils.now()
-        doc.save(ignore_permissions=True)
-
-        frappe.db.commit()
-
-    except Exception as refund_error: 
-        frappe.log_error("Error",refund_error)
\ No newline at end of file
@@ -0,0 +1,93 @@
+import frappe
+
+
+def after_commit(callback, run_now=False):
+    """
+    Run a callback once the current transaction commits.
+    With run_now the callback also runs immediately (cache invalidation).
+    """
+    if run_now:
+        callback()
+
+    if getattr(frappe.local, "db", None):
+        frappe.db.after_commit.add(callback)
+    elif not run_now:
+        callback()
+
+
+# Deletes the lock only while it still holds the caller's token, so a worker
+# whose lock expired cannot release the one another worker has taken since
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+EXTEND_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("expire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+def acquire_lock(key, timeout):
+    """
+    Take a site-wide Redis lock. Returns the token to release it with,
+    or None if another worker holds it.
+    """
+    cache = frappe.cache()
+    token = frappe.generate_hash(length=20)
+    if cache.set(cache.make_key(key), token, nx=True, ex=timeout):
+        return token
+    return None
+
+
+def release_lock(key, token):
+    cache = frappe.cache()
+    cache.eval(RELEASE_LOCK_SCRIPT, 1, cache.make_key(key), token)
+
+
+def extend_lock(key, token, timeout):
+    """
+    Reset the expiry of a lock the caller still holds. Returns False if it was lost.
+    """
+    cache = frappe.cache()
+    return bool(cache.eval(EXTEND_LOCK_SCRIPT, 1, cache.make_key(key), token, timeout))
+
+
+def add_unique_index(doctype, columns, index_name):
+    """
+    Add a unique index, or a plain one (logging the duplicates) when the
+    columns already hold duplicates
+    """
+    if frappe.db.has_index(f"tab{doctype}", index_name):
+        return
+
+    if _has_duplicates(doctype, columns):
+        frappe.db.add_index(doctype, columns, index_name)
+    else:
+        frappe.db.add_unique(doctype, columns, index_name)
+
+
+def _has_duplicates(doctype, columns):
+    column_list = ", ".join(f"`{column}`" for column in columns)
+    # NULLs never collide in a unique index, empty strings do
+    not_null = " AND ".join(f"`{column}` IS NOT NULL" for column in columns)
+    duplicates = frappe.db.sql(f"""
+        SELECT {column_list}, COUNT(*) AS count
+        FROM `tab{doctype}`
+        WHERE {not_null}
+        GROUP BY {column_list}
+        HAVING COUNT(*) > 1
+        LIMIT 20
+    """, as_dict=True)
+
+    if duplicates:
+        frappe.log_error(
+            f"Duplicate {', '.join(columns)} in {doctype}",
+            "Unique index skipped, a plain index was added instead. Duplicates:\n"
+            + "\n".join(str(row) for row in duplicates)
+        )
+    return bool(duplicates)
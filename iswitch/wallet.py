@@ -1,5 +1,5 @@
 import frappe
-import requests
+from . import http_client
 
 @frappe.whitelist(allow_guest=True)
 def recharge_wallet():
@@ -59,7 +59,7 @@ def get_wallet_balance():
                         "APITOKEN": processor.get_password("secret_key")
                     }
                     url = processor.api_endpoint.rstrip("/") + "/merchants/get/account_getbalance"
-                    response = requests.get(url, headers=headers,timeout = 5)
+                    response = http_client.get(processor.name, url, headers=headers, timeout=5)
                     
                     if response.status_code == 200:
                         api_response = response.json()
@@ -75,7 +75,7 @@ def get_wallet_balance():
                 url = processor.api_endpoint.rstrip("/") + "/balance"
                 api_response = {}
                 try:
-                    response = requests.post(url, json=payload,timeout=5)
+                    response = http_client.post(processor.name, url, json=payload, timeout=5, idempotent=True)
                     api_response = response.json()
                 except Exception as e:
                     frappe.log_error("Error in swavenpay balance fetching", str(e))
@@ -91,7 +91,7 @@ def get_wallet_balance():
                         "merchantID": processor.get_password("client_id"),
                         "secretKey": processor.get_password("secret_key")
                     }
-                    response = requests.get(url, headers=headers,timeout=5)
+                    response = http_client.get(processor.name, url, headers=headers, timeout=5)
                     api_response = response.json()
                     
                 except Exception as e:
@@ -107,7 +107,7 @@ def get_wallet_balance():
                 url = processor.api_endpoint.rstrip("/") + "/balanceCheck"
                 api_response = {}
                 try:
-                    response = requests.get(url, json=payload,timeout=5)
+                    response = http_client.get(processor.name, url, json=payload, timeout=5)
                     api_response = response.json()
                     
                 except Exception as e:
@@ -0,0 +1,140 @@
+import frappe
+from frappe.utils import add_to_date, now_datetime
+
+# Wallet service
+# Every change to a merchant wallet balance goes through this module. Debits and
+# credits are one conditional UPDATE each, so the row is never read, locked and
+# rewritten from Python. Payout orders reserve funds with hold_funds, which debits
+# and commits straight away; the hold is captured in the order's own transaction
+# or released (credited back) if the order does not go through.
+
+# Holds older than this are resolved by release_expired_holds
+HOLD_TIMEOUT_MINUTES = 15
+
+
+def debit(merchant, amount, allow_overdraft=False):
+    """
+    Debit a wallet if it holds at least the amount.
+    Returns {"opening_balance", "closing_balance"}, or None when the wallet is
+    missing or the balance is insufficient.
+    """
+    condition = "" if allow_overdraft else "AND balance >= %(amount)s"
+    return _apply(merchant, -float(amount), condition)
+
+
+def credit(merchant, amount):
+    """
+    Credit a wallet. Returns {"opening_balance", "closing_balance"}, or None when
+    the wallet does not exist.
+    """
+    return _apply(merchant, float(amount))
+
+
+def hold_funds(merchant, amount, client_ref_id):
+    """
+    Reserve funds for a payout order and commit, so the wallet row is not kept
+    locked while the order is created. Returns the debit with the hold name,
+    or None when the balance is insufficient.
+    """
+    movement = debit(merchant, amount)
+    if not movement:
+        return None
+
+    hold = frappe.get_doc({
+        "doctype": "Wallet Hold",
+        "merchant": merchant,
+        "amount": amount,
+        "client_ref_id": client_ref_id,
+        "status": "Held",
+        "opening_balance": movement.opening_balance,
+        "closing_balance": movement.closing_balance
+    }).insert(ignore_permissions=True)
+    frappe.db.commit()
+
+    movement.hold = hold.name
+    return movement
+
+
+def capture_hold(hold, order=None):
+    """
+    Settle a hold against its order, in the caller's transaction
+    """
+    frappe.db.sql("""
+        UPDATE `tabWallet Hold`
+        SET status = 'Captured', `order` = %s, modified = %s
+        WHERE name = %s AND status = 'Held'
+    """, (order, now_datetime(), hold))
+    return bool(frappe.db._cursor.rowcount)
+
+
+def release_hold(hold):
+    """
+    Credit a held amount back to the wallet and commit.
+    Only the first release of a hold moves money.
+    """
+    amount, merchant = frappe.db.get_value("Wallet Hold", hold, ["amount", "merchant"]) or (None, None)
+    frappe.db.sql("""
+        UPDATE `tabWallet Hold`
+        SET status = 'Released', modified = %s
+        WHERE name = %s AND status = 'Held'
+    """, (now_datetime(), hold))
+    if not frappe.db._cursor.rowcount:
+        return None
+
+    movement = credit(merchant, amount)
+    frappe.db.commit()
+    return movement
+
+
+def release_expired_holds():
+    """
+    Resolve holds left behind by a request that died between hold and order commit
+    """
+    holds = frappe.get_all(
+        "Wallet Hold",
+        filters={
+            "status": "Held",
+            "creation": ["<", add_to_date(now_datetime(), minutes=-HOLD_TIMEOUT_MINUTES)]
+        },
+        fields=["name", "merchant", "client_ref_id"]
+    )
+
+    for hold in holds:
+        try:
+            order = frappe.db.get_value(
+                "Order", {"client_ref_id": hold.client_ref_id, "merchant_ref_id": hold.merchant}, "name"
+            )
+            if order:
+                capture_hold(hold.name, order)
+                frappe.db.commit()
+            else:
+                release_hold(hold.name)
+        except Exception as e:
+            frappe.db.rollback()
+            frappe.log_error("Error in releasing wallet hold", f"{hold.name}: {e}")
+
+
+def _apply(merchant, delta, condition=""):
+    if not delta:
+        # MariaDB reports no affected row for an UPDATE that changes nothing
+        balance = frappe.db.get_value("Wallet", merchant, "balance")
+        if balance is None:
+            return None
+        return frappe._dict({"opening_balance": float(balance), "closing_balance": float(balance)})
+
+    # The user variable captures the balance the UPDATE itself read, so the
+    # opening balance needs no separate locking read
+    frappe.db.sql("""
+        UPDATE `tabWallet`
+        SET balance = (@wallet_opening := balance) + %(delta)s
+        WHERE name = %(merchant)s {condition}
+    """.format(condition=condition), {"merchant": merchant, "delta": delta, "amount": -delta})
+
+    if not frappe.db._cursor.rowcount:
+        return None
+
+    opening = float(frappe.db.sql("SELECT @wallet_opening")[0][0] or 0)
+    return frappe._dict({
+        "opening_balance": opening,
+        "closing_balance": opening + delta
+    })
@@ -6,8 +6,12 @@ import base64
 from typing import Dict, Any, Tuple
 from frappe import _
 from frappe.utils import now, get_datetime
+from .order_state import complete, fail
+from .tracing import span, traced
+from . import webhook_queue
 
 @frappe.whitelist(allow_guest=True)
+@traced("blinkpe_webhook")
 def blinkpe_webhook():
     """
     Blinkpe webhook endpoint to handle payment notifications.
@@ -23,13 +27,24 @@ def blinkpe_webhook():
         # Parse JSON payload
         try:
             payload = json.loads(frappe.request.data)
-            webhook = frappe.get_doc({
-                "doctype":"Blinkpe Webhook",
-                "webhook_data":payload,
-                "integration": "Airtel Payment Bank"
-            }).insert(ignore_permissions=True)
-            webhook.submit()
-            frappe.db.commit()
+
+            # Queued events are applied by the drain jobs (webhook_queue)
+            if webhook_queue.is_enabled():
+                with span("blinkpe_webhook", "enqueue"):
+                    webhook_queue.enqueue_webhook("Airtel Payment Bank", payload, frappe.request.data)
+                return {"status": "success", "message": "Webhook received"}
+
+            with span("blinkpe_webhook", "insert"):
+                webhook = frappe.get_doc({
+                    "doctype":"Blinkpe Webhook",
+                    "webhook_data":payload,
+                    "integration": "Airtel Payment Bank"
+                }).insert(ignore_permissions=True)
+            # on_submit applies the status (process_webhook)
+            with span("blinkpe_webhook", "submit"):
+                webhook.submit()
+            with span("blinkpe_webhook", "commit"):
+                frappe.db.commit()
 
             return {"status": "success", "message": "Webhook processed"}
             
@@ -60,7 +75,8 @@ def process_webhook(doc, method):
         payload = json.loads(webhook_response)
 
         if integration == "Airtel Payment Bank":
-            process_airtel_webhook(payload)
+            with span("blinkpe_webhook", "apply_status"):
+                process_airtel_webhook(payload)
 
     except Exception as e:
         frappe.log_error("Error in processing webhook", str(e))
@@ -74,137 +90,42 @@ def process_airtel_webhook(payload: Dict[str, Any]) -> Dict[str, Any]:
         order_id = payload.get("hdnOrderID")
         status = payload.get("txnStatus")
         remark = payload.get("messageText")
-        doc = frappe.get_doc("Order",order_id)
+        merchant = frappe.db.get_value("Order", order_id, "merchant_ref_id")
+        if not merchant:
+            frappe.throw(f"Order {order_id} not found")
 
-        frappe.set_user(doc.merchant_ref_id)
+        frappe.set_user(merchant)
 
-        transaction = frappe.get_doc("Transaction",{"order":order_id})
-        
-        # Process based on status
+        # Repeated callbacks for a settled order change nothing
         if status == "SUCCESS":
-            transaction.status = "Success"
-            transaction.transaction_reference_id = utr
-            transaction.remark = remark
-            transaction.save(ignore_permissions=True)
-            transaction.submit()
-            
-            doc.status = "Processed"
-            doc.utr = utr
-            doc.save(ignore_permissions=True)
-            frappe.db.commit()
-            
-        elif status == "FAILURE":
-            txn_status = "Failed"
-
-            transaction.status = txn_status
-            transaction.remark = remark
-            transaction.save(ignore_permissions=True)
-            transaction.submit()
+            complete(order_id, utr=utr, remark=remark)
 
-            handle_transaction_failure(client_order_id,txn_status,txn_status,transaction.name)
+        elif status == "FAILURE":
+            fail(order_id, remark)
         
     except Exception as e:
+        frappe.db.rollback(save_point = "webhook_process")
         frappe.log_error(f"Error processing webhook: {str(e)}", "Swavenpay Webhook Processing")
         return {"success": False, "error": str(e)}
         
-def handle_transaction_failure(name, status, error_message, transaction_id):
-    """
-    Common function to handle transaction failures and refund wallet
-    """
-    try:
-
-        doc = frappe.get_doc("Order", name)
-
-        frappe.set_user(doc.merchant_ref_id)
-
-        # wallet_row = frappe.db.sql("""
-        #     SELECT balance FROM `tabWallet`
-        #     WHERE name = %s FOR UPDATE
-        # """, (doc.merchant_ref_id,), as_dict=True)
-        balance = frappe.db.get_value("Wallet", doc.merchant_ref_id, "balance") or 0.0
-
-        frappe.db.sql("""
-            UPDATE `tabWallet`
-            SET balance = balance + %s
-            WHERE name = %s
-        """, (doc.transaction_amount, doc.merchant_ref_id))
-        
-        new_balance = float(balance) + float(doc.transaction_amount)
-        
-        ledger = frappe.get_doc({
-            "doctype": 'Ledger',
-            "order": doc.name,
-            "transaction_type": 'Credit',
-            'status': 'Reversed',
-            'transaction_id': transaction_id,
-            'client_ref_id': doc.client_ref_id,
-            'opening_balance': balance,
-            "closing_balance": new_balance
-        }).insert(ignore_permissions=True)
-        ledger.submit()
-                
-        # Refund Xettle Wallet
-        wallet = frappe.get_single("Xettle Wallet")
-        frappe.db.set_value("Xettle Wallet", None, "tax", float(wallet.tax) - float(doc.tax))
-        frappe.db.set_value("Xettle Wallet", None, "fee", float(wallet.fee) - float(doc.fee))
-        
-        doc.status = 'Reversed'
-        doc.cancellation_reason = error_message[:100]
-        doc.cancelled_at = frappe.utils.now()
-        doc.save(ignore_permissions=True)
-
-        #frappe.db.commit()
-
-    except Exception as refund_error: 
-        frappe.db.rollback(save_point = "webhook_process")
-        frappe.log_error("Error",refund_error)
-
 @frappe.whitelist()
 def update_webhook(webhook_url):
     try:
         user = frappe.session.user
         merchant = frappe.get_doc("Merchant", user)
 
-        exists = frappe.db.exists("Webhook", user, cache=True)
-        if not exists:
-            frappe.get_doc({
-                'doctype': 'Webhook',
-                '__newname': user,
-                'webhook_doctype': 'Transaction',
-                'webhook_docevent': 'on_submit',
-                'condition': f"(doc.merchant == '{user}') and (doc.status in ['Success', 'Failed', 'Reversed'])",
-                'request_url': webhook_url,
-                'request_method': 'POST',
-                'request_structure': 'JSON',
-                'background_jobs_queue': 'long',
-                'webhook_json': 
-                """{
-                    "crn":"{{doc.order}}",
-                    "utr":"{{doc.transaction_reference_id}}",
-                    "status": "{{doc.status}}",
-                    "clientRefID": "{{doc.client_ref_id}}"
-                }"""
-            }).insert(ignore_permissions=True)
-
-            merchant.webhook = webhook_url
-            merchant.save(ignore_permissions=True)
-            frappe.db.commit()
-            return {"status": "created"}
-
-        elif merchant.webhook != webhook_url:
-            webhook_doc = frappe.get_doc("Webhook", user)
-            webhook_doc.request_url = webhook_url
-            webhook_doc.save(ignore_permissions=True)
-
-            merchant.webhook = webhook_url
-            merchant.save(ignore_permissions=True)
-            frappe.db.commit()
-            return {"status": "updated"}
-        
-        else:
+        if merchant.webhook == webhook_url:
             # Webhook URL is the same, no update needed
             return {"status": "unchanged"}
 
+        status = "updated" if merchant.webhook else "created"
+
+        # merchant_webhooks delivers to Merchant.webhook
+        merchant.webhook = webhook_url
+        merchant.save(ignore_permissions=True)
+        frappe.db.commit()
+        return {"status": status}
+
     except Exception as e:
         frappe.log_error("Error in webhook updation", str(e))
         return {"status": "error", "message": str(e)}
@@ -232,7 +153,7 @@ def airtelbank():
         
         # Process your webhook data here
         # Example: Create a document, update status, etc.
-        process_webhook(webhook_data)
+        process_airtelbank_webhook(webhook_data)
         
         # Return success response
         return {
@@ -250,7 +171,7 @@ def airtelbank():
             "message": str(e)
         }
 
-def process_webhook(data):
+def process_airtelbank_webhook(data):
     """
     Process the webhook data
     """
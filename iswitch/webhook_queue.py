@@ -0,0 +1,228 @@
+import hashlib
+import json
+import time
+import zlib
+
+import frappe
+from frappe.utils import add_to_date, now, now_datetime
+
+from .admin_portal_api import check_admin_permission
+
+# Inbound webhook queue
+# With queue_inbound_webhooks set in Global Config, a processor callback is
+# stored as a Queued Blinkpe Webhook row (one INSERT, duplicates of the same
+# processor event are ignored through the unique event_id) and acknowledged
+# right away. Drain jobs apply the queued events in batches: rows are claimed
+# with FOR UPDATE SKIP LOCKED, so up to DRAIN_WORKERS jobs drain side by side
+# without taking the same event. A failing event is retried with backoff and
+# parked as Failed after MAX_ATTEMPTS; replay_webhooks queues it again.
+
+# Applies one event payload; returns {"success": False, "error": ...} on failure
+HANDLERS = {
+    "Airtel Payment Bank": "iswitch.webhook.process_airtel_webhook"
+}
+
+BATCH_SIZE = 100
+DRAIN_WORKERS = 4
+DRAIN_BUDGET = 50
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 30
+
+# A claimed event not finished within this long belongs to a crashed drain
+STALLED_AFTER = 10 * 60
+
+
+def is_enabled():
+    return bool(frappe.get_cached_doc("Global Config").get("queue_inbound_webhooks"))
+
+
+def get_event_id(integration, payload, raw=None):
+    """
+    Identify a processor event, so retried deliveries of it are stored once
+    """
+    if integration == "Airtel Payment Bank" and payload.get("hdnOrderID") and payload.get("txnStatus"):
+        key = f"{payload.get('hdnOrderID')}:{payload.get('txnStatus')}:{payload.get('rrn') or ''}"
+    else:
+        key = hashlib.sha256(raw or json.dumps(payload, sort_keys=True).encode()).hexdigest()
+    return f"{integration}:{key}"[:140]
+
+
+def enqueue_webhook(integration, payload, raw=None):
+    """
+    Store a callback for the drain jobs and commit. Returns the event id.
+    """
+    event_id = get_event_id(integration, payload, raw)
+    timestamp = now()
+    user = frappe.session.user
+
+    frappe.db.bulk_insert("Blinkpe Webhook", fields=[
+        "name", "creation", "modified", "owner", "modified_by", "docstatus",
+        "webhook_data", "integration", "event_id", "status", "attempts"
+    ], values=[(
+        frappe.generate_hash(length=10), timestamp, timestamp, user, user, 0,
+        json.dumps(payload), integration, event_id, "Queued", 0
+    )], ignore_duplicates=True)
+    frappe.db.commit()
+
+    _enqueue_drain(zlib.crc32(event_id.encode()) % DRAIN_WORKERS)
+    return event_id
+
+
+def schedule_drain():
+    """
+    Cron: requeue events of crashed drains and start the drain jobs
+    """
+    frappe.db.sql("""
+        UPDATE `tabBlinkpe Webhook`
+        SET status = 'Queued', modified = %s
+        WHERE status = 'Processing' AND modified < %s
+    """, (now(), add_to_date(now_datetime(), seconds=-STALLED_AFTER)))
+    frappe.db.commit()
+
+    for slot in range(DRAIN_WORKERS):
+        _enqueue_drain(slot)
+
+
+def drain_webhooks():
+    """
+    Apply queued events in batches until the queue is empty or the budget is spent
+    """
+    deadline = time.monotonic() + DRAIN_BUDGET
+    while time.monotonic() < deadline:
+        events = _claim(BATCH_SIZE)
+        if not events:
+            break
+
+        for event in events:
+            _apply(event)
+        frappe.db.commit()
+
+
+@frappe.whitelist()
+def replay_webhooks(names=None, status="Failed"):
+    """
+    Queue events again: the given Blinkpe Webhook names, or every event in a status
+    """
+    check_admin_permission()
+
+    values = {"modified": now()}
+    if names:
+        condition = "name IN %(names)s"
+        values["names"] = tuple(frappe.parse_json(names) if isinstance(names, str) else names)
+    else:
+        condition = "status = %(status)s"
+        values["status"] = status
+
+    frappe.db.sql(f"""
+        UPDATE `tabBlinkpe Webhook`
+        SET status = 'Queued', attempts = 0, next_attempt_at = NULL, error = NULL, modified = %(modified)s
+        WHERE {condition} AND docstatus = 0
+    """, values)
+    replayed = frappe.db._cursor.rowcount
+    frappe.db.commit()
+
+    for slot in range(DRAIN_WORKERS):
+        _enqueue_drain(slot)
+    return {"replayed": replayed}
+
+
+@frappe.whitelist()
+def get_queue_stats():
+    """
+    Number of events per status and the age of the oldest queued one
+    """
+    check_admin_permission()
+
+    counts = frappe.db.sql("""
+        SELECT status, COUNT(*)
+        FROM `tabBlinkpe Webhook`
+        WHERE status IN ('Queued', 'Processing', 'Failed')
+        GROUP BY status
+    """)
+    oldest = frappe.db.sql("""
+        SELECT MIN(creation) FROM `tabBlinkpe Webhook` WHERE status = 'Queued'
+    """)[0][0]
+    return {
+        "counts": dict(counts),
+        "oldest_queued": oldest
+    }
+
+
+def _enqueue_drain(slot):
+    frappe.enqueue(
+        "iswitch.webhook_queue.drain_webhooks",
+        queue="short",
+        job_id=f"iswitch_webhook_drain_{slot}",
+        deduplicate=True
+    )
+
+
+def _claim(limit):
+    names = frappe.db.sql("""
+        SELECT name
+        FROM `tabBlinkpe Webhook`
+        WHERE status = 'Queued' AND (next_attempt_at IS NULL OR next_attempt_at <= %s)
+        ORDER BY creation
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    """, (now(), limit), pluck=True)
+    if not names:
+        frappe.db.commit()
+        return []
+
+    frappe.db.sql("""
+        UPDATE `tabBlinkpe Webhook`
+        SET status = 'Processing', attempts = attempts + 1, modified = %s
+        WHERE name IN %s
+    """, (now(), tuple(names)))
+    events = frappe.db.sql("""
+        SELECT name, webhook_data, integration, attempts
+        FROM `tabBlinkpe Webhook`
+        WHERE name IN %s
+        ORDER BY creation
+    """, (tuple(names),), as_dict=True)
+    frappe.db.commit()
+    return events
+
+
+def _apply(event):
+    # Handlers roll back to this savepoint when they fail
+    frappe.db.savepoint("webhook_process")
+    try:
+        handler = HANDLERS.get(event.integration)
+        if not handler:
+            raise Exception(f"No webhook handler for {event.integration}")
+
+        result = frappe.get_attr(handler)(json.loads(event.webhook_data))
+        if isinstance(result, dict) and result.get("success") is False:
+            raise Exception(result.get("error") or "Webhook handler failed")
+    except Exception as e:
+        frappe.db.rollback(save_point="webhook_process")
+        _mark_failed(event, str(e))
+        return
+
+    frappe.db.sql("""
+        UPDATE `tabBlinkpe Webhook`
+        SET status = 'Processed', docstatus = 1, processed_at = %(now)s, modified = %(now)s, error = NULL
+        WHERE name = %(name)s
+    """, {"now": now(), "name": event.name})
+
+
+def _mark_failed(event, error):
+    if event.attempts >= MAX_ATTEMPTS:
+        status, next_attempt_at = "Failed", None
+    else:
+        status = "Queued"
+        next_attempt_at = add_to_date(now_datetime(), seconds=RETRY_DELAY * 2 ** (event.attempts - 1))
+
+    frappe.db.sql("""
+        UPDATE `tabBlinkpe Webhook`
+        SET status = %(status)s, next_attempt_at = %(next_attempt_at)s, error = %(error)s, modified = %(now)s
+        WHERE name = %(name)s
+    """, {
+        "status": status,
+        "next_attempt_at": next_attempt_at,
+        "error": error[:1000],
+        "now": now(),
+        "name": event.name
+    })